@@ -0,0 +1,190 @@
+"""
+Times the main entry points of petutils against a synthetic BIDS PET dataset and compares them with a stored baseline.
+
+    python -m benchmarks.run_benchmarks --subjects 50 --sessions 2 --runs 2
+    python -m benchmarks.run_benchmarks --update-baseline
+
+Each benchmark is run --repeat times and the fastest run is kept. The report is printed (or written to --output) as
+JSON, a benchmark counts as a regression when it is more than --tolerance and more than --min-delta seconds slower
+than the baseline, in which case the exit code is 1. Baselines are only comparable between runs with the same
+parameters on the same machine, otherwise the comparison is skipped. No baseline is shipped, record one with
+--update-baseline on the machine the benchmarks are tracked on.
+"""
+import argparse
+import json
+import os
+import pathlib
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy
+from bids import BIDSLayout
+from bids.layout import BIDSLayoutIndexer
+
+from petutils.petutils import collect_anat_and_pet, check_nifti_json_frame_consistency
+from petutils.scanner import BIDSScanner
+from petutils.compress import zip_nifti
+from petutils.synthetic import generate_dataset, write_nifti
+
+DEFAULT_BASELINE = pathlib.Path(__file__).parent / "baseline.json"
+
+
+def best_of(function, repeat: int, setup=None) -> float:
+    """Runs function repeat times and returns the fastest wall time in seconds, setup is run untimed before each."""
+    timings = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def write_counts_image(nifti_file: pathlib.Path, shape: tuple, seed: int=0) -> pathlib.Path:
+    """
+    Writes a 4D image of Poisson distributed counts, which gzip like noisy PET data. The zero images of
+    generate_dataset compress so quickly that timing them mostly measures noise.
+    """
+    write_nifti(nifti_file, shape)
+    rng = numpy.random.default_rng(seed)
+    with open(nifti_file, "r+b") as f:
+        f.seek(352)
+        for _ in range(shape[3]):
+            f.write(rng.poisson(1000, shape[:3]).astype(numpy.float32).tobytes())
+    return nifti_file
+
+
+def run_benchmarks(dataset: pathlib.Path, workdir: pathlib.Path, repeat: int=3, jobs: int=1, zip_shape: tuple=(32, 32, 16, 21)) -> dict:
+    """Returns benchmark name -> seconds for the dataset, workdir is used for the files zip_nifti compresses."""
+    results = {}
+    results["layout_construction"] = best_of(lambda: BIDSLayout(dataset), repeat)
+    results["layout_construction_no_metadata"] = best_of(
+        lambda: BIDSLayout(dataset, indexer=BIDSLayoutIndexer(index_metadata=False)), repeat)
+    results["scanner_construction"] = best_of(lambda: BIDSScanner(dataset).scan(), repeat)
+
+    layout = BIDSLayout(dataset)
+    scanner = BIDSScanner(dataset)
+    results["collect_anat_and_pet"] = best_of(lambda: collect_anat_and_pet(layout), repeat)
+    results["collect_anat_and_pet_difflib"] = best_of(lambda: collect_anat_and_pet(layout, matcher="difflib"), repeat)
+    results["collect_anat_and_pet_scanner"] = best_of(lambda: collect_anat_and_pet(scanner), repeat)
+    results["check_frame_consistency"] = best_of(lambda: check_nifti_json_frame_consistency(layout, n_jobs=jobs), repeat)
+    results["check_frame_consistency_read_sidecar"] = best_of(
+        lambda: check_nifti_json_frame_consistency(scanner, n_jobs=jobs, read_sidecar=True), repeat)
+    results["check_frame_consistency_deep"] = best_of(
+        lambda: check_nifti_json_frame_consistency(scanner, n_jobs=jobs, read_sidecar=True, deep=True), repeat)
+
+    # zip_nifti replaces its input, so each repeat compresses a fresh copy of the same image
+    source = write_counts_image(workdir / "source_pet.nii", tuple(zip_shape))
+    uncompressed = workdir / "sub-01_pet.nii"
+    results["zip_nifti"] = best_of(lambda: zip_nifti(uncompressed), repeat, setup=lambda: _fresh_copy(source, uncompressed))
+    results["zip_nifti_threads"] = best_of(lambda: zip_nifti(uncompressed, threads=os.cpu_count()), repeat,
+                                           setup=lambda: _fresh_copy(source, uncompressed))
+    return results
+
+
+def _fresh_copy(source, nifti_file):
+    for leftover in (nifti_file, nifti_file.with_name(nifti_file.name + ".gz")):
+        if leftover.exists():
+            leftover.unlink()
+    shutil.copyfile(source, nifti_file)
+
+
+def compare(results: dict, baseline: dict, tolerance: float, min_delta: float=0.0) -> dict:
+    """
+    Compares timings with the baseline's, returns name -> {seconds, baseline, ratio, regression}. A benchmark only
+    regresses when it is both more than tolerance (relative) and more than min_delta seconds slower, so that
+    benchmarks taking a millisecond don't fail on scheduling noise.
+    """
+    comparison = {}
+    for name, seconds in results.items():
+        reference = baseline.get(name)
+        ratio = seconds / reference if reference else None
+        comparison[name] = {
+            "seconds": seconds,
+            "baseline": reference,
+            "ratio": ratio,
+            "regression": ratio is not None and ratio > 1 + tolerance and seconds - reference > min_delta,
+        }
+    return comparison
+
+
+def machine_info() -> dict:
+    return {"python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count()}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark petutils against a synthetic BIDS PET dataset.")
+    parser.add_argument("--subjects", type=int, default=50, help="Number of subjects. Default 50.")
+    parser.add_argument("--sessions", type=int, default=2, help="Sessions per subject. Default 2.")
+    parser.add_argument("--runs", type=int, default=1, help="PET runs per session. Default 1.")
+    parser.add_argument("--frames", type=int, default=21, help="Frames per PET image. Default 21.")
+    parser.add_argument("--image-shape", type=int, nargs=3, default=[16, 16, 16], metavar=("X", "Y", "Z"),
+                        help="Spatial shape of the PET images, raise it to benchmark large payloads. Default 16 16 16.")
+    parser.add_argument("--zip-shape", type=int, nargs=4, default=[32, 32, 16, 21], metavar=("X", "Y", "Z", "T"),
+                        help="Shape of the noisy image the zip_nifti benchmarks compress. Default 32 32 16 21.")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per benchmark, the fastest is kept. Default 3.")
+    parser.add_argument("--jobs", type=int, default=1, help="n_jobs passed to check_nifti_json_frame_consistency. Default 1.")
+    parser.add_argument("--baseline", type=pathlib.Path, default=DEFAULT_BASELINE, help="Baseline JSON to compare against.")
+    parser.add_argument("--update-baseline", action="store_true", help="Store these timings as the new baseline.")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="Slowdown relative to the baseline tolerated before reporting a regression. Default 0.25.")
+    parser.add_argument("--min-delta", type=float, default=0.02,
+                        help="Seconds a benchmark must also slow down by to count as a regression. Default 0.02.")
+    parser.add_argument("--output", type=pathlib.Path, help="Write the JSON report here instead of printing it.")
+    parser.add_argument("--keep", type=pathlib.Path, help="Generate the dataset here and leave it in place.")
+    args = parser.parse_args(argv)
+
+    parameters = {
+        "subjects": args.subjects, "sessions": args.sessions, "runs": args.runs, "frames": args.frames,
+        "image_shape": args.image_shape, "zip_shape": args.zip_shape, "repeat": args.repeat, "jobs": args.jobs,
+    }
+    with tempfile.TemporaryDirectory() as tmpdir:
+        tmpdir = pathlib.Path(tmpdir)
+        dataset = args.keep if args.keep else tmpdir / "dataset"
+        start = time.perf_counter()
+        generate_dataset(dataset, n_subjects=args.subjects, n_sessions=args.sessions, n_runs=args.runs,
+                         n_frames=args.frames, image_shape=tuple(args.image_shape))
+        generation = time.perf_counter() - start
+        workdir = tmpdir / "work"
+        workdir.mkdir()
+        results = run_benchmarks(dataset, workdir, repeat=args.repeat, jobs=args.jobs, zip_shape=args.zip_shape)
+
+    baseline = {}
+    if args.baseline.exists():
+        with open(args.baseline) as f:
+            stored = json.load(f)
+        if stored.get("parameters") != parameters:
+            print(f"Warning: {args.baseline} was recorded with {stored.get('parameters')}, skipping the comparison.",
+                  file=sys.stderr)
+        elif stored.get("machine") != machine_info():
+            print(f"Warning: {args.baseline} was recorded on {stored.get('machine')}, skipping the comparison.",
+                  file=sys.stderr)
+        else:
+            baseline = stored.get("results", {})
+
+    report = {
+        "parameters": parameters,
+        "machine": machine_info(),
+        "generation_seconds": generation,
+        "results": results,
+        "comparison": compare(results, baseline, args.tolerance, args.min_delta),
+    }
+    report["regressions"] = [name for name, entry in report["comparison"].items() if entry["regression"]]
+
+    if args.update_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump({"parameters": parameters, "machine": report["machine"], "results": results}, f, indent=4)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=4)
+    else:
+        print(json.dumps(report, indent=4))
+    return 1 if report["regressions"] and not args.update_baseline else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
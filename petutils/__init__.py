@@ -0,0 +1,56 @@
+"""
+A collection of helper functions, testing fixtures, and generally useful stuff relating to PET and PET BIDS.
+
+The public functions and classes are available from the top level package. Their modules are only imported on first
+access, and pybids (with SQLAlchemy, pandas and nibabel) and numpy only once something needs them, so that e.g.
+`from petutils import zip_nifti` stays cheap in short lived jobs.
+"""
+import importlib
+
+# public name -> submodule it's defined in
+_API = {
+    "get_versions": "petutils",
+    "write_out_dataset_description_json": "petutils",
+    "write_out_dataset_description_jsons": "petutils",
+    "collect_anat_and_pet": "petutils",
+    "iter_anat_and_pet": "petutils",
+    "check_nifti_json_frame_consistency": "petutils",
+    "iter_frame_consistency": "petutils",
+    "read_frame_timing": "petutils",
+    "FrameConsistencyManifest": "petutils",
+    "PETFrameTimingError": "petutils",
+    "zip_nifti": "compress",
+    "zip_nifti_tree": "compress",
+    "parallel_gzip": "compress",
+    "verify_gzipped_nifti": "compress",
+    "verify_nifti_tree": "compress",
+    "ChecksumManifest": "compress",
+    "CompressionVerificationError": "compress",
+    "read_nifti_header": "nifti",
+    "MappedNifti": "nifti",
+    "NiftiHeaderError": "nifti",
+    "get_layout": "layout",
+    "LayoutCache": "layout",
+    "AnatomicalIndex": "matching",
+    "BIDSScanner": "scanner",
+    "FrameConsistencyResult": "results",
+    "FrameConsistencyTable": "results",
+    "validate_frame_timing": "timing",
+    "aiter_frame_consistency": "aio",
+    "check_nifti_json_frame_consistency_async": "aio",
+    "DatasetWatcher": "watch",
+}
+
+__all__ = sorted(_API)
+
+
+def __getattr__(name):
+    if name in _API:
+        value = getattr(importlib.import_module(f".{_API[name]}", __name__), name)
+        globals()[name] = value
+        return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
@@ -0,0 +1,122 @@
+import asyncio
+import pathlib
+import itertools
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Union
+from .petutils import (_load_bids_data, _pet_images, _read_pet_header, _frame_consistency_result, _sidecar_path,
+                       _collect_inconsistent_files, read_frame_timing, FrameConsistencyManifest, _TimingBatch)
+from .sharding import select_shard
+from . import instrumentation
+
+
+async def aiter_frame_consistency(bids_data, subjects: list=[], header_only: bool=True, concurrency: int=64,
+                                  manifest_file: Union[str, pathlib.Path]=None, read_sidecar: bool=False, deep: bool=False,
+                                  shard: tuple=None, timing_batch_size: int=None):
+    """
+    Asynchronous version of iter_frame_consistency for storage where each open or read has a long latency, e.g.
+    network or FUSE mounts. Up to concurrency images are checked at once, the header and the sidecar of an image are
+    read concurrently as well. File access is handed to a pool of concurrency threads, pybids is queried from one
+    thread at a time and only a window of images ahead of the last result is listed, so checking starts as soon as the
+    first images are found. Results are yielded in the same order as iter_frame_consistency and, with deep, are held
+    back until the timings of timing_batch_size images can be validated together, see iter_frame_consistency.
+
+    Parameters
+    ----------
+    concurrency : int, optional
+        Number of images whose files are being read at the same time. The default is 64.
+    timing_batch_size : int, optional
+        Number of images whose timing is validated at once with deep, 1 yields each result as soon as it's checked.
+        The default is None, which uses TIMING_BATCH_SIZE.
+
+    Takes the other arguments of check_nifti_json_frame_consistency.
+    """
+    loop = asyncio.get_running_loop()
+    pool = ThreadPoolExecutor(max_workers=concurrency)
+
+    def run(function, *args):
+        return loop.run_in_executor(pool, function, *args)
+
+    def list_images(bids_data, subjects):
+        bids_data = _load_bids_data(bids_data, index_metadata=not read_sidecar)
+        for subject, entry in _pet_images(bids_data, select_shard(subjects if subjects != [] else bids_data.get_subjects(), shard)):
+            # frame timing left as None is read from the sidecar
+            entities = {} if read_sidecar else entry.entities
+            yield subject, entry.path, entities.get('FrameTimesStart'), entities.get('FrameDuration')
+
+    def next_images(images):
+        return list(itertools.islice(images, concurrency))
+
+    manifest = FrameConsistencyManifest(manifest_file) if manifest_file is not None else None
+    semaphore = asyncio.BoundedSemaphore(concurrency)
+
+    async def check(subject, pet_path, frame_times_start, frame_duration):
+        async with semaphore:
+            fingerprint = None
+            if manifest is not None:
+                fingerprint, recorded = await run(manifest.lookup, pet_path, deep)
+                if recorded is not None:
+                    instrumentation.count("manifest_hit", path=pet_path)
+                    recorded.subject = subject
+                    return None, recorded, None
+            reads = [run(_read_pet_header, pet_path, header_only)]
+            if frame_times_start is None or frame_duration is None:
+                reads.append(run(read_frame_timing, _sidecar_path(pet_path)))
+            header, *sidecar_timing = await asyncio.gather(*reads)
+        if sidecar_timing:
+            frame_times_start = sidecar_timing[0][0] if frame_times_start is None else frame_times_start
+            frame_duration = sidecar_timing[0][1] if frame_duration is None else frame_duration
+        result = _frame_consistency_result(subject, pet_path, header, frame_times_start, frame_duration)
+        if not deep:
+            return fingerprint, result, None
+        # the timing is validated in batches as results are released, see _TimingBatch
+        from .timing import header_frame_duration
+        return fingerprint, result, (frame_times_start, frame_duration, header_frame_duration(header))
+
+    def release(ready):
+        for fingerprint, result in ready:
+            if fingerprint is not None:
+                manifest.record(fingerprint, result, deep=deep)
+            yield result
+
+    # images are listed a chunk at a time and tasks are started a window ahead of the result being yielded, so that
+    # memory doesn't grow with the dataset. the listing is only ever advanced by one thread at a time
+    images = list_images(bids_data, subjects)
+    pending = deque()
+    batch = _TimingBatch(timing_batch_size)
+    try:
+        while chunk := await run(next_images, images):
+            for image in chunk:
+                pending.append(asyncio.ensure_future(check(*image)))
+                if len(pending) >= 2 * concurrency:
+                    for result in release(batch.add(*await pending.popleft())):
+                        yield result
+        while pending:
+            for result in release(batch.add(*await pending.popleft())):
+                yield result
+        for result in release(batch.flush()):
+            yield result
+    finally:
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        if manifest is not None:
+            await run(manifest.save)
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+async def check_nifti_json_frame_consistency_async(bids_data, subjects: list=[], header_only: bool=True, concurrency: int=64,
+                                                   manifest_file: Union[str, pathlib.Path]=None, read_sidecar: bool=False,
+                                                   deep: bool=False, shard: tuple=None, timing_batch_size: int=None) -> dict:
+    """
+    Asynchronous version of check_nifti_json_frame_consistency, returns the same dictionary and raises a
+    PETFrameTimingError in the same cases. See aiter_frame_consistency for concurrency.
+
+        inconsistent_files = asyncio.run(check_nifti_json_frame_consistency_async(bids_dir, concurrency=128))
+    """
+    bids_data = await asyncio.to_thread(_load_bids_data, bids_data, not read_sidecar)
+    all_subjects = select_shard(subjects if subjects != [] else await asyncio.to_thread(bids_data.get_subjects), shard)
+    results = [result async for result in aiter_frame_consistency(
+        bids_data, subjects=subjects, header_only=header_only, concurrency=concurrency, manifest_file=manifest_file,
+        read_sidecar=read_sidecar, deep=deep, shard=shard, timing_batch_size=timing_batch_size)]
+    return _collect_inconsistent_files(results, all_subjects, check_single_subject=len(subjects) == 1)
@@ -0,0 +1,234 @@
+import sys
+import csv
+import json
+import pathlib
+import argparse
+from . import compress
+from .sharding import parse_shard
+
+# petutils validate-frames|map-anat|compress|watch BIDS_DIR [options] or petutils merge PARTIAL..., installed as the petutils script. Modules doing
+# the work are imported inside each command so that `petutils --help` and `petutils compress` don't load pybids.
+
+
+def _load_dataset(args, index_metadata: bool=True):
+    """Returns what the petutils functions should be handed for args.bids_dir given --scanner and --layout-cache."""
+    if not args.bids_dir.is_dir():
+        raise SystemExit(f"petutils: {args.bids_dir} is not a folder.")
+    if args.scanner:
+        from .scanner import BIDSScanner
+        return BIDSScanner(args.bids_dir)
+    if args.layout_cache is not None:
+        from .layout import LayoutCache, get_layout
+        return get_layout(args.bids_dir, index_metadata=index_metadata, cache=LayoutCache(cache_dir=args.layout_cache))
+    return args.bids_dir
+
+
+def _open_output(output):
+    return open(output, "w", newline="") if output is not None else sys.stdout
+
+
+def _add_dataset_arguments(parser):
+    parser.add_argument("bids_dir", type=pathlib.Path, help="Root of the BIDS dataset.")
+    parser.add_argument("--subjects", nargs="+", default=[], metavar="LABEL", help="Subjects to process, defaults to all.")
+    parser.add_argument("--scanner", action="store_true",
+                        help="Find files by their names with petutils.scanner.BIDSScanner instead of indexing with pybids.")
+    parser.add_argument("--layout-cache", type=pathlib.Path, default=None, metavar="DIR",
+                        help="Folder to persist the pybids index in so later runs skip indexing an unchanged dataset.")
+    _add_output_arguments(parser)
+    parser.add_argument("--shard", type=parse_shard, default=None, metavar="i/N",
+                        help="Only process the subjects of shard i (from 0) of N and write a partial result file to "
+                             "--output, combine the partial files of all shards with petutils merge.")
+
+
+def _add_output_arguments(parser):
+    parser.add_argument("--format", choices=("json", "tsv"), default="json", help="Output format. Default json.")
+    parser.add_argument("--output", "-o", type=pathlib.Path, default=None, help="File to write to instead of stdout.")
+
+
+def _check_partial_output(args):
+    if args.shard is not None and args.output is None:
+        raise SystemExit("petutils: --shard needs --output to write the partial result file to.")
+
+
+def _write_frame_results(results, args) -> int:
+    inconsistent = [result for result in results if not result.consistent]
+    reported = results if args.all else inconsistent
+
+    from .results import FrameConsistencyTable
+    f = _open_output(args.output)
+    try:
+        if args.format == "tsv":
+            FrameConsistencyTable.from_results(reported).to_csv(f, delimiter="\t")
+        else:
+            json.dump([dict(result.to_dict(), consistent=result.consistent, errors=result.errors) for result in reported], f, indent=4)
+            f.write("\n")
+    finally:
+        if f is not sys.stdout:
+            f.close()
+    return 1 if inconsistent else 0
+
+
+def _write_mapping(pairs, args) -> int:
+    f = _open_output(args.output)
+    try:
+        if args.format == "tsv":
+            writer = csv.writer(f, delimiter="\t")
+            writer.writerow(("subject", "pet", "anat"))
+            writer.writerows(pairs)
+        else:
+            mapping = {}
+            for subject, pet_file, anat_file in pairs:
+                mapping.setdefault(subject, {})[pet_file] = anat_file
+            json.dump(mapping, f, indent=4)
+            f.write("\n")
+    finally:
+        if f is not sys.stdout:
+            f.close()
+    return 0
+
+
+def validate_frames(args) -> int:
+    """Checks frame timing of every PET image, prints the inconsistent ones (all with --all), exits 1 if any."""
+    from .petutils import iter_frame_consistency, _load_bids_data
+    from .sharding import select_shard, write_partial
+
+    _check_partial_output(args)
+    bids_data = _load_dataset(args, index_metadata=not args.read_sidecar)
+    results = list(iter_frame_consistency(
+        bids_data, subjects=args.subjects, header_only=not args.full_load, n_jobs=args.jobs, executor=args.executor,
+        manifest_file=args.cache, read_sidecar=args.read_sidecar or args.scanner, deep=args.deep, shard=args.shard))
+    if args.shard is None:
+        return _write_frame_results(results, args)
+
+    bids_data = _load_bids_data(bids_data, index_metadata=not args.read_sidecar)
+    subjects = select_shard(args.subjects if args.subjects != [] else bids_data.get_subjects(), args.shard)
+    write_partial(args.output, "frame_consistency", args.shard, subjects, results)
+    return 0 if all(result.consistent for result in results) else 1
+
+
+def map_anat(args) -> int:
+    """Prints the anatomical image paired with each PET image, '' where none was found."""
+    from .petutils import iter_anat_and_pet, collect_anat_and_pet
+    from .sharding import write_partial
+
+    _check_partial_output(args)
+    bids_data = _load_dataset(args)
+    if args.shard is None:
+        return _write_mapping(iter_anat_and_pet(bids_data, suffixes=args.suffixes, subjects=args.subjects, matcher=args.matcher), args)
+
+    mapping = collect_anat_and_pet(bids_data, suffixes=args.suffixes, subjects=args.subjects, matcher=args.matcher, shard=args.shard)
+    write_partial(args.output, "anat_and_pet", args.shard, list(mapping), mapping)
+    return 0
+
+
+def merge(args) -> int:
+    """Combines the partial result files of every shard into the output of the unsharded command."""
+    from .sharding import read_partials, ShardMergeError
+
+    try:
+        kind, subjects, results = read_partials(args.partials)
+    except ShardMergeError as err:
+        raise SystemExit(f"petutils: {err}")
+    if kind == "frame_consistency":
+        return _write_frame_results(results, args)
+    return _write_mapping(((subject, pet, anat) for subject in subjects for pet, anat in results[subject].items()), args)
+
+
+def watch(args) -> int:
+    """Compresses and validates PET images as they arrive, printing a JSON line for each, until interrupted."""
+    from .watch import DatasetWatcher
+
+    if not args.bids_dir.is_dir():
+        raise SystemExit(f"petutils: {args.bids_dir} is not a folder.")
+    out = open(args.output, "a") if args.output is not None else sys.stdout
+
+    def report(event):
+        if event["result"] is not None:
+            result = event["result"]
+            event = dict(event, result=dict(result.to_dict(), consistent=result.consistent, errors=result.errors))
+        out.write(json.dumps(event) + "\n")
+        out.flush()
+
+    watcher = DatasetWatcher(args.bids_dir, compress=not args.no_compress, validate=not args.no_validate, deep=args.deep,
+                             debounce=args.debounce, jobs=args.jobs, compresslevel=args.level,
+                             process_existing=args.process_existing, on_event=report)
+    polls = iter(range(args.polls)) if args.polls is not None else None
+    try:
+        watcher.run(interval=args.interval, stop=None if polls is None else lambda: next(polls, None) is None)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    return 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="petutils", description="Utilities for PET BIDS datasets.")
+    commands = parser.add_subparsers(dest="command", required=True, metavar="command")
+
+    validate = commands.add_parser("validate-frames", help="Check PET headers against the frame timing of their sidecars.",
+                                   description="Check the number of frames in each PET header against FrameTimesStart and "
+                                               "FrameDuration in its sidecar. Exits with 1 if any image is inconsistent.")
+    _add_dataset_arguments(validate)
+    validate.add_argument("--jobs", "-j", type=int, default=None, help="Images checked at once, defaults to the number of cpus.")
+    validate.add_argument("--executor", choices=("thread", "process"), default="thread", help="Kind of worker pool. Default thread.")
+    validate.add_argument("--cache", type=pathlib.Path, default=None, metavar="FILE",
+                          help="JSON file of previous results, only images or sidecars changed since are checked again.")
+    validate.add_argument("--read-sidecar", action="store_true",
+                          help="Read frame timing from each image's own sidecar rather than pybids' metadata index.")
+    validate.add_argument("--deep", action="store_true", help="Also validate the timing values, e.g. gaps and overlaps.")
+    validate.add_argument("--full-load", action="store_true", help="Load images with nibabel rather than reading only the header.")
+    validate.add_argument("--all", action="store_true", help="Report consistent images as well.")
+    validate.set_defaults(function=validate_frames)
+
+    mapping = commands.add_parser("map-anat", help="Pair each PET image with an anatomical image.",
+                                  description="Pair each PET image with an anatomical image. Mapping runs on a single "
+                                              "thread and takes no --jobs or --cache: its time goes to layout queries, which "
+                                              "petutils keeps on one thread, and matching is a few dictionary lookups per "
+                                              "image. Use --shard to spread a large dataset over several processes.")
+    _add_dataset_arguments(mapping)
+    mapping.add_argument("--suffixes", nargs="+", default=["T1w", "T2w"], help="Anatomical suffixes in order of preference.")
+    mapping.add_argument("--matcher", choices=("entities", "difflib"), default="entities", help="Matching strategy. Default entities.")
+    mapping.set_defaults(function=map_anat)
+
+    zipping = commands.add_parser("compress", help="Gzip every uncompressed .nii file in a BIDS dataset in place.",
+                                  description="Gzip every uncompressed .nii file in a BIDS dataset in place.")
+    compress.add_arguments(zipping)
+    zipping.set_defaults(function=compress.run)
+
+    watching = commands.add_parser("watch", help="Compress and validate PET images as they arrive in a BIDS dataset.",
+                                   description="Poll a BIDS dataset and gzip and validate each PET image and sidecar pair "
+                                               "that arrives or changes, printing a JSON line per pair. Files already "
+                                               "present are left alone unless --process-existing is given.")
+    watching.add_argument("bids_dir", type=pathlib.Path, help="Root of the BIDS dataset.")
+    watching.add_argument("--interval", type=float, default=1.0, help="Seconds between polls. Default 1.")
+    watching.add_argument("--debounce", type=float, default=2.0,
+                          help="Seconds a file must stay unchanged before it's processed. Default 2.")
+    watching.add_argument("--jobs", "-j", type=int, default=1, help="Pairs processed at once. Default 1.")
+    watching.add_argument("--level", type=int, default=9, choices=range(1, 10), metavar="{1-9}", help="gzip compression level. Default 9.")
+    watching.add_argument("--no-compress", action="store_true", help="Don't gzip new .nii images.")
+    watching.add_argument("--no-validate", action="store_true", help="Don't check new images against their sidecars.")
+    watching.add_argument("--deep", action="store_true", help="Also validate the timing values, e.g. gaps and overlaps.")
+    watching.add_argument("--process-existing", action="store_true", help="Process the files present at start as well.")
+    watching.add_argument("--polls", type=int, default=None, help="Stop after this many polls, runs until interrupted by default.")
+    watching.add_argument("--output", "-o", type=pathlib.Path, default=None, help="File to append to instead of stdout.")
+    watching.set_defaults(function=watch)
+
+    merging = commands.add_parser("merge", help="Combine the partial result files of a run split with --shard.",
+                                  description="Combine the partial result files of every shard of a validate-frames or "
+                                              "map-anat run into the output of the unsharded command.")
+    merging.add_argument("partials", nargs="+", type=pathlib.Path, help="Partial result files, one per shard.")
+    _add_output_arguments(merging)
+    merging.add_argument("--all", action="store_true", help="Report consistent images as well (validate-frames only).")
+    merging.set_defaults(function=merge)
+    return parser
+
+
+def main(argv=None) -> int:
+    args = build_parser().parse_args(argv)
+    return args.function(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,427 @@
+import os
+import sys
+import gzip
+import zlib
+import time
+import shutil
+import json
+import struct
+import hashlib
+import pathlib
+import threading
+import argparse
+import tempfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from . import instrumentation
+from .scanner import BIDSScanner
+
+# deflate can refer back at most 32 KiB, this much of the previous chunk is used to prime the next chunk's compressor
+DEFLATE_WINDOW_SIZE = 32 * 1024
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+
+
+class CompressionVerificationError(Exception):
+    """Raised when the decompressed contents of a gzipped nifti don't match the checksum of the original file."""
+    pass
+
+
+class _HashingReader:
+    """Wraps a binary stream and updates a hash with every byte read through it."""
+
+    def __init__(self, stream, hasher):
+        self.stream = stream
+        self.hasher = hasher
+        self.size = 0
+
+    def read(self, size=-1):
+        data = self.stream.read(size)
+        self.hasher.update(data)
+        self.size += len(data)
+        return data
+
+
+def checksum_gzip(gz_file, chunk_size: int=DEFAULT_CHUNK_SIZE):
+    """
+    Decompresses a gzipped file as a stream and returns the sha256 hex digest and size of its contents. Only one
+    chunk is held in memory at a time, gzip's own CRC and length checks are applied once the end is reached.
+    """
+    hasher = hashlib.sha256()
+    size = 0
+    with gzip.open(gz_file, 'rb') as f:
+        for data in iter(lambda: f.read(chunk_size), b''):
+            hasher.update(data)
+            size += len(data)
+    return hasher.hexdigest(), size
+
+
+class ChecksumManifest:
+    """
+    JSON file recording the sha256 and size of the uncompressed contents of verified .nii.gz files, along with the
+    size and modification time of the .nii.gz when it was verified. A file whose size and modification time are
+    unchanged doesn't need to be decompressed again. Paths are stored relative to the folder of the manifest.
+    Safe to record into from several threads, call save to write it out.
+    """
+
+    def __init__(self, manifest_file):
+        self.manifest_file = pathlib.Path(manifest_file)
+        self._lock = threading.Lock()
+        try:
+            with open(self.manifest_file) as f:
+                self.entries = json.load(f)
+        except FileNotFoundError:
+            self.entries = {}
+
+    def _key(self, gz_file):
+        return os.path.relpath(os.path.abspath(gz_file), self.manifest_file.parent.absolute())
+
+    def get(self, gz_file):
+        return self.entries.get(self._key(gz_file))
+
+    def is_verified(self, gz_file) -> bool:
+        entry = self.get(gz_file)
+        if entry is None or not os.path.exists(gz_file):
+            return False
+        stat = os.stat(gz_file)
+        return entry["gz_size"] == stat.st_size and entry["gz_mtime_ns"] == stat.st_mtime_ns
+
+    def record(self, gz_file, sha256: str, size: int):
+        stat = os.stat(gz_file)
+        with self._lock:
+            self.entries[self._key(gz_file)] = {"sha256": sha256, "size": size, "gz_size": stat.st_size, "gz_mtime_ns": stat.st_mtime_ns}
+
+    def save(self):
+        """Writes the manifest to a temporary file and renames it over the previous manifest."""
+        from .petutils import _write_json_atomically
+        with self._lock:
+            self.manifest_file.parent.mkdir(parents=True, exist_ok=True)
+            _write_json_atomically(self.manifest_file, self.entries, indent=4, sort_keys=True)
+
+
+def verify_gzipped_nifti(gz_file, manifest: ChecksumManifest=None) -> str:
+    """
+    Checks that a .nii.gz decompresses cleanly and, if the manifest holds a checksum for it, that its contents match.
+    Files the manifest already lists as verified and unchanged are skipped without being read.
+
+    return : str
+        The sha256 of the uncompressed contents.
+    """
+    if manifest is not None and manifest.is_verified(gz_file):
+        return manifest.get(gz_file)["sha256"]
+    sha256, size = checksum_gzip(gz_file)
+    if manifest is not None:
+        entry = manifest.get(gz_file)
+        if entry is not None and (entry["sha256"], entry["size"]) != (sha256, size):
+            raise CompressionVerificationError(f"Contents of {gz_file} don't match the checksum recorded in {manifest.manifest_file}")
+        manifest.record(gz_file, sha256, size)
+    return sha256
+
+
+def _gzip_header(filename=None, mtime=None, level=9):
+    """Builds a gzip member header (RFC 1952), the original filename is stored like gzip.open does."""
+    flags = 0
+    fname = b''
+    if filename:
+        flags = 0x08
+        fname = os.path.basename(filename).encode('latin-1', errors='replace') + b'\x00'
+    if mtime is None:
+        mtime = int(time.time())
+    # extra flags signal maximum (2) or fastest (4) compression
+    xfl = 2 if level == 9 else (4 if level == 1 else 0)
+    return b'\x1f\x8b\x08' + bytes([flags]) + struct.pack('<I', mtime & 0xffffffff) + bytes([xfl, 255]) + fname
+
+
+def _deflate_chunk(chunk, dictionary, level, last):
+    """Compresses one chunk into a raw deflate fragment, the fragments of consecutive chunks can be concatenated."""
+    if dictionary:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS, zlib.DEF_MEM_LEVEL, zlib.Z_DEFAULT_STRATEGY, dictionary)
+    else:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    # a sync flush ends the fragment on a byte boundary without marking the final block, only the last chunk finishes
+    return compressor.compress(chunk) + compressor.flush(zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)
+
+
+def parallel_gzip(infile, outfile, threads: int=None, level: int=9, chunk_size: int=DEFAULT_CHUNK_SIZE, filename: str=None):
+    """
+    Gzips the binary stream infile into the binary stream outfile using a pool of threads, in the manner of pigz.
+    The input is split into chunks that are compressed independently (each primed with the last 32 KiB of the
+    chunk before it so compression ratio is barely affected) and written out in order as a single standard gzip
+    member, readable by gzip, zlib and nibabel.
+
+    Parameters
+    ----------
+    infile : binary file object
+        Stream to read the uncompressed data from.
+    outfile : binary file object
+        Stream the gzipped data is written to.
+    threads : int, optional
+        Number of compression threads, None uses all available cpus. The default is None.
+    level : int, optional
+        Compression level from 1 (fastest) to 9 (smallest). The default is 9, the same as gzip.open.
+    chunk_size : int, optional
+        Number of uncompressed bytes handed to each thread at once. At most 2 * threads chunks are held in memory.
+        The default is 1 MiB.
+    filename : str, optional
+        Original file name to record in the gzip header.
+    return : int
+        Number of uncompressed bytes read.
+    """
+    if threads is None:
+        threads = os.cpu_count() or 1
+    if threads < 1:
+        raise ValueError(f"threads must be at least 1, given {threads}.")
+    if chunk_size < 1:
+        raise ValueError(f"chunk_size must be positive, given {chunk_size}.")
+
+    outfile.write(_gzip_header(filename=filename, level=level))
+    crc = 0
+    size = 0
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        dictionary = b''
+        chunk = infile.read(chunk_size)
+        while True:
+            # read one chunk ahead so that we know which chunk is the last one
+            next_chunk = infile.read(chunk_size) if chunk else b''
+            last = not next_chunk
+            crc = zlib.crc32(chunk, crc)
+            size += len(chunk)
+            pending.append(pool.submit(_deflate_chunk, chunk, dictionary, level, last))
+            if last:
+                break
+            dictionary = chunk[-DEFLATE_WINDOW_SIZE:]
+            chunk = next_chunk
+            # bound the memory in use by writing out finished chunks once enough are in flight
+            while len(pending) >= 2 * threads:
+                outfile.write(pending.popleft().result())
+        while pending:
+            outfile.write(pending.popleft().result())
+    outfile.write(struct.pack('<II', crc & 0xffffffff, size & 0xffffffff))
+    return size
+
+
+def zip_nifti(nifti_file, threads: int=1, compresslevel: int=9, chunk_size: int=DEFAULT_CHUNK_SIZE, verify: bool=False, manifest: ChecksumManifest=None):
+    """
+    Zips an un-gzipped nifti file and removes the original file.
+
+    The gzipped file is written to a temporary file next to the original and renamed into place once complete, the
+    original is only removed after that. If the process dies part way through there is never a truncated .nii.gz
+    and the original .nii is still present.
+
+    Parameters
+    ----------
+    nifti_file : str
+        Path to the .nii file, paths already ending in .gz are returned as is.
+    threads : int, optional
+        Number of threads to compress with, values other than 1 compress blocks of the file in parallel (see
+        parallel_gzip) and None uses all available cpus. The default is 1.
+    compresslevel : int, optional
+        gzip compression level from 1 (fastest) to 9 (smallest). The default is 9.
+    chunk_size : int, optional
+        Size in bytes of the blocks compressed by each thread when threads is not 1. The default is 1 MiB.
+    verify : bool, optional
+        Checksum the original while it is compressed and decompress the result as a stream to check that it matches
+        before the original is removed, a CompressionVerificationError is raised otherwise. The default is False.
+    manifest : ChecksumManifest, optional
+        Manifest to record the checksum of the verified file in, the caller is responsible for saving it.
+    return : str
+        Path to the gzipped file.
+    """
+    if str(nifti_file).endswith('.gz'):
+        return nifti_file
+    else:
+        nifti_file = str(nifti_file)
+        directory, name = os.path.split(nifti_file)
+        temporary = tempfile.NamedTemporaryFile(dir=directory or '.', prefix=f".{name}.", suffix=".gz.tmp", delete=False)
+        try:
+            with open(nifti_file, 'rb') as infile, temporary as outfile, \
+                    instrumentation.stage("gzip", path=nifti_file, bytes=os.fstat(infile.fileno()).st_size, threads=threads):
+                if verify:
+                    infile = _HashingReader(infile, hashlib.sha256())
+                if threads == 1:
+                    with gzip.GzipFile(filename=name, mode='wb', compresslevel=compresslevel, fileobj=outfile) as gzipped:
+                        shutil.copyfileobj(infile, gzipped)
+                else:
+                    parallel_gzip(infile, outfile, threads=threads, level=compresslevel, chunk_size=chunk_size, filename=name)
+                outfile.flush()
+                os.fsync(outfile.fileno())
+            if verify:
+                sha256, size = checksum_gzip(temporary.name, chunk_size=chunk_size)
+                if (sha256, size) != (infile.hasher.hexdigest(), infile.size):
+                    raise CompressionVerificationError(f"Decompressed contents of {nifti_file}.gz don't match the original, the original was kept.")
+            # temporary files are created private, give the result the permissions of the original
+            os.chmod(temporary.name, os.stat(nifti_file).st_mode & 0o777)
+            os.replace(temporary.name, nifti_file + '.gz')
+        except BaseException:
+            if os.path.exists(temporary.name):
+                os.remove(temporary.name)
+            raise
+        if verify and manifest is not None:
+            manifest.record(nifti_file + '.gz', sha256, size)
+        os.remove(nifti_file)
+        return nifti_file + '.gz'
+
+
+def _find_files(bids_data, extension: str) -> list:
+    if isinstance(bids_data, BIDSScanner):
+        # a scanner only indexes some datatypes, the whole dataset it was built for is walked instead
+        bids_data = bids_data.root
+    elif hasattr(bids_data, "get") and hasattr(bids_data, "root"):
+        return sorted(bids_data.get(extension=extension, return_type="filename"))
+    if not os.path.isdir(bids_data):
+        raise TypeError(f"{bids_data} must be a BIDSLayout, a BIDSScanner or an existing folder, given type: {type(bids_data)}.")
+    found = []
+    for root, folders, files in os.walk(bids_data):
+        folders[:] = [f for f in folders if not f.startswith('.')]
+        found.extend(os.path.join(root, file) for file in files if file.endswith(f'.{extension}') and not file.startswith('.'))
+    return sorted(found)
+
+
+def find_uncompressed_niftis(bids_data) -> list:
+    """
+    Lists every .nii file in a BIDS dataset.
+
+    Parameters
+    ----------
+    bids_data : Union[pathlib.Path, str, BIDSLayout, BIDSScanner]
+        A folder, which is walked skipping hidden folders, or a BIDSLayout whose indexed files are used. The root of
+        a BIDSScanner is walked like a folder.
+    return : list
+        Sorted paths of the uncompressed nifti files.
+    """
+    return _find_files(bids_data, "nii")
+
+
+def find_gzipped_niftis(bids_data) -> list:
+    """Lists every .nii.gz file in a BIDS dataset, see find_uncompressed_niftis."""
+    return _find_files(bids_data, "nii.gz")
+
+
+def zip_nifti_tree(bids_data, jobs: int=None, threads: int=1, compresslevel: int=9, chunk_size: int=DEFAULT_CHUNK_SIZE, max_memory: int=None,
+                   verify: bool=False, manifest_file=None) -> dict:
+    """
+    Gzips every uncompressed nifti in a dataset with zip_nifti, several files at a time.
+
+    Parameters
+    ----------
+    bids_data : Union[pathlib.Path, str, BIDSLayout, BIDSScanner]
+        Dataset to compress, see find_uncompressed_niftis.
+    jobs : int, optional
+        Number of files compressed at once, None uses all available cpus. The default is None.
+    threads : int, optional
+        Compression threads per file, passed to zip_nifti. The default is 1.
+    compresslevel : int, optional
+        gzip compression level. The default is 9.
+    chunk_size : int, optional
+        Block size for parallel compression, passed to zip_nifti. The default is 1 MiB.
+    max_memory : int, optional
+        Upper bound in bytes on the buffers held by all jobs together, the number of concurrent jobs is lowered to fit
+        within it (each job holds roughly 2 * threads chunks, at least one job always runs). The default is no bound.
+    verify : bool, optional
+        Verify each file as it is compressed, see zip_nifti. The default is False.
+    manifest_file : Union[str, pathlib.Path], optional
+        Where to keep the checksums of verified files, it is written once all files are done. Only used with verify.
+    return : dict
+        Original path -> gzipped path for every file compressed.
+    """
+    nifti_files = find_uncompressed_niftis(bids_data)
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+    if max_memory is not None:
+        memory_per_job = 2 * max(threads or os.cpu_count() or 1, 1) * chunk_size
+        jobs = min(jobs, max(1, max_memory // memory_per_job))
+    jobs = max(1, min(jobs, len(nifti_files)))
+
+    manifest = ChecksumManifest(manifest_file) if verify and manifest_file is not None else None
+
+    def compress(nifti_file):
+        return zip_nifti(nifti_file, threads=threads, compresslevel=compresslevel, chunk_size=chunk_size, verify=verify, manifest=manifest)
+
+    try:
+        with ThreadPoolExecutor(max_workers=jobs) as pool:
+            return dict(zip(nifti_files, pool.map(compress, nifti_files)))
+    finally:
+        # keep the checksums of whatever was verified even if another file failed
+        if manifest is not None:
+            manifest.save()
+
+
+def verify_nifti_tree(bids_data, manifest_file, jobs: int=None) -> dict:
+    """
+    Verifies every .nii.gz in a dataset with verify_gzipped_nifti. Files the manifest lists as verified and unchanged
+    since are skipped without being read, so that later runs only decompress new or modified files. Files not in the
+    manifest yet are checked to decompress cleanly and their checksums recorded.
+
+    Parameters
+    ----------
+    bids_data : Union[pathlib.Path, str, BIDSLayout]
+        Dataset to verify, see find_gzipped_niftis.
+    manifest_file : Union[str, pathlib.Path]
+        The checksum manifest, written once all files are done.
+    jobs : int, optional
+        Number of files verified at once, None uses all available cpus. The default is None.
+    return : dict
+        gzipped path -> sha256 of its uncompressed contents for every file that passed. A
+        CompressionVerificationError listing every file that failed is raised after the others have been verified.
+    """
+    gz_files = find_gzipped_niftis(bids_data)
+    manifest = ChecksumManifest(manifest_file)
+    jobs = max(1, min(jobs or os.cpu_count() or 1, len(gz_files)))
+
+    def verify(gz_file):
+        try:
+            return verify_gzipped_nifti(gz_file, manifest), None
+        except (CompressionVerificationError, OSError, EOFError, zlib.error) as err:
+            return None, f"{gz_file}: {err}"
+
+    try:
+        with ThreadPoolExecutor(max_workers=jobs) as pool:
+            outcomes = dict(zip(gz_files, pool.map(verify, gz_files)))
+    finally:
+        manifest.save()
+    failures = [error for _, error in outcomes.values() if error is not None]
+    if failures:
+        raise CompressionVerificationError("\n".join(failures))
+    return {gz_file: sha256 for gz_file, (sha256, _) in outcomes.items()}
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    """Adds the options of the compress command to parser, shared with the compress subcommand of petutils.cli."""
+    parser.add_argument("bids_dir", type=pathlib.Path, help="Root of the BIDS dataset.")
+    parser.add_argument("--jobs", "-j", type=int, default=None, help="Files compressed at once, defaults to the number of cpus.")
+    parser.add_argument("--threads", type=int, default=1, help="Compression threads per file.")
+    parser.add_argument("--level", type=int, default=9, choices=range(1, 10), metavar="{1-9}", help="gzip compression level.")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE, help="Bytes per block when --threads > 1.")
+    parser.add_argument("--max-memory", type=int, default=None, help="Bound in bytes on compression buffers across all jobs.")
+    parser.add_argument("--verify", action="store_true", help="Verify each compressed file against a checksum of the original.")
+    parser.add_argument("--manifest", type=pathlib.Path, default=None, help="JSON file to record checksums of verified files in.")
+    parser.add_argument("--verify-existing", action="store_true",
+                        help="Afterwards verify every .nii.gz against --manifest, skipping files verified since they last changed.")
+
+
+def run(args) -> int:
+    if args.verify_existing and args.manifest is None:
+        raise SystemExit("compress: --verify-existing requires --manifest.")
+    compressed = zip_nifti_tree(args.bids_dir, jobs=args.jobs, threads=args.threads, compresslevel=args.level,
+                                chunk_size=args.chunk_size, max_memory=args.max_memory,
+                                verify=args.verify or args.manifest is not None, manifest_file=args.manifest)
+    for nifti_file, zipped in compressed.items():
+        print(f"{nifti_file} -> {zipped}")
+    if args.verify_existing:
+        try:
+            verified = verify_nifti_tree(args.bids_dir, args.manifest, jobs=args.jobs)
+        except CompressionVerificationError as err:
+            print(err, file=sys.stderr)
+            return 1
+        print(f"{len(verified)} gzipped files verified")
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Gzip every uncompressed .nii file in a BIDS dataset in place.")
+    add_arguments(parser)
+    return run(parser.parse_args(argv))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
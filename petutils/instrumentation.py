@@ -0,0 +1,151 @@
+import os
+import json
+import time
+import logging
+import threading
+import contextlib
+
+# Opt-in instrumentation of the expensive steps in petutils. Nothing is measured until a callback is added, each
+# measurement is then passed to every callback as a flat dictionary, an event, with at least a "stage" key:
+#
+#   layout_build    building a BIDSLayout (root, index_metadata, seconds)
+#   layout_cache    a cached BIDSLayout was reused (root, count)
+#   query           fetching files from a layout or scanner (subject, or bulk=True for all subjects at once; seconds)
+#   header_read     reading the header of a PET image (path, seconds)
+#   json_read       parsing a sidecar from disk, reads served from cache aren't reported (path, seconds)
+#   timing_batch    validating the frame timing of a batch of images with deep (images, seconds)
+#   difflib_match   picking the closest anatomical path with difflib (path, candidates, seconds)
+#   gzip            compressing a nifti file (path, bytes, seconds)
+#   manifest_hit    a recorded frame consistency result was reused (path, count)
+#
+# Callbacks may be called from the worker threads of n_jobs, they should be thread safe. Events that happen in
+# worker processes (executor="process") are not reported back to the parent.
+
+logger = logging.getLogger("petutils.instrumentation")
+
+_callbacks = []
+
+
+def add_callback(callback):
+    """Registers a callable that receives every event from now on."""
+    _callbacks.append(callback)
+    return callback
+
+
+def remove_callback(callback):
+    _callbacks.remove(callback)
+
+
+def enabled() -> bool:
+    return bool(_callbacks)
+
+
+def emit(event: dict):
+    for callback in list(_callbacks):
+        callback(event)
+
+
+class _Stage:
+    def __init__(self, name, fields):
+        self.fields = {"stage": name, **fields}
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self.fields
+
+    def __exit__(self, *exc_info):
+        self.fields["seconds"] = time.perf_counter() - self.start
+        emit(self.fields)
+        return False
+
+
+class _NullStage:
+    def __enter__(self):
+        return {}
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NULL_STAGE = _NullStage()
+
+
+def stage(name: str, **fields):
+    """
+    Context manager timing the block it wraps and emitting it as an event named name along with fields. It yields
+    the event dictionary, so values only known at the end of the block can be added to it. When no callback is
+    registered nothing is timed.
+    """
+    if not _callbacks:
+        return _NULL_STAGE
+    return _Stage(name, fields)
+
+
+def count(name: str, n: int=1, **fields):
+    """Emits a counter event, e.g. for cache hits that take no time worth measuring."""
+    if _callbacks:
+        emit({"stage": name, "count": n, **fields})
+
+
+class Recorder:
+    """
+    Callback that keeps every event it receives and can summarise them per stage, e.g.
+
+        with recording() as recorder:
+            check_nifti_json_frame_consistency(bids_dir)
+        print(recorder.summary())
+    """
+
+    def __init__(self):
+        self.events = []
+        self._lock = threading.Lock()
+
+    def __call__(self, event: dict):
+        with self._lock:
+            self.events.append(dict(event))
+
+    def summary(self) -> dict:
+        """
+        return : dict
+            stage -> {"count", "seconds", "max_seconds"}, "bytes" and "bytes_per_second" are added for stages that
+            report bytes. count is the number of events, or the sum of their counts for counter events.
+        """
+        summary = {}
+        with self._lock:
+            events = list(self.events)
+        for event in events:
+            totals = summary.setdefault(event["stage"], {"count": 0, "seconds": 0.0, "max_seconds": 0.0})
+            totals["count"] += event.get("count", 1)
+            seconds = event.get("seconds", 0.0)
+            totals["seconds"] += seconds
+            totals["max_seconds"] = max(totals["max_seconds"], seconds)
+            if "bytes" in event:
+                totals["bytes"] = totals.get("bytes", 0) + event["bytes"]
+        for totals in summary.values():
+            if "bytes" in totals:
+                totals["bytes_per_second"] = totals["bytes"] / totals["seconds"] if totals["seconds"] else None
+        return summary
+
+
+def log_events(level: int=logging.INFO):
+    """Returns a callback writing each event to the petutils.instrumentation logger as a line of JSON."""
+    def log_event(event):
+        if logger.isEnabledFor(level):
+            logger.log(level, json.dumps(event, default=str), extra={"petutils_event": event})
+    return log_event
+
+
+@contextlib.contextmanager
+def recording(callback=None):
+    """Registers callback, a new Recorder by default, for the duration of the with block and yields it."""
+    callback = add_callback(callback if callback is not None else Recorder())
+    try:
+        yield callback
+    finally:
+        remove_callback(callback)
+
+
+# setting PETUTILS_INSTRUMENTATION to a logging level name (e.g. INFO) logs every event without changing any code
+if os.environ.get("PETUTILS_INSTRUMENTATION"):
+    _level = logging.getLevelName(os.environ["PETUTILS_INSTRUMENTATION"].upper())
+    add_callback(log_events(_level if isinstance(_level, int) else logging.INFO))
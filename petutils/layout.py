@@ -0,0 +1,136 @@
+from __future__ import annotations
+import os
+import json
+import hashlib
+import pathlib
+from typing import Union, TYPE_CHECKING
+from . import instrumentation
+
+# pybids is imported when the first layout is built, see petutils/__init__.py
+if TYPE_CHECKING:
+    from bids import BIDSLayout
+
+# top level folders that pybids does not index by default, changes in these don't invalidate a cached layout
+IGNORED_TOP_LEVEL_FOLDERS = {"code", "derivatives", "models", "sourcedata", "stimuli"}
+
+
+def dataset_fingerprint(bids_dir: Union[str, pathlib.Path], invalidation: str="files") -> str:
+    """
+    Computes a hash that changes whenever the indexed part of a BIDS dataset changes.
+
+    Parameters
+    ----------
+    bids_dir : Union[str, pathlib.Path]
+        Root of the BIDS dataset.
+    invalidation : str, optional
+        "files" hashes the relative path, size and modification time of every file so that edits to sidecars are
+        picked up, "directories" only hashes the modification time of each folder below the root (and the names of the
+        root's entries) which catches files being added, removed or renamed at the cost of a stat per folder instead
+        of per file. The default is "files".
+    return : str
+        Hex digest of the fingerprint.
+    """
+    if invalidation not in ("files", "directories"):
+        raise ValueError(f"invalidation must be 'files' or 'directories', given {invalidation}.")
+    bids_dir = os.path.abspath(bids_dir)
+    digest = hashlib.sha1()
+    for root, folders, files in os.walk(bids_dir):
+        # walk in a stable order and skip the same folders pybids skips
+        folders[:] = sorted(f for f in folders if not f.startswith('.') and not (root == bids_dir and f in IGNORED_TOP_LEVEL_FOLDERS))
+        relative_root = os.path.relpath(root, bids_dir)
+        if invalidation == "directories":
+            if root == bids_dir:
+                # the root's own mtime also changes when an ignored folder such as derivatives is created, so its
+                # non ignored entries are hashed instead
+                entries = sorted(f for f in folders + files if not f.startswith('.'))
+                digest.update(f"{relative_root}\0{'/'.join(entries)}\n".encode())
+            else:
+                digest.update(f"{relative_root}\0{os.stat(root).st_mtime_ns}\n".encode())
+            continue
+        for file in sorted(files):
+            if file.startswith('.'):
+                continue
+            stat = os.stat(os.path.join(root, file))
+            digest.update(f"{relative_root}/{file}\0{stat.st_size}\0{stat.st_mtime_ns}\n".encode())
+    return digest.hexdigest()
+
+
+class LayoutCache:
+    """
+    Keeps BIDSLayouts keyed on the root of their dataset so that repeated calls don't re-index an unchanged dataset.
+    If a cache_dir is given the pybids database of each layout is also written to disk there, which lets separate
+    runs of a pipeline reuse the index. A cached layout is rebuilt whenever the dataset's fingerprint changes.
+    """
+
+    def __init__(self, cache_dir: Union[str, pathlib.Path, None]=None, invalidation: str="files"):
+        self.cache_dir = pathlib.Path(cache_dir) if cache_dir is not None else None
+        self.invalidation = invalidation
+        self._layouts = {}
+
+    def _database_path(self, key):
+        return self.cache_dir / hashlib.sha1(json.dumps(key).encode()).hexdigest()[:16]
+
+    def get(self, bids_dir: Union[str, pathlib.Path], validate: bool=True, index_metadata: bool=True) -> BIDSLayout:
+        """Returns a layout for bids_dir, building and caching it only if the dataset has changed since last time."""
+        root = str(pathlib.Path(bids_dir).resolve())
+        key = [root, validate, index_metadata]
+        fingerprint = dataset_fingerprint(root, invalidation=self.invalidation)
+
+        cached = self._layouts.get(tuple(key))
+        if cached is not None and cached[0] == fingerprint:
+            instrumentation.count("layout_cache", root=root)
+            return cached[1]
+
+        from bids import BIDSLayout
+        from bids.layout import BIDSLayoutIndexer
+        layout_kwargs = {"validate": validate, "indexer": BIDSLayoutIndexer(validate=validate, index_metadata=index_metadata)}
+        if self.cache_dir is None:
+            with instrumentation.stage("layout_build", root=root, index_metadata=index_metadata):
+                layout = BIDSLayout(root, **layout_kwargs)
+        else:
+            database_path = self._database_path(key)
+            fingerprint_file = database_path / "petutils_fingerprint.json"
+            try:
+                with open(fingerprint_file) as f:
+                    reset_database = json.load(f).get("fingerprint") != fingerprint
+            except (FileNotFoundError, json.JSONDecodeError):
+                reset_database = True
+            database_path.mkdir(parents=True, exist_ok=True)
+            with instrumentation.stage("layout_build", root=root, index_metadata=index_metadata, reset_database=reset_database):
+                layout = BIDSLayout(root, database_path=database_path, reset_database=reset_database, **layout_kwargs)
+            if reset_database:
+                with open(fingerprint_file, 'w') as f:
+                    json.dump({"root": root, "fingerprint": fingerprint}, f)
+
+        self._layouts[tuple(key)] = (fingerprint, layout)
+        return layout
+
+    def clear(self):
+        """Drops all layouts held in memory, databases written to cache_dir are left in place."""
+        self._layouts.clear()
+
+
+# layouts are persisted to disk only when a cache folder is configured through the environment
+default_layout_cache = LayoutCache(cache_dir=os.environ.get("PETUTILS_LAYOUT_CACHE"))
+
+
+def get_layout(bids_dir: Union[str, pathlib.Path], validate: bool=True, index_metadata: bool=True, cache: LayoutCache=None) -> BIDSLayout:
+    """
+    Returns a (possibly cached) BIDSLayout for bids_dir.
+
+    Parameters
+    ----------
+    bids_dir : Union[str, pathlib.Path]
+        Root of the BIDS dataset.
+    validate : bool, optional
+        Passed on to BIDSLayout. The default is True.
+    index_metadata : bool, optional
+        Whether pybids should read every sidecar into its database. The default is True.
+    cache : LayoutCache, optional
+        Cache to use, defaults to the module level cache which persists to the folder set in the
+        PETUTILS_LAYOUT_CACHE environment variable if any.
+    return : BIDSLayout
+    """
+    if cache is None:
+        cache = default_layout_cache
+    return cache.get(bids_dir, validate=validate, index_metadata=index_metadata)
@@ -0,0 +1,129 @@
+import os
+import re
+from difflib import SequenceMatcher
+from typing import Iterable, Tuple
+
+# wildcard used in the index for an entity that should not be considered when looking up an anatomical image
+ANY = "*"
+
+RUN_ENTITY = re.compile(r"_run-[a-zA-Z0-9]+")
+
+
+def _label(value):
+    """Entity values from pybids may be ints (e.g. run), we compare labels as strings."""
+    return None if value is None else str(value)
+
+
+def _run_label(value):
+    """Runs are indices in BIDS, so run-1 and run-01 are the same run, zero padding is dropped."""
+    value = _label(value)
+    return str(int(value)) if value is not None and value.isdigit() else value
+
+
+class AnatomicalIndex:
+    """
+    Indexes anatomical images by their subject, session, run and acquisition entities so that the anatomical image
+    for a PET image can be resolved with a handful of dictionary lookups instead of comparing it against every
+    anatomical file.
+
+    For a PET image the anatomical image is looked up first in the PET image's own session, then at the subject level
+    (anat folder without a session) and finally in the subject's first session that contains anatomical images.
+    Within a session a matching run and acquisition are preferred, then a matching run, then a matching acquisition
+    and then any image. Ties are broken by the order of the suffixes given (e.g. T1w before T2w) and then by path.
+    """
+
+    def __init__(self, anat_files: Iterable[Tuple[str, dict]], suffixes=["T1w", "T2w"]):
+        """
+        Parameters
+        ----------
+        anat_files : Iterable[Tuple[str, dict]]
+            Pairs of path and BIDS entities (subject, session, run, acquisition, suffix) for each anatomical image.
+        suffixes : list, optional
+            Anatomical suffixes in order of preference. The default is ["T1w", "T2w"].
+        """
+        suffix_rank = {suffix: rank for rank, suffix in enumerate(suffixes)}
+        ranked = sorted(
+            ((suffix_rank.get(entities.get("suffix"), len(suffix_rank)), path, entities) for path, entities in anat_files),
+            key=lambda anat: anat[:2],
+        )
+
+        # (subject, session) -> {(run, acquisition): path}, the first (best ranked) image claims each key
+        self._index = {}
+        sessions = {}
+        for _, path, entities in ranked:
+            subject, session = _label(entities.get("subject")), _label(entities.get("session"))
+            run, acquisition = _run_label(entities.get("run")), _label(entities.get("acquisition"))
+            bucket = self._index.setdefault((subject, session), {})
+            for key in ((run, acquisition), (run, ANY), (ANY, acquisition), (ANY, ANY)):
+                bucket.setdefault(key, path)
+            if session is not None:
+                sessions.setdefault(subject, set()).add(session)
+        self._first_session = {subject: sorted(labels)[0] for subject, labels in sessions.items()}
+
+    def match(self, subject, session=None, run=None, acquisition=None) -> str:
+        """Returns the path of the best anatomical image for a PET image with the given entities or '' if none exist."""
+        subject, session = _label(subject), _label(session)
+        run, acquisition = _run_label(run), _label(acquisition)
+        for candidate_session in (session, None, self._first_session.get(subject)):
+            bucket = self._index.get((subject, candidate_session))
+            if bucket is None:
+                continue
+            for key in ((run, acquisition), (run, ANY), (ANY, acquisition), (ANY, ANY)):
+                if key in bucket:
+                    return bucket[key]
+        return ''
+
+
+class DifflibMatcher:
+    """
+    Picks the anatomical path textually closest to a PET path, as difflib.get_close_matches(pet_path, anat_files,
+    n=1) would, for the PET images of one subject.
+
+    Like get_close_matches, the PET path is set once as the second sequence of a SequenceMatcher (set_seq2, where
+    difflib caches its index of the sequence) and each anatomical path is compared against it as the first, ratio()
+    isn't symmetric so the orientation has to be the same. Candidates whose quick_ratio can't beat the best ratio
+    found so far are skipped without computing their ratio.
+
+    The runs of a session usually end up with the same anatomical image, so the winner for the previous run (the PET
+    path with its run entity stripped, the session kept) is scored first. Its ratio is then the bar the other
+    candidates' quick_ratio has to reach, which skips most of them. Only the order candidates are scored in changes,
+    every candidate that could match or beat the winner is still scored, so the result is exactly that of
+    get_close_matches.
+    """
+
+    def __init__(self, anat_files: Iterable[str], cutoff: float=0.6):
+        self.cutoff = cutoff
+        self.anat_files = list(anat_files)
+        # PET path without its run entity -> anatomical path picked for the last such PET path
+        self._previous = {}
+
+    def _key(self, pet_path: str) -> str:
+        folder, name = os.path.split(pet_path)
+        return os.path.join(folder, RUN_ENTITY.sub("", name))
+
+    def match(self, pet_path: str) -> str:
+        """Returns the closest anatomical path with a similarity of at least cutoff or '' if there is none."""
+        key = self._key(pet_path)
+        closest = self._closest(pet_path, self._previous.get(key))
+        self._previous[key] = closest
+        return closest
+
+    def _closest(self, pet_path: str, first: str=None) -> str:
+        best_score, best_path = None, ''
+        matcher = SequenceMatcher()
+        matcher.set_seq2(pet_path)
+        candidates = self.anat_files
+        if first:
+            candidates = [first] + [path for path in candidates if path != first]
+        for path in candidates:
+            matcher.set_seq1(path)
+            if matcher.real_quick_ratio() < self.cutoff:
+                continue
+            upper_bound = matcher.quick_ratio()
+            # equal scores are still computed, ties go to the greater path like in get_close_matches
+            if upper_bound < self.cutoff or (best_score is not None and upper_bound < best_score):
+                continue
+            score = matcher.ratio()
+            if score >= self.cutoff and (best_score is None or (score, path) > (best_score, best_path)):
+                best_score, best_path = score, path
+        return best_path
@@ -0,0 +1,198 @@
+import gzip
+import mmap
+import struct
+
+# size in bytes of the fixed portion of the NIfTI-1 and NIfTI-2 headers, these are the only bytes we need to read
+# to learn the shape, datatype, and voxel sizes of an image
+NIFTI1_HEADER_SIZE = 348
+NIFTI2_HEADER_SIZE = 540
+
+
+# numpy type codes for the NIfTI datatype codes, RGB and other compound types aren't supported by MappedNifti
+NIFTI_DATATYPES = {
+    2: "u1", 4: "i2", 8: "i4", 16: "f4", 32: "c8", 64: "f8", 256: "i1", 512: "u2", 768: "u4", 1024: "i8",
+    1280: "u8", 1792: "c16",
+}
+
+
+class NiftiHeaderError(Exception):
+    """Raised when a file does not contain a valid NIfTI-1 or NIfTI-2 header."""
+    pass
+
+
+def _open_nifti(nifti_file):
+    """Opens a nifti file for binary reading, gzipped files are decompressed as a stream."""
+    with open(nifti_file, 'rb') as f:
+        is_gzipped = f.read(2) == b'\x1f\x8b'
+    if is_gzipped:
+        return gzip.open(nifti_file, 'rb')
+    return open(nifti_file, 'rb')
+
+
+def parse_nifti_header(header_bytes: bytes) -> dict:
+    """
+    Decodes the fields of a NIfTI-1 or NIfTI-2 header that are needed to describe an image's shape and timing.
+
+    Parameters
+    ----------
+    header_bytes : bytes
+        At least the first 348 bytes (NIfTI-1) or 540 bytes (NIfTI-2) of a nifti file.
+    return : dict
+        A dictionary containing version, endianness, dim, datatype, bitpix, pixdim, vox_offset, scl_slope,
+        scl_inter and xyzt_units.
+    """
+    if len(header_bytes) < NIFTI1_HEADER_SIZE:
+        raise NiftiHeaderError(f"Expected at least {NIFTI1_HEADER_SIZE} bytes of header, got {len(header_bytes)}.")
+
+    # sizeof_hdr is the first field of both versions, we use it to determine the version and byte order
+    for endianness in ('<', '>'):
+        sizeof_hdr = struct.unpack_from(f"{endianness}i", header_bytes, 0)[0]
+        if sizeof_hdr in (NIFTI1_HEADER_SIZE, NIFTI2_HEADER_SIZE):
+            break
+    else:
+        raise NiftiHeaderError("Unable to determine NIfTI version from sizeof_hdr in header.")
+
+    e = endianness
+    if sizeof_hdr == NIFTI1_HEADER_SIZE:
+        header = {
+            "version": 1,
+            "endianness": e,
+            "dim": struct.unpack_from(f"{e}8h", header_bytes, 40),
+            "datatype": struct.unpack_from(f"{e}h", header_bytes, 70)[0],
+            "bitpix": struct.unpack_from(f"{e}h", header_bytes, 72)[0],
+            "pixdim": struct.unpack_from(f"{e}8f", header_bytes, 76),
+            "vox_offset": int(struct.unpack_from(f"{e}f", header_bytes, 108)[0]),
+            "scl_slope": struct.unpack_from(f"{e}f", header_bytes, 112)[0],
+            "scl_inter": struct.unpack_from(f"{e}f", header_bytes, 116)[0],
+            "xyzt_units": header_bytes[123],
+        }
+    else:
+        if len(header_bytes) < NIFTI2_HEADER_SIZE:
+            raise NiftiHeaderError(f"Expected {NIFTI2_HEADER_SIZE} bytes for a NIfTI-2 header, got {len(header_bytes)}.")
+        header = {
+            "version": 2,
+            "endianness": e,
+            "dim": struct.unpack_from(f"{e}8q", header_bytes, 16),
+            "datatype": struct.unpack_from(f"{e}h", header_bytes, 12)[0],
+            "bitpix": struct.unpack_from(f"{e}h", header_bytes, 14)[0],
+            "pixdim": struct.unpack_from(f"{e}8d", header_bytes, 104),
+            "vox_offset": struct.unpack_from(f"{e}q", header_bytes, 168)[0],
+            "scl_slope": struct.unpack_from(f"{e}d", header_bytes, 176)[0],
+            "scl_inter": struct.unpack_from(f"{e}d", header_bytes, 184)[0],
+            "xyzt_units": struct.unpack_from(f"{e}i", header_bytes, 500)[0],
+        }
+    return header
+
+
+def read_nifti_header(nifti_file) -> dict:
+    """
+    Reads only the header of a nifti file without loading the image through nibabel. Gzipped files are
+    decompressed as a stream and only the first 348 (NIfTI-1) or 540 (NIfTI-2) bytes are ever decoded, so the
+    cost of this function does not depend on the size of the image.
+
+    Parameters
+    ----------
+    nifti_file : Union[str, pathlib.Path]
+        Path to a .nii or .nii.gz file.
+    return : dict
+        The parsed header, see parse_nifti_header for the fields returned.
+    """
+    with _open_nifti(nifti_file) as f:
+        header_bytes = f.read(NIFTI1_HEADER_SIZE)
+        # a NIfTI-2 header announces itself in sizeof_hdr, only then do we read the remaining bytes
+        if len(header_bytes) >= 4 and NIFTI2_HEADER_SIZE in struct.unpack_from('<i', header_bytes) + struct.unpack_from('>i', header_bytes):
+            header_bytes += f.read(NIFTI2_HEADER_SIZE - NIFTI1_HEADER_SIZE)
+    try:
+        return parse_nifti_header(header_bytes)
+    except NiftiHeaderError as err:
+        raise NiftiHeaderError(f"{nifti_file}: {err}") from err
+
+
+class MappedNifti:
+    """
+    Memory mapped, read only view of an uncompressed .nii file. The header is decoded straight out of the mapping
+    and frames are returned as numpy arrays backed by the mapping rather than copies, so reading one frame of a
+    multi gigabyte 4D image only pages in that frame. Gzipped files can't be mapped, a NiftiHeaderError is raised.
+
+        with MappedNifti("sub-01_pet.nii") as image:
+            for index in range(image.n_frames):
+                qc(image.frame(index))
+
+    Arrays returned by frame and frames are only valid while the file is mapped. If any are still referenced when
+    the file is closed, the mapping is left for garbage collection to release once they are gone.
+
+    Parameters
+    ----------
+    nifti_file : Union[str, pathlib.Path]
+        Path to an uncompressed NIfTI-1 or NIfTI-2 file.
+    """
+
+    def __init__(self, nifti_file):
+        self.nifti_file = nifti_file
+        with open(nifti_file, 'rb') as f:
+            if f.read(2) == b'\x1f\x8b':
+                raise NiftiHeaderError(f"{nifti_file}: gzipped files can't be memory mapped.")
+            f.seek(0)
+            try:
+                self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError as err:
+                raise NiftiHeaderError(f"{nifti_file}: {err}") from err
+        try:
+            self.header = parse_nifti_header(self._mmap)
+        except NiftiHeaderError as err:
+            self._mmap.close()
+            raise NiftiHeaderError(f"{nifti_file}: {err}") from err
+
+        dim = self.header["dim"]
+        self.shape = tuple(int(d) for d in dim[1:dim[0] + 1])
+        # everything past the three spatial dimensions is counted as frames
+        self.frame_shape = (self.shape + (1, 1, 1))[:3]
+        self.n_frames = 1
+        for d in self.shape[3:]:
+            self.n_frames *= d
+        datatype = NIFTI_DATATYPES.get(self.header["datatype"])
+        if datatype is None:
+            self._mmap.close()
+            raise NiftiHeaderError(f"{nifti_file}: datatype {self.header['datatype']} is not supported.")
+        self.dtype = self.header["endianness"] + datatype
+        self.frame_size = self.frame_shape[0] * self.frame_shape[1] * self.frame_shape[2] * int(datatype[1:])
+        end, size = self.header["vox_offset"] + self.frame_size * self.n_frames, len(self._mmap)
+        if end > size:
+            self._mmap.close()
+            raise NiftiHeaderError(f"{nifti_file}: header describes {end} bytes of image, the file only has {size}.")
+
+    def frame(self, index: int, scaled: bool=False):
+        """
+        Returns frame index as an array of frame_shape in the file's own datatype, backed by the mapping. With
+        scaled, scl_slope and scl_inter are applied if set, which makes a floating point copy.
+        """
+        import numpy
+        if not -self.n_frames <= index < self.n_frames:
+            raise IndexError(f"frame {index} out of range for {self.n_frames} frames.")
+        index %= self.n_frames
+        offset = self.header["vox_offset"] + index * self.frame_size
+        count = self.frame_shape[0] * self.frame_shape[1] * self.frame_shape[2]
+        data = numpy.frombuffer(self._mmap, dtype=self.dtype, count=count, offset=offset).reshape(self.frame_shape, order='F')
+        slope, inter = self.header["scl_slope"], self.header["scl_inter"]
+        if scaled and slope != 0 and (slope != 1 or inter != 0):
+            return data * slope + inter
+        return data
+
+    def frames(self, scaled: bool=False):
+        """Yields each frame in turn, see frame."""
+        for index in range(self.n_frames):
+            yield self.frame(index, scaled=scaled)
+
+    def close(self):
+        try:
+            self._mmap.close()
+        except BufferError:
+            # arrays handed out still point into the mapping, it's unmapped when the last of them is collected
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+        return False
@@ -1,114 +1,575 @@
+from __future__ import annotations
 import os
-import shutil
-import gzip
+import sys
 import pathlib
 import json
-from bids import BIDSLayout
-from bids.layout.models import BIDSImageFile, BIDSJSONFile
-from typing import Union
-from difflib import get_close_matches
+import functools
+from typing import Union, TYPE_CHECKING
+from collections import deque
+from concurrent.futures import Executor, Future, ThreadPoolExecutor, ProcessPoolExecutor
+from .nifti import read_nifti_header
+from .layout import get_layout
+from .matching import AnatomicalIndex, DifflibMatcher
+from .compress import zip_nifti
+from .scanner import BIDSScanner, BIDSRecord
+from .results import FrameConsistencyResult
+from .sharding import select_shard
+from . import instrumentation
 
+# pybids pulls in SQLAlchemy, pandas and nibabel, it's only imported once a BIDSLayout is actually needed
+if TYPE_CHECKING:
+    from bids import BIDSLayout
 
-def get_versions():
-     #collect version from pyproject.toml
-    places_to_look = [pathlib.Path(__file__).parent.absolute(), pathlib.Path(__file__).parent.parent.absolute()]
+# orjson is used to parse sidecars when it's installed, it's optional and the standard library is used otherwise
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
-    __version__ = "unable to locate version number in pyproject.toml"
-    
-    # we use the default version at the time of this writing, but the most current version
-    # can be found in the pyproject.toml file under the [tool.bids] section
-    __bids_version__ = "1.8.0"
-    
-    # search for toml file
-    for place in places_to_look:
-        for root, folders, files in os.walk(place):
-            for file in files:
-                if file.endswith("pyproject.toml"):
-                    toml_file = os.path.join(root, file)
-
-                    with open(toml_file, "r") as f:
-                        for line in f.readlines():
-                            if "version" in line and len(line.split("=")) > 1 and "bids_version" not in line:
-                                __version__ = line.split("=")[1].strip().replace('"', "")
-                            if "bids_version" in line and len(line.split("=")) > 1:
-                                __bids_version__ = line.split("=")[1].strip().replace('"', "")
-                    break
-    return {"ingest_pet_version": __version__, "bids_version": __bids_version__}
-
-def zip_nifti(nifti_file):
-    """Zips an un-gzipped nifti file and removes the original file."""
-    if str(nifti_file).endswith('.gz'):
-        return nifti_file
+
+# the BIDS version written out when the pyproject.toml doesn't give one under [tool.bids]
+DEFAULT_BIDS_VERSION = "1.8.0"
+
+# number of images whose frame timing is validated together when checking a dataset with deep
+TIMING_BATCH_SIZE = 256
+
+def _read_pyproject_versions(toml_file) -> tuple:
+    """Returns (version, bids_version) from a petutils pyproject.toml, either is None if it isn't found."""
+    version, bids_version, section, name = None, None, None, None
+    with open(toml_file, "r") as f:
+        for line in f:
+            line = line.strip()
+            if line.startswith("["):
+                section = line.strip("[]").strip()
+                continue
+            key, _, value = line.partition("=")
+            key, value = key.strip(), value.strip().strip('"\'')
+            if section == "project" and key == "name":
+                name = value
+            elif section == "project" and key == "version":
+                version = value
+            elif key == "bids_version":
+                bids_version = value
+    if name != "petutils":
+        return None, None
+    return version, bids_version
+
+@functools.lru_cache(maxsize=None)
+def _lookup_versions() -> tuple:
+    import importlib.metadata
+    try:
+        version = importlib.metadata.version("petutils")
+    except importlib.metadata.PackageNotFoundError:
+        version = None
+    bids_version = None
+    # a development checkout has the pyproject.toml next to the package, only these two paths are ever looked at
+    package_dir = pathlib.Path(__file__).parent.absolute()
+    for toml_file in (package_dir.parent / "pyproject.toml", package_dir / "pyproject.toml"):
+        if toml_file.is_file():
+            checkout_version, bids_version = _read_pyproject_versions(toml_file)
+            if checkout_version is not None:
+                version = version or checkout_version
+                break
+    if version is None:
+        version = "unable to locate version number in pyproject.toml"
+    return version, bids_version or DEFAULT_BIDS_VERSION
+
+def get_versions() -> dict:
+    """
+    Returns the version of petutils and of the BIDS specification it writes. The version of the installed
+    distribution is used when there is one, otherwise that of a development checkout's pyproject.toml next to the
+    package. bids_version is read from the [tool.bids] section of that pyproject.toml and defaults to
+    DEFAULT_BIDS_VERSION. The lookup is only made once.
+
+    return : dict
+        {"ingest_pet_version": version, "bids_version": bids_version}
+    """
+    version, bids_version = _lookup_versions()
+    return {"ingest_pet_version": version, "bids_version": bids_version}
+
+def _write_json_atomically(json_file: Union[str, pathlib.Path], data: Union[dict, list, bytes], **dump_kwargs):
+    """Writes data (or already encoded bytes) to a temporary file next to json_file and renames it over json_file."""
+    json_file = pathlib.Path(json_file)
+    temporary = json_file.with_name(f".{json_file.name}.tmp")
+    if isinstance(data, bytes):
+        with open(temporary, 'wb') as f:
+            f.write(data)
     else:
-        with open(nifti_file, 'rb') as infile:
-            with gzip.open(nifti_file + '.gz', 'wb') as outfile:
-                shutil.copyfileobj(infile, outfile)
-        os.remove(nifti_file)
-        return nifti_file + '.gz'
+        with open(temporary, 'w') as f:
+            json.dump(data, f, **dump_kwargs)
+    os.replace(temporary, json_file)
+
+@functools.lru_cache(maxsize=256)
+def _load_source_description(description_file, size, mtime_ns) -> dict:
+    """Parses a dataset_description.json, size and mtime_ns only serve to key the cache."""
+    with open(description_file) as f:
+        return json.load(f)
 
-def write_out_dataset_description_json(input_bids_dir, output_bids_dir=None):
+def _read_source_description(input_bids_dir) -> dict:
+    """The dataset_description.json of a BIDS dataset, cached until the file changes, or {"Name": "Unknown"}."""
+    description_file = os.path.join(input_bids_dir, 'dataset_description.json')
+    stat = _file_fingerprint(description_file)
+    if stat is None:
+        return {"Name": "Unknown"}
+    return _load_source_description(description_file, *stat)
 
-    # set output dir to input dir if output dir is not specified
-    if output_bids_dir is None:
-        output_bids_dir = pathlib.Path(os.path.join(input_bids_dir, "derivatives", "petdeface"))
+def _derivative_description(source_dataset_description: dict, versions: dict) -> dict:
+    return {
+        "Name": f"description verygeneric - this is a placeholder: "
+                f"Not much to read here, if this has been published you've messed up`{source_dataset_description['Name']}`",
+        "BIDSVersion": versions["bids_version"],
+        "GeneratedBy": [
+            {"Name": "TBD",
+             "Version": versions["ingest_pet_version"],
+             "CodeURL": "https://github.com/someuser/someproject"}],
+        "HowToAcknowledge": "This ________ uses ______________: `Someone, A., A Title. Journal, 2099. 12(3): p. 1-5.`,"
+                            "and the ___________ developed by Some other person: `https://notarealurl.super.fake/extremelyfake`",
+        "License": "CCBY"
+    }
+
+def write_out_dataset_description_jsons(derivatives) -> list:
+    """
+    Writes the dataset_description.json of many derivative datasets in one pass. Versions are looked up once, the
+    description of each source dataset is read and encoded once no matter how many derivatives it has, and every
+    file is written to a temporary file and renamed into place so that readers never see a partial description.
+
+    Parameters
+    ----------
+    derivatives : iterable
+        (input_bids_dir, output_bids_dir) pairs, output_bids_dir may be None for input_bids_dir/derivatives/petdeface.
+        Output folders are created as needed.
+    return : list
+        The paths of the dataset_description.json files written.
+    """
+    versions = get_versions()
+    encoded_descriptions = {}
+    written = []
+    for input_bids_dir, output_bids_dir in derivatives:
+        # set output dir to input dir if output dir is not specified
+        if output_bids_dir is None:
+            output_bids_dir = os.path.join(input_bids_dir, "derivatives", "petdeface")
+        output_bids_dir = pathlib.Path(output_bids_dir)
         output_bids_dir.mkdir(parents=True, exist_ok=True)
 
-    # collect name of dataset from input folder
-    try:
-        with open(os.path.join(input_bids_dir, 'dataset_description.json')) as f:
-            source_dataset_description = json.load(f)
-    except FileNotFoundError:
-        source_dataset_description = {"Name": "Unknown"}
-
-    with open(os.path.join(output_bids_dir, 'dataset_description.json'), 'w') as f:
-        dataset_description = {
-            "Name": f"description verygeneric - this is a placeholder: "
-                    f"Not much to read here, if this has been published you've messed up`{source_dataset_description['Name']}`",
-            "BIDSVersion": __bids_version__,
-            "GeneratedBy": [
-                {"Name": "TBD",
-                 "Version": __version__,
-                 "CodeURL": "https://github.com/someuser/someproject"}],
-            "HowToAcknowledge": "This ________ uses ______________: `Someone, A., A Title. Journal, 2099. 12(3): p. 1-5.`,"
-                                "and the ___________ developed by Some other person: `https://notarealurl.super.fake/extremelyfake`",
-            "License": "CCBY"
-        }
-
-        json.dump(dataset_description, f, indent=4)
-
-def collect_anat_and_pet(bids_data: Union[pathlib.Path, BIDSLayout], suffixes=["T1w", "T2w"], subjects: list=[], check_single_subject=False):
-    if type(bids_data) is BIDSLayout:
-        pass
+        # collect name of dataset from input folder
+        source = os.path.abspath(input_bids_dir)
+        if source not in encoded_descriptions:
+            description = _derivative_description(_read_source_description(source), versions)
+            encoded_descriptions[source] = json.dumps(description, indent=4).encode()
+        _write_json_atomically(output_bids_dir / 'dataset_description.json', encoded_descriptions[source])
+        written.append(output_bids_dir / 'dataset_description.json')
+    return written
+
+def write_out_dataset_description_json(input_bids_dir, output_bids_dir=None) -> pathlib.Path:
+    """
+    Writes the dataset_description.json of a derivative dataset, see write_out_dataset_description_jsons to write
+    many at once.
+
+    Parameters
+    ----------
+    input_bids_dir : Union[str, pathlib.Path]
+        The source BIDS dataset, its name is taken from its dataset_description.json.
+    output_bids_dir : Union[str, pathlib.Path], optional
+        The derivative dataset, the default is input_bids_dir/derivatives/petdeface.
+    return : pathlib.Path
+        The path of the file written.
+    """
+    return write_out_dataset_description_jsons([(input_bids_dir, output_bids_dir)])[0]
+
+def _is_image(entry) -> bool:
+    """True for the image files of a BIDSLayout or a BIDSScanner."""
+    if isinstance(entry, BIDSRecord):
+        return entry.is_image
+    from bids.layout.models import BIDSImageFile
+    return type(entry) is BIDSImageFile
+
+def _load_bids_data(bids_data: Union[pathlib.Path, BIDSLayout, BIDSScanner], index_metadata: bool=True):
+    """Returns bids_data ready to be queried, paths are turned into (cached) BIDSLayouts."""
+    if isinstance(bids_data, BIDSScanner):
+        return bids_data
     elif isinstance(bids_data, (pathlib.PosixPath, pathlib.WindowsPath)) and bids_data.exists():
-        bids_data = BIDSLayout(bids_data)
+        return get_layout(bids_data, index_metadata=index_metadata)
+    # a BIDSLayout can only exist once pybids has been imported, checking for one mustn't import it
+    elif "bids" in sys.modules and type(bids_data) is sys.modules["bids"].BIDSLayout:
+        return bids_data
     else:
-        raise TypeError(f"{bids_data} must be a BIDSLayout or valid Path object, given type: {type(bids_data)}.")
-    
+        raise TypeError(f"{bids_data} must be a BIDSLayout, BIDSScanner or valid Path object, given type: {type(bids_data)}.")
+
+def iter_anat_and_pet(bids_data: Union[pathlib.Path, BIDSLayout, BIDSScanner], suffixes=["T1w", "T2w"], subjects: list=[], matcher: str="entities", bulk: bool=True,
+                      shard: tuple=None):
+    """
+    Generator version of collect_anat_and_pet, yields (subject, pet_file, anat_file) for each PET image as soon as
+    it is matched instead of building the whole mapping first. Takes the same arguments as collect_anat_and_pet.
+    """
+    if matcher not in ("entities", "difflib"):
+        raise ValueError(f"matcher must be 'entities' or 'difflib', given {matcher}.")
+    bids_data = _load_bids_data(bids_data)
+
     # return all subjects if no list of subjects is given
-    if subjects == []:
+    all_subjects = subjects == []
+    if all_subjects:
         subjects = bids_data.get_subjects()
+    if shard is not None:
+        subjects, all_subjects = select_shard(subjects, shard), False
+
+    for subject, pet_files, anat_files in _query_pet_and_anat(bids_data, subjects, suffixes, bulk, all_subjects):
+        if matcher == "entities":
+            anat_index = AnatomicalIndex(((a.path, bids_data.parse_file_entities(a.path)) for a in anat_files), suffixes=suffixes)
+        else:
+            anat_matcher = DifflibMatcher(a.path for a in anat_files)
+        for entry in pet_files:
+            if _is_image(entry):
+                if matcher == "entities":
+                    entities = bids_data.parse_file_entities(entry.path)
+                    yield subject, entry.path, anat_index.match(
+                        subject, entities.get("session"), entities.get("run"), entities.get("acquisition"))
+                    continue
+                # search through anatomical files and find the closest match
+                with instrumentation.stage("difflib_match", path=entry.path, candidates=len(anat_files)):
+                    closest = anat_matcher.match(entry.path)
+                yield subject, entry.path, closest
+
+def collect_anat_and_pet(bids_data: Union[pathlib.Path, BIDSLayout, BIDSScanner], suffixes=["T1w", "T2w"], subjects: list=[], check_single_subject=False, matcher: str="entities", bulk: bool=True,
+                         shard: tuple=None):
+    """
+    Pairs each PET image in a BIDS dataset with an anatomical image.
+
+    Parameters
+    ----------
+    bids_data : Union[pathlib.Path, BIDSLayout, BIDSScanner]
+        The path to the BIDS dataset, a BIDSLayout object or a BIDSScanner.
+    suffixes : list, optional
+        Anatomical suffixes to consider, in order of preference. The default is ["T1w", "T2w"].
+    subjects : list, optional
+        A list of subjects to collect, if not given all subjects in the dataset are collected. The default is [].
+    matcher : str, optional
+        "entities" resolves the anatomical image from the BIDS entities of the PET image, looking in the same session,
+        then the subject level and then the first session, see petutils.matching.AnatomicalIndex. "difflib" picks the
+        anatomical path that is textually closest to the PET path. The default is "entities".
+    bulk : bool, optional
+        Fetch the PET and anatomical files of all requested subjects with a single query each and group them in
+        memory, instead of querying the layout twice per subject. The results are the same. The default is True.
+    shard : tuple, optional
+        (index, count) to only map the subjects that petutils.sharding.shard_of assigns to shard index of count,
+        e.g. to spread a dataset over several nodes. The default is None, which maps every subject.
+    return : dict
+        subject -> {pet_file: anat_file}, anat_file is '' if no anatomical image was found. Use iter_anat_and_pet to
+        receive the pairs one at a time instead.
+    """
+    bids_data = _load_bids_data(bids_data)
 
     mapped_pet_to_anat = {}
-    for subject in subjects:
+    for subject in select_shard(subjects if subjects != [] else bids_data.get_subjects(), shard):
         mapped_pet_to_anat[subject] = {}
-    for subject in subjects:
-        pet_files = bids_data.get(subject=subject, suffix="pet")
-        anat_files = [a.path for a in bids_data.get(suffix=suffixes, subject=subject, extension=["nii", "nii.gz"])]
-        # for each pet image file we create an entry our mapping dictionary
-        for entry in pet_files:
-            if type(entry) is BIDSImageFile:
-                try:
-                    # search through anatomical files and find the closest match
-                    mapped_pet_to_anat[subject][entry.path] = get_close_matches(entry.path, anat_files, n=1)[0]
-                except IndexError:
-                    mapped_pet_to_anat[subject][entry.path] = ''
+    for subject, pet_file, anat_file in iter_anat_and_pet(bids_data, suffixes=suffixes, subjects=subjects, matcher=matcher, bulk=bulk, shard=shard):
+        mapped_pet_to_anat[subject][pet_file] = anat_file
     return mapped_pet_to_anat
 
+def _query_pet_and_anat(bids_data: Union[BIDSLayout, BIDSScanner], subjects: list, suffixes: list, bulk: bool=True, all_subjects: bool=False):
+    """
+    Yields (subject, pet_files, anat_files) for each subject. In bulk mode all PET and all anatomical files are
+    fetched with one query each and grouped by subject in memory, otherwise two queries are made per subject.
+    If all_subjects is True the subject filter is left out of the bulk queries entirely.
+    """
+    anat_extensions = ["nii", "nii.gz"]
+    if not bulk:
+        for subject in subjects:
+            with instrumentation.stage("query", subject=subject):
+                pet_files = bids_data.get(subject=subject, suffix="pet")
+                anat_files = bids_data.get(suffix=suffixes, subject=subject, extension=anat_extensions)
+            yield subject, pet_files, anat_files
+        return
+
+    subject_filter = {} if all_subjects else {"subject": subjects}
+    grouped = {subject: ([], []) for subject in subjects}
+    # results from pybids are sorted by path, appending keeps that order within each subject
+    with instrumentation.stage("query", bulk=True):
+        queried = (bids_data.get(suffix="pet", **subject_filter),
+                   bids_data.get(suffix=suffixes, extension=anat_extensions, **subject_filter))
+    for position, files in enumerate(queried):
+        for bids_file in files:
+            subject = bids_data.parse_file_entities(bids_file.path).get("subject")
+            if subject in grouped:
+                grouped[subject][position].append(bids_file)
+    for subject in subjects:
+        yield (subject, *grouped[subject])
+
 class PETFrameTimingError(Exception):
     """Raised when frame timing information is inconsistent with NIFTI header or within a sidecar JSON file."""
     pass
 
-def check_nifti_json_frame_consistency(bids_data: Union[pathlib.Path, BIDSLayout], subjects: list=[]):
+def _imap_with_executor(calls, n_jobs: int=1, executor: Union[str, Executor]="thread"):
+    """
+    Lazily runs an iterable of (tag, function, args) calls, optionally spread over a pool of threads or processes,
+    and yields (tag, result) in the order of the calls. A function of None passes args through as the result
+    without making a call. Only a couple of calls per worker are in flight at once so memory stays flat no matter
+    how many calls there are.
+
+    Parameters
+    ----------
+    n_jobs : int, optional
+        Number of workers to use, 1 runs serially on the calling thread and None or -1 uses all available cpus. The
+        default is 1.
+    executor : Union[str, concurrent.futures.Executor], optional
+        Either "thread", "process" or an already running Executor, in which case n_jobs is ignored and the executor
+        is left running for the caller to shut down. The default is "thread".
+    """
+    if n_jobs is None or n_jobs == -1:
+        n_jobs = os.cpu_count() or 1
+    if isinstance(executor, Executor):
+        pool, owned = executor, False
+        n_jobs = getattr(executor, "_max_workers", n_jobs)
+    elif n_jobs == 1:
+        for tag, function, args in calls:
+            yield tag, (args if function is None else function(*args))
+        return
+    elif executor == "thread":
+        pool, owned = ThreadPoolExecutor(max_workers=n_jobs), True
+    elif executor == "process":
+        pool, owned = ProcessPoolExecutor(max_workers=n_jobs), True
+    else:
+        raise ValueError(f"executor must be 'thread', 'process' or a concurrent.futures.Executor, given {executor}.")
+
+    pending = deque()
+    try:
+        for tag, function, args in calls:
+            if function is None:
+                future = Future()
+                future.set_result(args)
+            else:
+                future = pool.submit(function, *args)
+            pending.append((tag, future))
+            while len(pending) >= 2 * n_jobs:
+                tag, future = pending.popleft()
+                yield tag, future.result()
+        while pending:
+            tag, future = pending.popleft()
+            yield tag, future.result()
+    finally:
+        if owned:
+            pool.shutdown(wait=True, cancel_futures=True)
+
+def _sidecar_path(pet_path) -> str:
+    """Builds the path to the sidecar json of a nifti file."""
+    entry_path = pathlib.Path(pet_path)
+    if len(entry_path.suffixes) > 1:
+        return str(entry_path).replace('.nii.gz', '.json')
+    else:
+        return str(entry_path).replace('.nii', '.json')
+
+@functools.lru_cache(maxsize=4096)
+def _load_frame_timing(json_path, size, mtime_ns):
+    """Parses FrameTimesStart and FrameDuration out of a sidecar, size and mtime_ns only serve to key the cache."""
+    with instrumentation.stage("json_read", path=json_path), open(json_path, 'rb') as f:
+        sidecar = orjson.loads(f.read()) if orjson is not None else json.load(f)
+    return tuple(sidecar.get("FrameTimesStart", ())), tuple(sidecar.get("FrameDuration", ()))
+
+def read_frame_timing(json_path) -> tuple:
+    """
+    Reads FrameTimesStart and FrameDuration directly from a sidecar json without going through pybids. Results are
+    cached on the path, size and modification time of the sidecar so that an edited sidecar is read again.
+
+    Parameters
+    ----------
+    json_path : Union[str, pathlib.Path]
+        Path to the sidecar json.
+    return : tuple
+        (FrameTimesStart, FrameDuration) as tuples, either is empty if it's missing from the sidecar.
+    """
+    stat = os.stat(json_path)
+    return _load_frame_timing(str(json_path), stat.st_size, stat.st_mtime_ns)
+
+def _file_fingerprint(path):
+    """Size and modification time of a file, or None if it doesn't exist."""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return [stat.st_size, stat.st_mtime_ns]
+
+class FrameConsistencyManifest:
+    """
+    JSON file remembering the outcome of the frame consistency check for each PET image along with the size and
+    modification time of the image and its sidecar at the time it was checked. Pairs where neither file has changed
+    since don't need to be checked again.
+    """
+
+    def __init__(self, manifest_file: Union[str, pathlib.Path]):
+        self.manifest_file = pathlib.Path(manifest_file)
+        try:
+            with open(self.manifest_file) as f:
+                self.entries = json.load(f)
+        except FileNotFoundError:
+            self.entries = {}
+
+    def lookup(self, pet_path, deep: bool=False):
+        """
+        Returns the current fingerprint of a PET image and its sidecar, and the FrameConsistencyResult recorded for
+        them if neither file has changed since it was recorded with the same depth of checks (None otherwise).
+        """
+        fingerprint = [_file_fingerprint(pet_path), _file_fingerprint(_sidecar_path(pet_path))]
+        entry = self.entries.get(str(pet_path))
+        if entry is not None and entry["fingerprint"] == fingerprint and entry.get("deep", False) == deep and "result" in entry:
+            return fingerprint, FrameConsistencyResult.from_dict(entry["result"])
+        return fingerprint, None
+
+    def record(self, fingerprint, result: FrameConsistencyResult, deep: bool=False):
+        self.entries[str(result.pet_path)] = {"fingerprint": fingerprint, "deep": deep, "result": result.to_dict()}
+
+    def save(self):
+        """Writes the manifest to a temporary file and renames it over the previous manifest."""
+        self.manifest_file.parent.mkdir(parents=True, exist_ok=True)
+        _write_json_atomically(self.manifest_file, self.entries, indent=4, sort_keys=True)
+
+def _read_pet_header(pet_path, header_only=True) -> dict:
+    """Reads the header fields the frame checks need, see check_nifti_json_frame_consistency for header_only."""
+    with instrumentation.stage("header_read", path=pet_path, header_only=header_only):
+        if header_only:
+            return read_nifti_header(pet_path)
+        else:
+            import nibabel
+            nibabel_header = nibabel.load(pet_path).header
+            return {"dim": nibabel_header.get("dim"), "pixdim": nibabel_header.get("pixdim"), "xyzt_units": int(nibabel_header.get("xyzt_units"))}
+
+def _frame_consistency_result(subject, pet_path, header, frame_times_start, frame_duration, deep=False) -> FrameConsistencyResult:
+    """Compares a header read by _read_pet_header against the frame timing of the image's sidecar."""
+    timing_issues = None
+    if deep:
+        from .timing import validate_frame_timing, header_frame_duration
+        timing_issues = validate_frame_timing(frame_times_start, frame_duration, header_duration=header_frame_duration(header))
+    return FrameConsistencyResult(subject, pet_path, _sidecar_path(pet_path), header["dim"][4], len(frame_times_start), len(frame_duration), timing_issues)
+
+def _resolve_frame_timing(pet_path, frame_times_start, frame_duration) -> tuple:
+    """Reads whichever of frame_times_start and frame_duration is None from the image's sidecar."""
+    if frame_times_start is None or frame_duration is None:
+        sidecar_times_start, sidecar_duration = read_frame_timing(_sidecar_path(pet_path))
+        frame_times_start = sidecar_times_start if frame_times_start is None else frame_times_start
+        frame_duration = sidecar_duration if frame_duration is None else frame_duration
+    return frame_times_start, frame_duration
+
+def _check_pet_frame_timing(subject, pet_path, frame_times_start, frame_duration, header_only=True, deep=False) -> FrameConsistencyResult:
+    """
+    Compares the number of frames in a PET image's header against the FrameTimesStart and FrameDuration entries
+    of its sidecar. Kept at module level and free of pybids objects so that it can be sent to a process pool.
+    Whichever of frame_times_start and frame_duration is None is read from the sidecar file. With deep the timing
+    values themselves are validated as well.
+    """
+    header = _read_pet_header(pet_path, header_only=header_only)
+    frame_times_start, frame_duration = _resolve_frame_timing(pet_path, frame_times_start, frame_duration)
+    return _frame_consistency_result(subject, pet_path, header, frame_times_start, frame_duration, deep=deep)
+
+def _check_pet_frame_counts(subject, pet_path, frame_times_start, frame_duration, header_only=True, deep=False) -> tuple:
+    """
+    Worker of the dataset wide checks, _check_pet_frame_timing with the timing validation left to the caller so
+    that it can be done for many images at once with _TimingBatch. Returns the result and, with deep, the
+    (frame_times_start, frame_duration, header_duration) to validate, else None.
+    """
+    header = _read_pet_header(pet_path, header_only=header_only)
+    frame_times_start, frame_duration = _resolve_frame_timing(pet_path, frame_times_start, frame_duration)
+    result = _frame_consistency_result(subject, pet_path, header, frame_times_start, frame_duration)
+    if not deep:
+        return result, None
+    from .timing import header_frame_duration
+    return result, (frame_times_start, frame_duration, header_frame_duration(header))
+
+class _TimingBatch:
+    """
+    Holds back checked results until the frame timing of batch_size images can be validated with a single call to
+    petutils.timing.validate_frame_timing_batch, results are released in the order they were added.
+    """
+
+    def __init__(self, batch_size: int=None):
+        self.batch_size = batch_size if batch_size is not None else TIMING_BATCH_SIZE
+        self._held = []
+        self._timings = []
+
+    def add(self, tag, result: FrameConsistencyResult, timing: tuple=None) -> list:
+        """Adds a result, with the timing returned by _check_pet_frame_counts if it still needs validating, and
+        returns the (tag, result) pairs ready to be released."""
+        self._held.append((tag, result))
+        if timing is not None:
+            self._timings.append((result, timing))
+        if not self._timings or len(self._timings) >= self.batch_size:
+            return self.flush()
+        return []
+
+    def flush(self) -> list:
+        """Validates the timings held and returns every (tag, result) pair held."""
+        if self._timings:
+            from .timing import validate_frame_timing_batch
+            starts, durations, header_durations = (list(values) for values in zip(*(timing for _, timing in self._timings)))
+            with instrumentation.stage("timing_batch", images=len(self._timings)):
+                issues = validate_frame_timing_batch(starts, durations, header_durations)
+            for (result, _), timing_issues in zip(self._timings, issues):
+                result.timing_issues = timing_issues
+        ready, self._held, self._timings = self._held, [], []
+        return ready
+
+def _pet_images(bids_data: Union[BIDSLayout, BIDSScanner], subjects: list):
+    """Yields (subject, entry) for the PET images of each subject, in the order pybids returns them."""
+    for subject in subjects:
+        with instrumentation.stage("query", subject=subject):
+            pet_files = bids_data.get(subject=subject, suffix="pet", extension=['nii', 'nii.gz'])
+        for entry in pet_files:
+            if _is_image(entry):
+                yield subject, entry
+
+def iter_frame_consistency(bids_data: Union[pathlib.Path, BIDSLayout, BIDSScanner], subjects: list=[], header_only: bool=True, n_jobs: int=1, executor: Union[str, Executor]="thread",
+                           manifest_file: Union[str, pathlib.Path]=None, read_sidecar: bool=False, deep: bool=False, shard: tuple=None,
+                           timing_batch_size: int=None):
+    """
+    Generator version of check_nifti_json_frame_consistency, yields a FrameConsistencyResult for every PET image as
+    soon as it has been checked, consistent or not. Results come in the same order regardless of n_jobs and never
+    raise a PETFrameTimingError. Takes the same arguments as check_nifti_json_frame_consistency, pass the results to
+    FrameConsistencyTable.from_results to filter or export them in bulk.
+
+    With deep, results are held back until the timings of timing_batch_size images have been checked (or the images
+    run out) and are then validated and yielded together, so a result can come up to timing_batch_size - 1 images
+    late. Pass timing_batch_size=1 to get each result as soon as it's checked at the cost of batching.
+    """
+    bids_data = _load_bids_data(bids_data, index_metadata=not read_sidecar)
+
+    # return all subjects if no list of subjects is given
+    if subjects == []:
+        subjects = bids_data.get_subjects()
+    subjects = select_shard(subjects, shard)
+
+    # in incremental mode only pairs that changed since they were last recorded are checked
+    manifest = FrameConsistencyManifest(manifest_file) if manifest_file is not None else None
+
+    def calls():
+        # pybids queries stay on this thread, only the per file header checks are handed to the executor
+        for subject, entry in _pet_images(bids_data, subjects):
+            fingerprint, recorded = manifest.lookup(entry.path, deep=deep) if manifest is not None else (None, None)
+            if recorded is not None:
+                instrumentation.count("manifest_hit", path=entry.path)
+                recorded.subject = subject
+                yield None, None, (recorded, None)
+                continue
+            # frame timing left as None is read from the sidecar by the worker
+            entities = {} if read_sidecar else entry.entities
+            yield (fingerprint, _check_pet_frame_counts,
+                   (subject, entry.path, entities.get('FrameTimesStart'), entities.get('FrameDuration'), header_only, deep))
+
+    def checked():
+        # with deep the timing of the images checked is validated a batch at a time on this thread
+        batch = _TimingBatch(timing_batch_size)
+        for fingerprint, (result, timing) in _imap_with_executor(calls(), n_jobs=n_jobs, executor=executor):
+            yield from batch.add(fingerprint, result, timing)
+        yield from batch.flush()
+
+    try:
+        for fingerprint, result in checked():
+            if fingerprint is not None:
+                manifest.record(fingerprint, result, deep=deep)
+            yield result
+    finally:
+        if manifest is not None:
+            manifest.save()
+
+def check_nifti_json_frame_consistency(bids_data: Union[pathlib.Path, BIDSLayout, BIDSScanner], subjects: list=[], header_only: bool=True, n_jobs: int=1, executor: Union[str, Executor]="thread",
+                                       manifest_file: Union[str, pathlib.Path]=None, read_sidecar: bool=False, deep: bool=False, shard: tuple=None,
+                                       timing_batch_size: int=None):
     """
     This function checks the consistency of the frame timing information in the NIFTI header and the sidecar JSON file as well as 
     the number of entries between FrameTimesStart and FrameDuration within the sidecar JSON file. Intended to be used to either 
@@ -119,21 +580,49 @@ def check_nifti_json_frame_consistency(bids_data: Union[pathlib.Path, BIDSLayout
 
     Parameters
     ----------
-    bids_data : Union[pathlib.Path, BIDSLayout]
-        The path to the BIDS dataset or a BIDSLayout object.
+    bids_data : Union[pathlib.Path, BIDSLayout, BIDSScanner]
+        The path to the BIDS dataset, a BIDSLayout object or a BIDSScanner. Layouts built from a path are cached, see
+        petutils.layout.get_layout.
     subjects : list, optional
         A list of subjects to check. If not given, all subjects in the dataset will be checked. If a single subject is given
         then an exception will be raised if any inconsistencies are found. The default is [].
+    header_only : bool, optional
+        Read the number of frames by decoding only the nifti header instead of loading each image with nibabel,
+        this avoids decompressing whole .nii.gz files. The default is True.
+    n_jobs : int, optional
+        Number of threads or processes used to read the PET headers, None or -1 uses all available cpus. Reads are
+        spread across the pool but results are merged in the same order as a serial run. The default is 1.
+    executor : Union[str, concurrent.futures.Executor], optional
+        "thread" or "process" to create a pool of n_jobs workers, or an existing Executor to submit the checks to.
+        Threads are the better choice when latency of the storage dominates. The default is "thread".
+    manifest_file : Union[str, pathlib.Path], optional
+        JSON file in which the result for each PET image is stored along with the size and modification time of the
+        image and its sidecar. On later calls only pairs that changed are checked again, the rest reuse the stored
+        result. The default is None, which checks every pair.
+    read_sidecar : bool, optional
+        Read FrameTimesStart and FrameDuration straight from each image's own sidecar json rather than from the
+        metadata pybids indexed, metadata inherited from sidecars higher up the tree is not considered. Paths are
+        then indexed with index_metadata=False which makes building the layout much cheaper. Sidecars are also read
+        directly for any image pybids has no frame timing metadata for. The default is False.
+    deep : bool, optional
+        Also validate the timing values: positive durations, increasing start times, no overlaps or gaps between
+        consecutive frames and agreement with the frame duration in the header's pixdim[4], see
+        petutils.timing.validate_frame_timing. The timings of timing_batch_size images are validated together with
+        petutils.timing.validate_frame_timing_batch. Problems found are reported as errors. The default is False.
+    shard : tuple, optional
+        (index, count) to only check the subjects that petutils.sharding.shard_of assigns to shard index of count,
+        the results of all shards can be combined with petutils.sharding.merge_partials. The default is None,
+        which checks every subject.
+    timing_batch_size : int, optional
+        Number of images whose timing is validated at once with deep. The default is None, which uses
+        TIMING_BATCH_SIZE.
     return : dict
         A dictionary of dictionaries containing the inconsistent files for each subject as well as the errors found.
-        subject -> {errors: [error strings], files: {pet_file: json_file}}
+        subject -> {errors: [error strings], files: {pet_file: json_file}}, errors holds the errors of every
+        inconsistent file of the subject. Use iter_frame_consistency to receive a structured result for each file as
+        it's checked instead.
     """
-    if type(bids_data) is BIDSLayout:
-        pass
-    elif isinstance(bids_data, (pathlib.PosixPath, pathlib.WindowsPath)) and bids_data.exists():
-        bids_data = BIDSLayout(bids_data)
-    else:
-        raise TypeError(f"{bids_data} must be a BIDSLayout or valid Path object, given type: {type(bids_data)}.")
+    bids_data = _load_bids_data(bids_data, index_metadata=not read_sidecar)
     
     # We change the behavior of this function to raise an error if a single subject is given otherwise it returns
     # a dictionary of all the inconsistent files for each subject
@@ -142,48 +631,32 @@ def check_nifti_json_frame_consistency(bids_data: Union[pathlib.Path, BIDSLayout
     else:
         check_single_subject = False
 
-    # return all subjects if no list of subjects is given
-    if subjects == []:
-        subjects = bids_data.get_subjects()
+    checked_files = iter_frame_consistency(bids_data, subjects=subjects, header_only=header_only, n_jobs=n_jobs, executor=executor,
+                                           manifest_file=manifest_file, read_sidecar=read_sidecar, deep=deep, shard=shard,
+                                           timing_batch_size=timing_batch_size)
+    try:
+        return _collect_inconsistent_files(checked_files, select_shard(subjects if subjects != [] else bids_data.get_subjects(), shard), check_single_subject)
+    finally:
+        checked_files.close()
 
-    # inconsistent files will be stored as image files and their associated sidecar json files
+def _collect_inconsistent_files(checked_files, subjects: list, check_single_subject: bool) -> dict:
+    """Gathers FrameConsistencyResults into the dictionary check_nifti_json_frame_consistency returns."""
     inconsistent_files = {}
     for subject in subjects:
         inconsistent_files[subject] = {'errors': [], 'files': {}}
-        pet_files = bids_data.get(subject=subject, suffix="pet", extension=['nii', 'nii.gz'])
-        for entry in pet_files:
-            if type(entry) is BIDSImageFile:
-                entry_image = entry.get_image()
-                nii_frames = entry_image.header.get("dim")[4]
-                error_string = []
-                # build the path to the sidecar json
-                entry_path = pathlib.Path(entry.path)
-                if len(entry_path.suffixes) > 1:
-                    entry_json = str(entry_path).replace('.nii.gz', '.json')
-                else:
-                    entry_json = str(entry_path).replace('.nii', '.json')
-                
-                # check that each frame timing info is the correct length as implied by the nifti header
-                frame_timings = {"FrameTimesStart": len(entry.entities['FrameTimesStart']), "FrameDuration": len(entry.entities['FrameDuration'])}
-                if frame_timings["FrameTimesStart"] != frame_timings["FrameDuration"]:
-                        error_string.append(f"Number of entries for FrameTimesStart -> {frame_timings['FrameTimesStart']} and FrameDuration -> {frame_timings['FrameDuration']} do not match in {entry_json}")
-                        inconsistent_files[subject]['files'][entry.path] = entry_json
-                if frame_timings["FrameTimesStart"] != nii_frames:
-                        error_string.append(f"Number frames in {entry.path} header -> {nii_frames} does not match the number of frames in FrameTimesStart -> {frame_timings['FrameTimesStart']} at {entry_json}")
-                        inconsistent_files[subject]['files'][entry.path] = entry_json
-                if frame_timings["FrameDuration"] != nii_frames:
-                        error_string.append(f"Number frames in {entry.path} header -> {nii_frames} does not match the number of frames in FrameDuration -> {frame_timings['FrameDuration']} at {entry_json}")
-                        inconsistent_files[subject]['files'][entry.path] = entry_json
-
-                
-                if len(error_string) > 0:
-                        inconsistent_files[subject]['errors'] = error_string
-
-                if check_single_subject:
-                    # concat error string 
-                    error_string = '\n'.join(error_string)
-                    # raise error 
-                    if len(error_string) > 0:
-                        raise PETFrameTimingError(error_string)
-
-    return inconsistent_files
\ No newline at end of file
+
+    for result in checked_files:
+        error_string = result.errors
+        # inconsistent files will be stored as image files and their associated sidecar json files
+        if len(error_string) > 0:
+            inconsistent_files[result.subject]['files'][result.pet_path] = result.json_path
+            inconsistent_files[result.subject]['errors'].extend(error_string)
+
+        if check_single_subject:
+            # concat error string 
+            error_string = '\n'.join(error_string)
+            # raise error 
+            if len(error_string) > 0:
+                raise PETFrameTimingError(error_string)
+
+    return inconsistent_files
@@ -0,0 +1,142 @@
+from __future__ import annotations
+import csv
+import json
+from typing import TYPE_CHECKING
+
+# numpy is only imported once a table is built
+if TYPE_CHECKING:
+    import numpy
+
+
+class FrameConsistencyResult:
+    """
+    Outcome of checking one PET image against its sidecar: the number of frames in the nifti header (nii_frames)
+    and the number of entries in FrameTimesStart (n_start) and FrameDuration (n_duration). When the frame timing
+    itself was validated, timing_issues maps each problem found to the frames affected, see
+    petutils.timing.validate_frame_timing.
+    """
+    __slots__ = ("subject", "pet_path", "json_path", "nii_frames", "n_start", "n_duration", "timing_issues")
+
+    def __init__(self, subject, pet_path, json_path, nii_frames, n_start, n_duration, timing_issues=None):
+        self.subject = subject
+        self.pet_path = pet_path
+        self.json_path = json_path
+        self.nii_frames = int(nii_frames)
+        self.n_start = int(n_start)
+        self.n_duration = int(n_duration)
+        self.timing_issues = dict(timing_issues) if timing_issues else {}
+
+    def __eq__(self, other):
+        return isinstance(other, FrameConsistencyResult) and self.to_dict() == other.to_dict()
+
+    def __repr__(self):
+        fields = ", ".join(f"{field}={getattr(self, field)!r}" for field in self.__slots__)
+        return f"FrameConsistencyResult({fields})"
+
+    @property
+    def consistent(self) -> bool:
+        return self.nii_frames == self.n_start == self.n_duration and not self.timing_issues
+
+    @property
+    def errors(self) -> list:
+        """The inconsistencies found, formatted as human readable strings."""
+        errors = []
+        if self.n_start != self.n_duration:
+            errors.append(f"Number of entries for FrameTimesStart -> {self.n_start} and FrameDuration -> {self.n_duration} do not match in {self.json_path}")
+        if self.n_start != self.nii_frames:
+            errors.append(f"Number frames in {self.pet_path} header -> {self.nii_frames} does not match the number of frames in FrameTimesStart -> {self.n_start} at {self.json_path}")
+        if self.n_duration != self.nii_frames:
+            errors.append(f"Number frames in {self.pet_path} header -> {self.nii_frames} does not match the number of frames in FrameDuration -> {self.n_duration} at {self.json_path}")
+        for issue, frames in self.timing_issues.items():
+            errors.append(f"Frame timing issue {issue} at frames {frames} in {self.json_path}")
+        return errors
+
+    def to_dict(self) -> dict:
+        return {field: getattr(self, field) for field in self.__slots__}
+
+    @classmethod
+    def from_dict(cls, values: dict):
+        return cls(*(values[field] for field in cls.__slots__))
+
+
+class FrameConsistencyTable:
+    """
+    Column oriented collection of FrameConsistencyResults held in numpy arrays, so that results for thousands of
+    subjects can be filtered with vectorized comparisons instead of parsing error strings. numpy is only imported
+    once a table is built.
+
+    Each field of FrameConsistencyResult is a column, string columns are object arrays and the frame counts int64.
+    timing_issues is an object array of dictionaries and is written out as JSON by to_csv.
+    """
+    COLUMNS = FrameConsistencyResult.__slots__
+    COUNT_COLUMNS = ("nii_frames", "n_start", "n_duration")
+
+    def __init__(self, columns: dict):
+        import numpy
+        lengths = {len(values) for values in columns.values()}
+        if set(columns) != set(self.COLUMNS) or len(lengths) > 1:
+            raise ValueError(f"A FrameConsistencyTable needs equally long columns for each of {self.COLUMNS}.")
+        self.columns = {
+            name: numpy.asarray(columns[name], dtype=numpy.int64 if name in self.COUNT_COLUMNS else object)
+            for name in self.COLUMNS
+        }
+
+    @classmethod
+    def from_results(cls, results):
+        """Builds a table from an iterable of FrameConsistencyResults, e.g. the output of iter_frame_consistency."""
+        columns = {name: [] for name in cls.COLUMNS}
+        for result in results:
+            for name in cls.COLUMNS:
+                columns[name].append(getattr(result, name))
+        return cls(columns)
+
+    def __len__(self):
+        return len(self.columns["subject"])
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def __iter__(self):
+        for row in zip(*(self.columns[name] for name in self.COLUMNS)):
+            yield FrameConsistencyResult(*row)
+
+    @property
+    def start_duration_mismatch(self) -> numpy.ndarray:
+        return self.columns["n_start"] != self.columns["n_duration"]
+
+    @property
+    def header_mismatch(self) -> numpy.ndarray:
+        return (self.columns["nii_frames"] != self.columns["n_start"]) | (self.columns["nii_frames"] != self.columns["n_duration"])
+
+    @property
+    def timing_problem(self) -> numpy.ndarray:
+        import numpy
+        return numpy.array([bool(issues) for issues in self.columns["timing_issues"]], dtype=bool)
+
+    @property
+    def consistent(self) -> numpy.ndarray:
+        return ~(self.start_duration_mismatch | self.header_mismatch | self.timing_problem)
+
+    def filter(self, mask) -> "FrameConsistencyTable":
+        """Returns the rows where the boolean mask is True."""
+        import numpy
+        mask = numpy.asarray(mask, dtype=bool)
+        return FrameConsistencyTable({name: values[mask] for name, values in self.columns.items()})
+
+    def inconsistent(self) -> "FrameConsistencyTable":
+        return self.filter(~self.consistent)
+
+    def to_csv(self, path, delimiter: str=","):
+        """Writes the table with a header row to a path or an open text file, pass delimiter="\\t" for a TSV."""
+        if hasattr(path, "write"):
+            self._write_csv(path, delimiter)
+            return
+        with open(path, "w", newline="") as f:
+            self._write_csv(f, delimiter)
+
+    def _write_csv(self, f, delimiter):
+        writer = csv.writer(f, delimiter=delimiter)
+        writer.writerow(self.COLUMNS)
+        columns = [self.columns[name].tolist() for name in self.COLUMNS]
+        columns[self.COLUMNS.index("timing_issues")] = [json.dumps(issues) for issues in self.columns["timing_issues"]]
+        writer.writerows(zip(*columns))
@@ -0,0 +1,151 @@
+import os
+import re
+import pathlib
+from typing import Union
+
+# sub-<label>[_ses-<label>][_<key>-<value>...]_<suffix><extension>
+BIDS_FILENAME = re.compile(
+    r"^sub-(?P<subject>[a-zA-Z0-9]+)"
+    r"(?:_ses-(?P<session>[a-zA-Z0-9]+))?"
+    r"(?P<entities>(?:_[a-zA-Z]+-[a-zA-Z0-9+]+)*)"
+    r"_(?P<suffix>[a-zA-Z0-9]+)"
+    r"(?P<extension>\.[a-zA-Z0-9.]+)$"
+)
+BIDS_ENTITY = re.compile(r"_([a-zA-Z]+)-([a-zA-Z0-9+]+)")
+
+# short keys in filenames and the names pybids uses for them
+ENTITY_NAMES = {
+    "task": "task", "trc": "tracer", "acq": "acquisition", "ce": "ceagent", "rec": "reconstruction",
+    "dir": "direction", "run": "run", "echo": "echo", "part": "part", "inv": "inversion", "mt": "mt",
+    "flip": "flip", "space": "space", "desc": "desc",
+}
+IMAGE_EXTENSIONS = (".nii", ".nii.gz")
+
+
+class BIDSRecord:
+    """A file found by BIDSScanner along with the entities parsed from its name."""
+    __slots__ = ("path", "subject", "session", "datatype", "suffix", "extension", "other_entities")
+
+    def __init__(self, path, subject, session, datatype, suffix, extension, other_entities):
+        self.path = path
+        self.subject = subject
+        self.session = session
+        self.datatype = datatype
+        self.suffix = suffix
+        self.extension = extension
+        self.other_entities = other_entities
+
+    @property
+    def is_image(self) -> bool:
+        return self.extension in IMAGE_EXTENSIONS
+
+    @property
+    def entities(self) -> dict:
+        """Entities in the same form pybids reports them, without any metadata from sidecars."""
+        entities = {"subject": self.subject}
+        if self.session is not None:
+            entities["session"] = self.session
+        entities.update(self.other_entities)
+        entities.update({"datatype": self.datatype, "suffix": self.suffix, "extension": self.extension})
+        return entities
+
+    def get_entities(self, metadata=False) -> dict:
+        return self.entities
+
+    def __repr__(self):
+        return f"<BIDSRecord {self.path}>"
+
+
+def parse_bids_filename(filename: str) -> Union[dict, None]:
+    """Parses the entities of a BIDS filename, returns None if the name doesn't follow the BIDS pattern."""
+    match = BIDS_FILENAME.match(filename)
+    if match is None:
+        return None
+    entities = {"subject": match["subject"]}
+    if match["session"] is not None:
+        entities["session"] = match["session"]
+    for key, value in BIDS_ENTITY.findall(match["entities"]):
+        entities[ENTITY_NAMES.get(key, key)] = value
+    entities["suffix"] = match["suffix"]
+    entities["extension"] = match["extension"]
+    return entities
+
+
+def _listify(value):
+    if value is None:
+        return None
+    return [value] if isinstance(value, (str, int)) else list(value)
+
+
+class BIDSScanner:
+    """
+    A lightweight stand in for a BIDSLayout that only walks sub-*/[ses-*/]<datatype> folders with os.scandir and
+    parses entities out of the filenames, nothing is validated and no sidecar metadata is read. It implements the
+    parts of the BIDSLayout interface used by collect_anat_and_pet and check_nifti_json_frame_consistency
+    (get_subjects, get and parse_file_entities), so it can be handed to either in place of a layout.
+    """
+
+    def __init__(self, root: Union[str, pathlib.Path], datatypes=("pet", "anat")):
+        self.root = pathlib.Path(root).absolute()
+        if not self.root.is_dir():
+            raise TypeError(f"{root} must be an existing folder.")
+        self.datatypes = tuple(datatypes)
+        self._records = None
+
+    def _scan_datatype_folders(self, folder, subject, session, records):
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                if entry.name in self.datatypes and entry.is_dir():
+                    self._scan_files(entry.path, subject, session, entry.name, records)
+
+    def _scan_files(self, folder, subject, session, datatype, records):
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                if entry.name.startswith('.') or not entry.is_file():
+                    continue
+                entities = parse_bids_filename(entry.name)
+                if entities is None or entities["subject"] != subject or entities.get("session") != session:
+                    continue
+                other_entities = {k: v for k, v in entities.items() if k not in ("subject", "session", "suffix", "extension")}
+                records.append(BIDSRecord(entry.path, subject, session, datatype, entities["suffix"], entities["extension"], other_entities))
+
+    def scan(self) -> list:
+        """Walks the dataset and returns the records found, sorted by path. Called automatically on first use."""
+        records = []
+        with os.scandir(self.root) as subjects:
+            subject_folders = [entry for entry in subjects if entry.name.startswith("sub-") and entry.is_dir()]
+        for subject_folder in subject_folders:
+            subject = subject_folder.name[len("sub-"):]
+            self._scan_datatype_folders(subject_folder.path, subject, None, records)
+            with os.scandir(subject_folder.path) as sessions:
+                session_folders = [entry for entry in sessions if entry.name.startswith("ses-") and entry.is_dir()]
+            for session_folder in session_folders:
+                self._scan_datatype_folders(session_folder.path, subject, session_folder.name[len("ses-"):], records)
+        self._records = sorted(records, key=lambda record: record.path)
+        return self._records
+
+    @property
+    def records(self) -> list:
+        if self._records is None:
+            self.scan()
+        return self._records
+
+    def get_subjects(self) -> list:
+        return sorted({record.subject for record in self.records})
+
+    def get(self, subject=None, session=None, suffix=None, extension=None, datatype=None) -> list:
+        """Returns the records matching every filter given, each filter can be a single value or a list."""
+        filters = {"subject": _listify(subject), "session": _listify(session), "suffix": _listify(suffix), "datatype": _listify(datatype)}
+        filters = {key: {str(v) for v in values} for key, values in filters.items() if values is not None}
+        extensions = _listify(extension)
+        if extensions is not None:
+            extensions = {e if e.startswith('.') else f".{e}" for e in extensions}
+        return [
+            record for record in self.records
+            if all(getattr(record, key) in values for key, values in filters.items())
+            and (extensions is None or record.extension in extensions)
+        ]
+
+    def parse_file_entities(self, filename) -> dict:
+        entities = parse_bids_filename(os.path.basename(filename))
+        return {} if entities is None else entities
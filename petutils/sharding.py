@@ -0,0 +1,126 @@
+import json
+import zlib
+import pathlib
+from typing import Union
+
+# Splitting a run over many nodes: each node processes the subjects of its shard (see select_shard), writes a partial
+# result file with write_partial, and merge_partials combines the partial files of all shards afterwards. Subjects
+# are assigned by a hash of their label so the assignment is stable across nodes, runs and dataset growth.
+
+PARTIAL_KINDS = ("frame_consistency", "anat_and_pet")
+
+
+class ShardMergeError(Exception):
+    """Raised when partial result files don't add up to one complete sharded run."""
+    pass
+
+
+def shard_of(subject: str, n_shards: int) -> int:
+    """The shard, from 0 to n_shards - 1, a subject label belongs to."""
+    return zlib.crc32(str(subject).encode()) % n_shards
+
+
+def parse_shard(shard: str) -> tuple:
+    """Parses "i/N" into (i, N), shards are numbered from 0 to N - 1."""
+    try:
+        index, n_shards = (int(part) for part in shard.split("/"))
+    except ValueError:
+        raise ValueError(f"shard must look like i/N, given {shard!r}.") from None
+    check_shard((index, n_shards))
+    return index, n_shards
+
+
+def check_shard(shard: tuple):
+    index, n_shards = shard
+    if n_shards < 1 or not 0 <= index < n_shards:
+        raise ValueError(f"shard index must be between 0 and {n_shards - 1}, given {index}/{n_shards}.")
+
+
+def select_shard(subjects: list, shard: Union[tuple, None]) -> list:
+    """The subjects that belong to shard (index, n_shards), in their original order. A shard of None keeps all."""
+    if shard is None:
+        return list(subjects)
+    check_shard(shard)
+    index, n_shards = shard
+    return [subject for subject in subjects if shard_of(subject, n_shards) == index]
+
+
+def write_partial(partial_file: Union[str, pathlib.Path], kind: str, shard: tuple, subjects: list, results):
+    """
+    Writes the results of one shard.
+
+    Parameters
+    ----------
+    partial_file : Union[str, pathlib.Path]
+        JSON file to write, replaced atomically.
+    kind : str
+        "frame_consistency" for a list of FrameConsistencyResults or "anat_and_pet" for the mapping returned by
+        collect_anat_and_pet.
+    shard : tuple
+        (index, n_shards) of the shard.
+    subjects : list
+        The subjects the shard covered, including those without any PET image.
+    results : Union[list, dict]
+    """
+    from .petutils import _write_json_atomically
+    if kind not in PARTIAL_KINDS:
+        raise ValueError(f"kind must be one of {PARTIAL_KINDS}, given {kind}.")
+    if kind == "frame_consistency":
+        results = [result.to_dict() for result in results]
+    partial = {"kind": kind, "shard": list(shard), "subjects": list(subjects), "results": results}
+    _write_json_atomically(partial_file, partial, indent=4)
+
+
+def read_partials(partial_files: list) -> tuple:
+    """
+    Reads the partial files of every shard of a run and checks that each shard is present exactly once.
+
+    return : tuple
+        (kind, subjects, results): the subjects of all shards sorted, and the results of each subject in that
+        order, FrameConsistencyResults in a list for "frame_consistency" and a subject -> {pet: anat} dictionary for
+        "anat_and_pet".
+    """
+    from .results import FrameConsistencyResult
+    partials = []
+    for partial_file in partial_files:
+        with open(partial_file) as f:
+            partials.append(json.load(f))
+    if not partials:
+        raise ShardMergeError("No partial result files given.")
+
+    kinds = {partial["kind"] for partial in partials}
+    counts = {partial["shard"][1] for partial in partials}
+    if len(kinds) > 1 or len(counts) > 1:
+        raise ShardMergeError(f"Partial files come from different runs: kinds {sorted(kinds)}, shard counts {sorted(counts)}.")
+    kind, n_shards = kinds.pop(), counts.pop()
+    indices = sorted(partial["shard"][0] for partial in partials)
+    if indices != list(range(n_shards)):
+        missing = sorted(set(range(n_shards)) - set(indices))
+        duplicated = sorted({index for index in indices if indices.count(index) > 1})
+        raise ShardMergeError(f"Expected each of {n_shards} shards once, missing {missing}, duplicated {duplicated}.")
+
+    subjects = sorted(subject for partial in partials for subject in partial["subjects"])
+    if kind == "anat_and_pet":
+        mapping = {}
+        for partial in partials:
+            mapping.update(partial["results"])
+        return kind, subjects, {subject: mapping.get(subject, {}) for subject in subjects}
+
+    by_subject = {subject: [] for subject in subjects}
+    for partial in partials:
+        for values in partial["results"]:
+            by_subject[values["subject"]].append(FrameConsistencyResult.from_dict(values))
+    return kind, subjects, [result for subject in subjects for result in by_subject[subject]]
+
+
+def merge_partials(partial_files: list) -> Union[dict, tuple]:
+    """
+    Combines the partial files of all shards into the output of the unsharded call: the mapping of
+    collect_anat_and_pet for "anat_and_pet" partials, and for "frame_consistency" partials a tuple of the
+    FrameConsistencyResults of every image and the dictionary check_nifti_json_frame_consistency returns.
+    """
+    from .petutils import _collect_inconsistent_files
+    kind, subjects, results = read_partials(partial_files)
+    if kind == "anat_and_pet":
+        return results
+    return results, _collect_inconsistent_files(results, subjects, check_single_subject=False)
@@ -0,0 +1,102 @@
+import gzip
+import json
+import pathlib
+from typing import Union
+import numpy
+
+# frame timing of the example dataset in data/, repeated or truncated to the number of frames requested
+EXAMPLE_FRAME_DURATION = [20, 20, 20, 60, 60, 60, 120, 120, 120, 300, 300, 600, 600, 600, 600, 600, 600, 600, 600, 600, 600]
+
+
+def frame_timing(n_frames: int) -> tuple:
+    """Returns (FrameTimesStart, FrameDuration) for n_frames contiguous frames."""
+    durations = [EXAMPLE_FRAME_DURATION[min(i, len(EXAMPLE_FRAME_DURATION) - 1)] for i in range(n_frames)]
+    starts = numpy.concatenate(([0], numpy.cumsum(durations)[:-1])).tolist() if n_frames else []
+    return starts, durations
+
+
+def write_nifti(nifti_file: Union[str, pathlib.Path], shape: tuple, dtype=numpy.float32, frame_duration: float=0.0, chunk_size: int=16 * 1024 * 1024):
+    """
+    Writes a NIfTI-1 image of zeros with a real header. The data is streamed out in chunks so that images of many
+    gigabytes can be written without holding them in memory, files ending in .gz are gzipped.
+    """
+    import nibabel
+
+    header = nibabel.Nifti1Header()
+    header.set_data_shape(shape)
+    header.set_data_dtype(dtype)
+    header.set_xyzt_units("mm", "sec")
+    header["pixdim"][1:4] = 1.0
+    if len(shape) > 3:
+        header["pixdim"][4] = frame_duration
+    header.set_data_offset(352)
+    header.set_sform(numpy.eye(4), code=1)
+
+    n_bytes = int(numpy.prod(shape)) * numpy.dtype(dtype).itemsize
+    opener = gzip.open if str(nifti_file).endswith(".gz") else open
+    # level 1 keeps generating large compressed payloads quick
+    kwargs = {"compresslevel": 1} if opener is gzip.open else {}
+    with opener(nifti_file, "wb", **kwargs) as f:
+        header.write_to(f)
+        zeros = bytes(min(chunk_size, n_bytes))
+        remaining = n_bytes
+        while remaining > 0:
+            f.write(zeros[:min(chunk_size, remaining)])
+            remaining -= chunk_size
+    return nifti_file
+
+
+def generate_dataset(root: Union[str, pathlib.Path], n_subjects: int=2, n_sessions: int=1, n_runs: int=1, n_frames: int=21,
+                     image_shape: tuple=(2, 2, 2), compress: bool=True, with_anat: bool=True) -> pathlib.Path:
+    """
+    Builds a synthetic BIDS PET dataset of n_subjects x n_sessions x n_runs PET images, each a 4D nifti with a real
+    header of image_shape x n_frames voxels and a sidecar whose frame timing matches it, plus one T1w per session.
+    Large image_shapes can be used to measure I/O bound steps, the data is streamed out (see write_nifti).
+
+    Parameters
+    ----------
+    root : Union[str, pathlib.Path]
+        Folder to create the dataset in.
+    n_subjects, n_sessions, n_runs : int, optional
+        Size of the dataset. Sessions and runs are left out of the filenames when there is only one of them.
+    n_frames : int, optional
+        Frames per PET image. The default is 21, as in the example dataset.
+    image_shape : tuple, optional
+        Spatial shape of the PET images. The default is (2, 2, 2).
+    compress : bool, optional
+        Write .nii.gz rather than .nii images. The default is True.
+    with_anat : bool, optional
+        Write a T1w image for every session. The default is True.
+    return : pathlib.Path
+        The root of the dataset.
+    """
+    root = pathlib.Path(root)
+    root.mkdir(parents=True, exist_ok=True)
+    with open(root / "dataset_description.json", "w") as f:
+        json.dump({"Name": "Synthetic PET dataset", "BIDSVersion": "1.8.0"}, f, indent=4)
+
+    extension = ".nii.gz" if compress else ".nii"
+    starts, durations = frame_timing(n_frames)
+    sidecar = {
+        "Manufacturer": "Synthetic", "Units": "Bq/mL", "TracerName": "DASB", "TracerRadionuclide": "C11",
+        "ModeOfAdministration": "bolus", "TimeZero": "00:00:00", "ScanStart": 0, "InjectionStart": 0,
+        "FrameTimesStart": starts, "FrameDuration": durations,
+    }
+    for subject in range(1, n_subjects + 1):
+        for session in range(1, n_sessions + 1):
+            prefix = f"sub-{subject:03d}" + (f"_ses-{session:02d}" if n_sessions > 1 else "")
+            folder = root / f"sub-{subject:03d}"
+            if n_sessions > 1:
+                folder = folder / f"ses-{session:02d}"
+            (folder / "pet").mkdir(parents=True, exist_ok=True)
+            if with_anat:
+                (folder / "anat").mkdir(parents=True, exist_ok=True)
+                write_nifti(folder / "anat" / f"{prefix}_T1w{extension}", (4, 4, 4), dtype=numpy.int16)
+                with open(folder / "anat" / f"{prefix}_T1w.json", "w") as f:
+                    json.dump({"Manufacturer": "Synthetic"}, f)
+            for run in range(1, n_runs + 1):
+                pet_prefix = prefix + (f"_run-{run:02d}" if n_runs > 1 else "")
+                write_nifti(folder / "pet" / f"{pet_prefix}_pet{extension}", tuple(image_shape) + (n_frames,))
+                with open(folder / "pet" / f"{pet_prefix}_pet.json", "w") as f:
+                    json.dump(sidecar, f, indent=4)
+    return root
@@ -0,0 +1,89 @@
+import numpy
+
+# seconds per unit for the time bits of the nifti xyzt_units field, unknown units are taken to be seconds
+NIFTI_TIME_UNITS = {0: 1.0, 8: 1.0, 16: 1e-3, 24: 1e-6}
+
+# the kinds of timing problems reported, each maps to the indices of the frames where it occurs
+TIMING_ISSUES = ("non_positive_duration", "not_increasing", "overlap", "gap", "header_duration_mismatch")
+
+
+def header_frame_duration(header: dict) -> float:
+    """Frame duration in seconds implied by pixdim[4] of a header from petutils.nifti.read_nifti_header."""
+    return float(header["pixdim"][4]) * NIFTI_TIME_UNITS.get(header["xyzt_units"] & 0x38, 1.0)
+
+
+def validate_frame_timing_batch(frame_times_start: list, frame_duration: list, header_durations: list=None, tolerance: float=1e-3) -> list:
+    """
+    Checks the frame timing of many PET images at once. The timings of all images are concatenated into single
+    arrays and every check is one vectorized operation across the whole batch, the issues found are then split back
+    out per image.
+
+    For each image the checks are: durations must be positive, FrameTimesStart must be strictly increasing, a frame
+    must not overlap the next one (start[i] + duration[i] > start[i + 1]) nor leave a gap before it
+    (start[i] + duration[i] < start[i + 1]), and if the header gives a frame duration (pixdim[4] > 0) and all frames
+    have the same duration it must agree with it. Images whose FrameTimesStart and FrameDuration differ in length
+    are skipped, that inconsistency is reported by the frame count check.
+
+    Parameters
+    ----------
+    frame_times_start : list
+        FrameTimesStart of each image.
+    frame_duration : list
+        FrameDuration of each image.
+    header_durations : list, optional
+        Frame duration in seconds from each image's header (see header_frame_duration), None or 0 to skip.
+    tolerance : float, optional
+        Slack in seconds allowed when comparing times. The default is 1e-3.
+    return : list
+        For each image a dictionary from the issue names in TIMING_ISSUES to the list of frame indices affected,
+        issues that don't occur are left out.
+    """
+    n_images = len(frame_times_start)
+    if header_durations is None:
+        header_durations = [None] * n_images
+    checked = [len(start) == len(duration) for start, duration in zip(frame_times_start, frame_duration)]
+    lengths = numpy.array([len(start) if ok else 0 for start, ok in zip(frame_times_start, checked)], dtype=numpy.int64)
+    offsets = numpy.concatenate(([0], numpy.cumsum(lengths)))
+    start = numpy.concatenate([numpy.asarray(s, dtype=float) for s, ok in zip(frame_times_start, checked) if ok] or [numpy.empty(0)])
+    duration = numpy.concatenate([numpy.asarray(d, dtype=float) for d, ok in zip(frame_duration, checked) if ok] or [numpy.empty(0)])
+
+    # comparisons with the following frame only apply where the following frame belongs to the same image
+    has_next = numpy.ones(len(start), dtype=bool)
+    has_next[offsets[1:][lengths > 0] - 1] = False
+    next_start = numpy.append(start[1:], numpy.nan)
+    end = start + duration
+
+    image_of_frame = numpy.repeat(numpy.arange(n_images), lengths)
+    reference = numpy.array([h if h else numpy.nan for h in header_durations], dtype=float)
+    duration_min = numpy.full(n_images, numpy.inf)
+    duration_max = numpy.full(n_images, -numpy.inf)
+    numpy.minimum.at(duration_min, image_of_frame, duration)
+    numpy.maximum.at(duration_max, image_of_frame, duration)
+    constant = (duration_max - duration_min) <= tolerance
+    header_mismatch_image = constant & ~numpy.isnan(reference) & (numpy.abs(duration_max - reference) > tolerance)
+
+    masks = {
+        "non_positive_duration": duration <= 0,
+        "not_increasing": has_next & ~(next_start > start),
+        "overlap": has_next & (end > next_start + tolerance),
+        "gap": has_next & (end < next_start - tolerance),
+        "header_duration_mismatch": header_mismatch_image[image_of_frame] if len(start) else numpy.zeros(0, dtype=bool),
+    }
+
+    issues = [{} for _ in range(n_images)]
+    for name in TIMING_ISSUES:
+        frames = numpy.flatnonzero(masks[name])
+        images = image_of_frame[frames]
+        for image in numpy.unique(images):
+            issues[image][name] = (frames[images == image] - offsets[image]).tolist()
+    return issues
+
+
+def validate_frame_timing(frame_times_start, frame_duration, header_duration: float=None, tolerance: float=1e-3) -> dict:
+    """
+    Checks the frame timing of a single PET image, see validate_frame_timing_batch for the checks made.
+
+    return : dict
+        Issue name -> list of frame indices affected, empty if the timing is sound.
+    """
+    return validate_frame_timing_batch([frame_times_start], [frame_duration], [header_duration], tolerance=tolerance)[0]
@@ -0,0 +1,196 @@
+import os
+import time
+import logging
+import pathlib
+from typing import Union
+from concurrent.futures import ThreadPoolExecutor, wait
+from .scanner import BIDSScanner, parse_bids_filename
+from .compress import zip_nifti
+from .petutils import _check_pet_frame_timing, _file_fingerprint, _sidecar_path
+
+logger = logging.getLogger("petutils.watch")
+
+PAIR_EXTENSIONS = (".nii", ".nii.gz", ".json")
+
+
+def _stem(path: str) -> str:
+    """The path of a PET file without its extension, shared by an image and its sidecar."""
+    for extension in PAIR_EXTENSIONS:
+        if path.endswith(extension):
+            return path[:-len(extension)]
+    return path
+
+
+class DatasetWatcher:
+    """
+    Watches a BIDS dataset for PET images and sidecars that arrive or change, and compresses and validates only
+    those, see petutils.watch.DatasetWatcher.step. The dataset is polled: every step lists the pet folders and stats
+    the PET files in them, which is compared against an in-memory index of the files already seen.
+
+    A changed file is debounced, it's only picked up once its size and modification time have been stable for
+    debounce seconds so that files still being copied in aren't read. Once every changed file of an image/sidecar
+    pair has settled, the pair is handed to a pool of workers which gzips a .nii image with zip_nifti and checks the
+    image's frames against its own sidecar (metadata inherited from higher up the tree is not considered).
+
+    Parameters
+    ----------
+    bids_dir : Union[str, pathlib.Path]
+        Root of the BIDS dataset.
+    compress : bool, optional
+        Gzip new .nii images. The default is True.
+    validate : bool, optional
+        Check new images against their sidecars. The default is True.
+    deep : bool, optional
+        Also validate the frame timing values, see check_nifti_json_frame_consistency. The default is False.
+    debounce : float, optional
+        Seconds a file must stay unchanged before it's processed. The default is 2.
+    jobs : int, optional
+        Number of pairs processed at once. The default is 1.
+    compresslevel : int, optional
+        gzip compression level. The default is 9.
+    process_existing : bool, optional
+        Treat the files present when the watcher starts as new, otherwise only later changes are processed. The
+        default is False.
+    on_event : callable, optional
+        Called with each event returned by step as soon as it's collected.
+    clock : callable, optional
+        Source of the current time in seconds. The default is time.monotonic.
+    """
+
+    def __init__(self, bids_dir: Union[str, pathlib.Path], compress: bool=True, validate: bool=True, deep: bool=False,
+                 debounce: float=2.0, jobs: int=1, compresslevel: int=9, process_existing: bool=False, on_event=None,
+                 clock=time.monotonic):
+        self.scanner = BIDSScanner(bids_dir, datatypes=("pet",))
+        self.compress = compress
+        self.validate = validate
+        self.deep = deep
+        self.debounce = debounce
+        self.compresslevel = compresslevel
+        self.on_event = on_event
+        self.clock = clock
+        self._pool = ThreadPoolExecutor(max_workers=jobs)
+        # path -> fingerprint of every file already processed or present at start
+        self.known = {} if process_existing else self._snapshot()
+        # path -> (fingerprint, time it was first seen with it) of changed files that haven't settled yet
+        self._pending = {}
+        # stem -> future of the pairs being processed
+        self._in_flight = {}
+
+    def _snapshot(self) -> dict:
+        snapshot = {}
+        for record in self.scanner.scan():
+            if record.suffix == "pet" and record.extension in PAIR_EXTENSIONS:
+                fingerprint = _file_fingerprint(record.path)
+                if fingerprint is not None:
+                    snapshot[record.path] = fingerprint
+        return snapshot
+
+    def _process(self, image: str) -> tuple:
+        """
+        Compresses and validates a pair, returns the event and path -> fingerprint (None if removed) of the files
+        as they were written or read here. Fingerprints are taken before a file is read, so a file that changes
+        after that no longer matches and is picked up again by a later step.
+        """
+        event = {"pet_path": image, "compressed": False, "result": None, "error": None}
+        handled = {}
+        try:
+            if self.compress and image.endswith(".nii"):
+                gz_file = zip_nifti(image, compresslevel=self.compresslevel)
+                handled[image] = None
+                handled[gz_file] = _file_fingerprint(gz_file)
+                image = event["pet_path"] = gz_file
+                event["compressed"] = True
+            if self.validate:
+                handled.setdefault(image, _file_fingerprint(image))
+                sidecar = _sidecar_path(image)
+                handled[sidecar] = _file_fingerprint(sidecar)
+                subject = parse_bids_filename(os.path.basename(image))["subject"]
+                event["result"] = _check_pet_frame_timing(subject, image, None, None, header_only=True, deep=self.deep)
+        except Exception as err:
+            event["error"] = f"{type(err).__name__}: {err}"
+        return event, handled
+
+    def step(self, block: bool=False) -> list:
+        """
+        Polls the dataset once, dispatches the pairs whose changes have settled and collects the pairs that finished
+        processing. With block, waits for every pair in flight before collecting.
+
+        return : list
+            An event for each pair finished, a dictionary of pet_path (the gzipped path if it was compressed),
+            compressed, result (a FrameConsistencyResult, None if validate is off) and error (a message if
+            processing failed, else None).
+        """
+        now = self.clock()
+        snapshot = self._snapshot()
+        for index in (self.known, self._pending):
+            for path in [path for path in index if path not in snapshot]:
+                del index[path]
+
+        for path, fingerprint in snapshot.items():
+            if _stem(path) in self._in_flight:
+                continue
+            if self.known.get(path) == fingerprint:
+                self._pending.pop(path, None)
+            elif path not in self._pending or self._pending[path][0] != fingerprint:
+                self._pending[path] = (fingerprint, now)
+
+        # a pair is only ready once all of its changed files have settled
+        unsettled = {_stem(path) for path, (_, since) in self._pending.items() if now - since < self.debounce}
+        ready = {}
+        for path in list(self._pending):
+            if _stem(path) not in unsettled:
+                self.known[path] = self._pending.pop(path)[0]
+                ready.setdefault(_stem(path), set()).add(path)
+        for stem in ready:
+            # an uncompressed image is the newer one if both exist
+            image = next((stem + extension for extension in (".nii", ".nii.gz") if stem + extension in snapshot), None)
+            # a sidecar arriving ahead of its image is read once the image arrives
+            if image is not None:
+                self._in_flight[stem] = self._pool.submit(self._process, image)
+
+        return self._collect(block)
+
+    def _collect(self, block: bool) -> list:
+        if block:
+            wait(self._in_flight.values())
+        events = []
+        for stem, future in list(self._in_flight.items()):
+            if not future.done():
+                continue
+            del self._in_flight[stem]
+            event, handled = future.result()
+            # only the files the worker wrote or read are known as it left them, so that compressing a pair doesn't
+            # count as a change while anything that changed during processing is still picked up
+            for path, fingerprint in handled.items():
+                if fingerprint is None:
+                    self.known.pop(path, None)
+                else:
+                    self.known[path] = fingerprint
+            self._log(event)
+            if self.on_event is not None:
+                self.on_event(event)
+            events.append(event)
+        return events
+
+    def _log(self, event):
+        if event["error"] is not None:
+            logger.error("%s: %s", event["pet_path"], event["error"])
+        elif event["result"] is not None and not event["result"].consistent:
+            logger.warning("%s", "\n".join(event["result"].errors))
+        else:
+            logger.info("%s processed", event["pet_path"])
+
+    def run(self, interval: float=1.0, stop=None):
+        """Calls step every interval seconds until stop() returns True or the process is interrupted."""
+        try:
+            while stop is None or not stop():
+                self.step()
+                time.sleep(interval)
+        finally:
+            self.close()
+
+    def close(self) -> list:
+        """Waits for the pairs in flight, shuts the workers down and returns the events of those pairs."""
+        events = self._collect(block=True)
+        self._pool.shutdown(wait=True)
+        return events
@@ -277,4 +277,34 @@ def anat_in_each_session_folder_multi_run(tmpdir):
     # Convert to multi-run
     convert_to_multi_run(dest_dir)
     
-    return dest_dir
\ No newline at end of file
+    return dest_dir
+
+# Helper function to write a small 4D PET image with a given number of frames, the images in the data directory
+# are replaced or supplemented with these so that tests of the nifti header don't depend on large files
+def write_pet_nifti(nifti_path, n_frames, nifti_class=None, frame_duration=1.0):
+    import nibabel
+    import numpy
+
+    if nifti_class is None:
+        nifti_class = nibabel.Nifti1Image
+    image = nifti_class(numpy.zeros((2, 2, 2, n_frames), dtype=numpy.float32), numpy.eye(4))
+    image.header.set_xyzt_units("mm", "sec")
+    image.header["pixdim"][4] = frame_duration
+    nibabel.save(image, str(nifti_path))
+    return nifti_path
+
+# 6 - dataset with real 4D PET images, the first session is consistent with its sidecar and the second is not
+@pytest.fixture
+def pet_images_with_frame_mismatch(tmpdir):
+    dest_dir = pathlib.Path(tmpdir) / "pet_images_with_frame_mismatch"
+    shutil.copytree(data_dir, dest_dir)
+
+    baseline_pet = dest_dir / "sub-01" / "ses-baseline" / "pet" / "sub-01_ses-baseline_pet"
+    write_pet_nifti(baseline_pet.with_suffix(".nii.gz"), 21)
+
+    second_pet_folder = dest_dir / "sub-01" / "ses-second" / "pet"
+    second_pet_folder.mkdir(parents=True, exist_ok=True)
+    shutil.copy(baseline_pet.with_suffix(".json"), second_pet_folder / "sub-01_ses-second_pet.json")
+    write_pet_nifti(second_pet_folder / "sub-01_ses-second_pet.nii", 20)
+
+    return dest_dir
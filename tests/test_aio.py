@@ -0,0 +1,86 @@
+import time
+import asyncio
+import pytest
+from petutils import aio
+from petutils.aio import aiter_frame_consistency, check_nifti_json_frame_consistency_async
+from petutils.petutils import check_nifti_json_frame_consistency, iter_frame_consistency, PETFrameTimingError
+from petutils.scanner import BIDSScanner
+from petutils.synthetic import generate_dataset
+
+
+async def collect(bids_data, **kwargs):
+    return [result async for result in aiter_frame_consistency(bids_data, **kwargs)]
+
+
+@pytest.mark.parametrize("read_sidecar", [False, True])
+def test_async_check_matches_sync(pet_images_with_frame_mismatch, read_sidecar):
+    expected = check_nifti_json_frame_consistency(pet_images_with_frame_mismatch, read_sidecar=read_sidecar)
+    inconsistent = asyncio.run(check_nifti_json_frame_consistency_async(pet_images_with_frame_mismatch, read_sidecar=read_sidecar, concurrency=2))
+    assert inconsistent == expected
+    assert len(inconsistent["01"]["files"]) == 1
+
+
+def test_async_check_raises_for_single_subject(pet_images_with_frame_mismatch):
+    with pytest.raises(PETFrameTimingError):
+        asyncio.run(check_nifti_json_frame_consistency_async(pet_images_with_frame_mismatch, subjects=["01"]))
+
+
+def test_async_iter_uses_manifest(pet_images_with_frame_mismatch, tmp_path, monkeypatch):
+    manifest_file = tmp_path / "manifest.json"
+    first = asyncio.run(collect(pet_images_with_frame_mismatch, manifest_file=manifest_file, deep=True))
+    assert manifest_file.exists()
+
+    def fail(*args):
+        raise AssertionError("unchanged images should not be read again")
+    monkeypatch.setattr(aio, "_read_pet_header", fail)
+    assert asyncio.run(collect(pet_images_with_frame_mismatch, manifest_file=manifest_file, deep=True)) == first
+
+
+def test_async_reads_overlap_with_latency(tmp_path, monkeypatch):
+    dataset = generate_dataset(tmp_path / "dataset", n_subjects=4, n_sessions=2, n_frames=3, with_anat=False)
+    latency = 0.05
+    read_pet_header, read_frame_timing = aio._read_pet_header, aio.read_frame_timing
+
+    def slow_header(*args):
+        time.sleep(latency)
+        return read_pet_header(*args)
+
+    def slow_timing(*args):
+        time.sleep(latency)
+        return read_frame_timing(*args)
+
+    monkeypatch.setattr(aio, "_read_pet_header", slow_header)
+    monkeypatch.setattr(aio, "read_frame_timing", slow_timing)
+    scanner = BIDSScanner(dataset)
+
+    start = time.perf_counter()
+    results = asyncio.run(collect(scanner, read_sidecar=True, concurrency=16))
+    elapsed = time.perf_counter() - start
+
+    assert results == list(iter_frame_consistency(scanner, read_sidecar=True))
+    assert all(result.consistent for result in results)
+    # 8 images with a header and a sidecar read each would take 16 * latency one after the other
+    assert elapsed < 16 * latency / 2
+
+
+def test_async_iter_lists_images_a_window_at_a_time(tmp_path, monkeypatch):
+    dataset = generate_dataset(tmp_path / "dataset", n_subjects=20, n_frames=3, with_anat=False)
+    listed = []
+    pet_images = aio._pet_images
+
+    def counting_pet_images(*args):
+        for image in pet_images(*args):
+            listed.append(image)
+            yield image
+    monkeypatch.setattr(aio, "_pet_images", counting_pet_images)
+
+    async def first_result():
+        results = aiter_frame_consistency(BIDSScanner(dataset), concurrency=2)
+        try:
+            return await results.__anext__()
+        finally:
+            await results.aclose()
+
+    assert asyncio.run(first_result()).consistent
+    # 2 * concurrency tasks plus a chunk of concurrency images at most
+    assert len(listed) <= 6
@@ -0,0 +1,79 @@
+import csv
+import json
+import pytest
+from petutils.cli import main
+
+
+def test_validate_frames_json(pet_images_with_frame_mismatch, tmp_path, capsys):
+    cache = tmp_path / "frames.json"
+    assert main(["validate-frames", str(pet_images_with_frame_mismatch), "--jobs", "2", "--cache", str(cache)]) == 1
+    reported = json.loads(capsys.readouterr().out)
+    assert [result["pet_path"].endswith("sub-01_ses-second_pet.nii") for result in reported] == [True]
+    assert reported[0]["nii_frames"] == 20 and not reported[0]["consistent"]
+    assert len(reported[0]["errors"]) == 2
+    assert cache.exists()
+
+    # the second run is answered from the cache
+    assert main(["validate-frames", str(pet_images_with_frame_mismatch), "--cache", str(cache), "--all"]) == 1
+    assert len(json.loads(capsys.readouterr().out)) == 2
+
+
+def test_validate_frames_tsv(pet_images_with_frame_mismatch, tmp_path):
+    output = tmp_path / "frames.tsv"
+    assert main(["validate-frames", str(pet_images_with_frame_mismatch), "--scanner", "--deep", "--all",
+                 "--format", "tsv", "-o", str(output)]) == 1
+    with open(output, newline="") as f:
+        rows = list(csv.DictReader(f, delimiter="\t"))
+    assert [row["nii_frames"] for row in rows] == ["21", "20"]
+
+
+def test_validate_frames_consistent_subject(pet_images_with_frame_mismatch, capsys):
+    pet_images_with_frame_mismatch.joinpath("sub-01", "ses-second", "pet", "sub-01_ses-second_pet.nii").unlink()
+    assert main(["validate-frames", str(pet_images_with_frame_mismatch), "--subjects", "01", "--read-sidecar"]) == 0
+    assert json.loads(capsys.readouterr().out) == []
+
+
+@pytest.mark.parametrize("output_format", ["json", "tsv"])
+def test_map_anat(anat_in_each_session_folder, output_format, tmp_path, capsys):
+    layout_cache = tmp_path / "layouts"
+    assert main(["map-anat", str(anat_in_each_session_folder), "--format", output_format,
+                 "--layout-cache", str(layout_cache)]) == 0
+    output = capsys.readouterr().out
+    if output_format == "json":
+        pairs = [(subject, pet, anat) for subject, mapping in json.loads(output).items() for pet, anat in mapping.items()]
+    else:
+        pairs = [tuple(row) for row in csv.reader(output.splitlines()[1:], delimiter="\t")]
+    assert len(pairs) == 2
+    for subject, pet, anat in pairs:
+        assert subject == "01"
+        assert pet.split("_pet")[0] == anat.replace("/anat/", "/pet/").split("_T1w")[0]
+    assert any(layout_cache.iterdir())
+
+
+def test_compress(pet_images_with_frame_mismatch, capsys):
+    assert main(["compress", str(pet_images_with_frame_mismatch), "--jobs", "1"]) == 0
+    assert "sub-01_ses-second_pet.nii ->" in capsys.readouterr().out
+    assert pet_images_with_frame_mismatch.joinpath("sub-01", "ses-second", "pet", "sub-01_ses-second_pet.nii.gz").exists()
+
+
+def test_compress_verify_existing(pet_images_with_frame_mismatch, tmp_path, capsys):
+    manifest = tmp_path / "checksums.json"
+    args = ["compress", str(pet_images_with_frame_mismatch), "--manifest", str(manifest), "--verify-existing"]
+    assert main(args) == 0
+    n_gzipped = len(list(pet_images_with_frame_mismatch.rglob("*.nii.gz")))
+    assert f"{n_gzipped} gzipped files verified" in capsys.readouterr().out
+    assert len(json.loads(manifest.read_text())) == n_gzipped
+    assert main(args) == 0
+
+
+def test_missing_dataset(tmp_path):
+    with pytest.raises(SystemExit):
+        main(["map-anat", str(tmp_path / "missing")])
+
+
+def test_watch(pet_images_with_frame_mismatch, capsys):
+    assert main(["watch", str(pet_images_with_frame_mismatch), "--process-existing", "--debounce", "0",
+                 "--interval", "0", "--polls", "2", "--no-compress"]) == 0
+    events = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert sorted(event["result"]["consistent"] for event in events) == [False, True]
+    assert not any(event["compressed"] for event in events)
@@ -0,0 +1,127 @@
+import io
+import gzip
+import os
+import shutil
+import hashlib
+import pytest
+import nibabel
+from petutils import compress
+from petutils.compress import parallel_gzip, zip_nifti_tree, find_uncompressed_niftis, find_gzipped_niftis
+from petutils.compress import ChecksumManifest, CompressionVerificationError, verify_gzipped_nifti, verify_nifti_tree
+from petutils.petutils import zip_nifti
+from petutils.scanner import BIDSScanner
+from tests.conftest import write_pet_nifti
+
+
+@pytest.mark.parametrize("size", [0, 1, 4096, 4096 * 3, 100_000])
+@pytest.mark.parametrize("threads", [1, 4])
+def test_parallel_gzip_round_trip(size, threads):
+    # mix incompressible and repetitive data so that back references across chunks are exercised
+    data = (os.urandom(size // 2) + b"petutils" * size)[:size]
+    compressed = io.BytesIO()
+    assert parallel_gzip(io.BytesIO(data), compressed, threads=threads, level=6, chunk_size=4096) == size
+    assert gzip.decompress(compressed.getvalue()) == data
+
+
+def test_zip_nifti_parallel(tmp_path):
+    nifti_file = str(write_pet_nifti(tmp_path / "sub-01_pet.nii", 21))
+    zipped = zip_nifti(nifti_file, threads=3, compresslevel=1, chunk_size=256)
+    assert zipped == nifti_file + ".gz"
+    assert not os.path.exists(nifti_file)
+    assert nibabel.load(zipped).shape == (2, 2, 2, 21)
+    with gzip.open(zipped) as f:
+        f.read()
+
+
+def test_zip_nifti_leaves_original_when_interrupted(tmp_path, monkeypatch):
+    nifti_file = str(write_pet_nifti(tmp_path / "sub-01_pet.nii", 21))
+
+    def interrupted(*args, **kwargs):
+        raise KeyboardInterrupt
+    monkeypatch.setattr(shutil, "copyfileobj", interrupted)
+    with pytest.raises(KeyboardInterrupt):
+        zip_nifti(nifti_file)
+    assert os.listdir(tmp_path) == ["sub-01_pet.nii"]
+
+
+def test_zip_nifti_tree(pet_images_with_frame_mismatch):
+    uncompressed = pet_images_with_frame_mismatch / "sub-01" / "ses-second" / "pet" / "sub-01_ses-second_pet.nii"
+    other = write_pet_nifti(pet_images_with_frame_mismatch / "sub-01" / "ses-baseline" / "anat" / "sub-01_ses-baseline_T2w.nii", 1)
+    compressed = zip_nifti_tree(pet_images_with_frame_mismatch, jobs=2, max_memory=1)
+    assert compressed == {str(other): f"{other}.gz", str(uncompressed): f"{uncompressed}.gz"}
+    assert find_uncompressed_niftis(pet_images_with_frame_mismatch) == []
+    assert nibabel.load(f"{uncompressed}.gz").shape == (2, 2, 2, 20)
+
+
+def test_zip_nifti_tree_with_scanner(pet_images_with_frame_mismatch):
+    uncompressed = pet_images_with_frame_mismatch / "sub-01" / "ses-second" / "pet" / "sub-01_ses-second_pet.nii"
+    scanner = BIDSScanner(pet_images_with_frame_mismatch)
+    assert find_uncompressed_niftis(scanner) == [str(uncompressed)]
+    assert zip_nifti_tree(scanner, jobs=1) == {str(uncompressed): f"{uncompressed}.gz"}
+    assert f"{uncompressed}.gz" in find_gzipped_niftis(scanner)
+
+
+def test_find_niftis_rejects_other_types():
+    with pytest.raises(TypeError):
+        find_uncompressed_niftis(42)
+
+
+def test_zip_nifti_verify_records_manifest(tmp_path):
+    nifti_file = str(write_pet_nifti(tmp_path / "sub-01_pet.nii", 21))
+    with open(nifti_file, "rb") as f:
+        original = hashlib.sha256(f.read()).hexdigest()
+    manifest = ChecksumManifest(tmp_path / "manifest.json")
+    zipped = zip_nifti(nifti_file, threads=2, chunk_size=128, verify=True, manifest=manifest)
+    manifest.save()
+
+    reloaded = ChecksumManifest(tmp_path / "manifest.json")
+    assert reloaded.get(zipped)["sha256"] == original
+    assert reloaded.is_verified(zipped)
+    assert verify_gzipped_nifti(zipped, reloaded) == original
+
+
+def test_zip_nifti_verify_keeps_original_on_mismatch(tmp_path, monkeypatch):
+    nifti_file = str(write_pet_nifti(tmp_path / "sub-01_pet.nii", 21))
+    monkeypatch.setattr(compress, "checksum_gzip", lambda *args, **kwargs: ("0" * 64, 0))
+    with pytest.raises(CompressionVerificationError):
+        zip_nifti(nifti_file, verify=True)
+    assert os.listdir(tmp_path) == ["sub-01_pet.nii"]
+
+
+def test_verify_gzipped_nifti_detects_changed_contents(tmp_path):
+    manifest = ChecksumManifest(tmp_path / "manifest.json")
+    zipped = zip_nifti(str(write_pet_nifti(tmp_path / "sub-01_pet.nii", 21)), verify=True, manifest=manifest)
+    with gzip.open(zipped, "wb") as f:
+        f.write(b"not the original")
+    with pytest.raises(CompressionVerificationError):
+        verify_gzipped_nifti(zipped, manifest)
+
+
+def test_verify_nifti_tree_skips_verified_files(tmp_path, monkeypatch):
+    dataset = tmp_path / "dataset"
+    dataset.mkdir()
+    gz_files = [f"{write_pet_nifti(dataset / f'sub-0{i}_pet.nii.gz', 3)}" for i in (1, 2)]
+    manifest_file = tmp_path / "manifest.json"
+
+    checksummed = []
+    checksum_gzip = compress.checksum_gzip
+    monkeypatch.setattr(compress, "checksum_gzip", lambda gz_file: checksummed.append(str(gz_file)) or checksum_gzip(gz_file))
+    first = verify_nifti_tree(dataset, manifest_file, jobs=2)
+    assert sorted(first) == gz_files and sorted(checksummed) == gz_files
+
+    # unchanged files are answered from the manifest, a rewritten one is read again and caught
+    checksummed.clear()
+    with gzip.open(gz_files[1], "wb") as f:
+        f.write(b"not the original")
+    with pytest.raises(CompressionVerificationError, match="sub-02_pet.nii.gz"):
+        verify_nifti_tree(dataset, manifest_file)
+    assert checksummed == [gz_files[1]]
+
+
+def test_checksum_manifest_save_is_atomic(tmp_path):
+    manifest = ChecksumManifest(tmp_path / "manifests" / "manifest.json")
+    manifest.entries["sub-01_pet.nii.gz"] = {"sha256": "0" * 64}
+    manifest.save()
+    assert os.listdir(tmp_path / "manifests") == ["manifest.json"]
+    assert ChecksumManifest(tmp_path / "manifests" / "manifest.json").entries == manifest.entries
+
@@ -0,0 +1,49 @@
+import sys
+import json
+import subprocess
+import pathlib
+import petutils
+
+project_dir = pathlib.Path(__file__).parent.parent.absolute()
+
+HEAVY_MODULES = ["bids", "sqlalchemy", "pandas", "nibabel", "numpy"]
+
+
+def modules_loaded_after(code):
+    """Runs code in a fresh interpreter and returns which of HEAVY_MODULES it ended up importing."""
+    script = f"import sys, json\n{code}\nprint(json.dumps([m for m in {HEAVY_MODULES!r} if m in sys.modules]))"
+    output = subprocess.run([sys.executable, "-c", script], cwd=project_dir, capture_output=True, text=True, check=True)
+    return json.loads(output.stdout.splitlines()[-1])
+
+
+def test_import_does_not_load_heavy_dependencies():
+    assert modules_loaded_after("import petutils") == []
+    assert modules_loaded_after("import petutils.petutils") == []
+
+
+def test_light_api_does_not_load_heavy_dependencies():
+    code = "from petutils import zip_nifti, get_versions, read_nifti_header, BIDSScanner, FrameConsistencyResult\nget_versions()"
+    assert modules_loaded_after(code) == []
+
+
+def test_scanner_does_not_load_pybids(tmp_path):
+    from petutils.synthetic import generate_dataset
+    dataset = generate_dataset(tmp_path / "dataset", n_subjects=2)
+    code = ("from petutils import BIDSScanner, collect_anat_and_pet, check_nifti_json_frame_consistency\n"
+            f"scanner = BIDSScanner({str(dataset)!r})\n"
+            "collect_anat_and_pet(scanner)\n"
+            "check_nifti_json_frame_consistency(scanner, read_sidecar=True)\n"
+            "from petutils.cli import main\n"
+            f"main(['validate-frames', {str(dataset)!r}, '--scanner'])")
+    assert modules_loaded_after(code) == []
+
+
+def test_layout_loads_pybids_on_first_use():
+    assert "bids" in modules_loaded_after(f"from petutils import get_layout\nget_layout({str(project_dir / 'data')!r})")
+
+
+def test_public_api_resolves():
+    for name in petutils.__all__:
+        assert getattr(petutils, name) is not None
+    assert set(petutils.__all__) <= set(dir(petutils))
+    assert petutils.zip_nifti is petutils.compress.zip_nifti
@@ -0,0 +1,58 @@
+import logging
+from petutils import instrumentation
+from petutils.instrumentation import Recorder, recording, stage, count
+from petutils.layout import LayoutCache
+from petutils.petutils import collect_anat_and_pet, check_nifti_json_frame_consistency, zip_nifti
+from petutils.synthetic import generate_dataset, write_nifti
+
+
+def test_nothing_is_recorded_without_callbacks():
+    assert not instrumentation.enabled()
+    with stage("query", subject="01") as fields:
+        fields["extra"] = 1
+    count("manifest_hit")
+
+
+def test_recorder_summary():
+    with recording() as recorder:
+        with stage("gzip", bytes=100):
+            pass
+        with stage("gzip", bytes=300) as fields:
+            fields["path"] = "a.nii"
+        count("layout_cache", n=2)
+    with stage("gzip", bytes=1):
+        pass
+
+    assert [event["stage"] for event in recorder.events] == ["gzip", "gzip", "layout_cache"]
+    assert recorder.events[1]["path"] == "a.nii"
+    summary = recorder.summary()
+    assert summary["gzip"]["count"] == 2
+    assert summary["gzip"]["bytes"] == 400
+    assert summary["gzip"]["bytes_per_second"] > 0
+    assert summary["layout_cache"]["count"] == 2
+    assert not instrumentation.enabled()
+
+
+def test_stages_of_a_run(tmp_path):
+    dataset = generate_dataset(tmp_path / "dataset", n_subjects=2, n_frames=3)
+    with recording() as recorder:
+        layout = LayoutCache().get(dataset)
+        collect_anat_and_pet(layout, matcher="difflib", bulk=False)
+        check_nifti_json_frame_consistency(layout, read_sidecar=True, n_jobs=2)
+        zip_nifti(write_nifti(tmp_path / "image.nii", (2, 2, 2, 3)))
+    summary = recorder.summary()
+    assert summary["layout_build"]["count"] == 1
+    assert summary["difflib_match"]["count"] == 2
+    assert summary["header_read"]["count"] == 2
+    # two per-subject queries for the mapping and two for the frame check
+    assert summary["query"]["count"] == 4
+    assert summary["json_read"]["count"] <= 2
+    assert summary["gzip"]["bytes"] == 352 + 2 * 2 * 2 * 3 * 4
+
+
+def test_log_events(caplog):
+    with caplog.at_level(logging.INFO, logger="petutils.instrumentation"):
+        with recording(instrumentation.log_events()):
+            count("manifest_hit", path="sub-01_pet.nii")
+    assert caplog.records[0].petutils_event == {"stage": "manifest_hit", "count": 1, "path": "sub-01_pet.nii"}
+    assert '"manifest_hit"' in caplog.records[0].getMessage()
@@ -0,0 +1,59 @@
+import os
+import shutil
+import pathlib
+from petutils.layout import LayoutCache, dataset_fingerprint
+
+data_dir = pathlib.Path(__file__).parent.parent / "data"
+
+
+def test_layout_cache_reuses_layout_until_dataset_changes(tmp_path):
+    bids_dir = tmp_path / "bids"
+    shutil.copytree(data_dir, bids_dir)
+    cache = LayoutCache()
+
+    layout = cache.get(bids_dir)
+    assert cache.get(bids_dir) is layout
+
+    for file in (bids_dir / "sub-01").glob("**/*.*"):
+        new_file = bids_dir / str(file.relative_to(bids_dir)).replace("sub-01", "sub-02")
+        new_file.parent.mkdir(parents=True, exist_ok=True)
+        shutil.copy(file, new_file)
+    changed_layout = cache.get(bids_dir)
+    assert changed_layout is not layout
+    assert changed_layout.get_subjects() == ["01", "02"]
+
+
+def test_layout_cache_persists_database(tmp_path):
+    bids_dir = tmp_path / "bids"
+    shutil.copytree(data_dir, bids_dir)
+    cache_dir = tmp_path / "cache"
+
+    LayoutCache(cache_dir=cache_dir).get(bids_dir)
+    database_files = list(cache_dir.glob("*/*.sqlite"))
+    assert len(database_files) == 1
+    written = database_files[0].stat().st_mtime_ns
+
+    # a fresh cache, as in a new run of a pipeline, loads the database instead of re-indexing
+    layout = LayoutCache(cache_dir=cache_dir).get(bids_dir)
+    assert layout.get_subjects() == ["01"]
+    assert database_files[0].stat().st_mtime_ns == written
+
+
+def test_dataset_fingerprint_ignores_derivatives(tmp_path):
+    bids_dir = tmp_path / "bids"
+    shutil.copytree(data_dir, bids_dir)
+    for invalidation in ("files", "directories"):
+        before = dataset_fingerprint(bids_dir, invalidation=invalidation)
+        (bids_dir / "derivatives" / "petdeface").mkdir(parents=True, exist_ok=True)
+        # the mkdir may land in the same mtime tick as the copy, move the root's mtime on explicitly
+        os.utime(bids_dir, ns=(bids_dir.stat().st_atime_ns, bids_dir.stat().st_mtime_ns + 10 ** 9))
+        assert dataset_fingerprint(bids_dir, invalidation=invalidation) == before
+
+
+def test_dataset_fingerprint_sees_new_subjects(tmp_path):
+    bids_dir = tmp_path / "bids"
+    shutil.copytree(data_dir, bids_dir)
+    for invalidation in ("files", "directories"):
+        before = dataset_fingerprint(bids_dir, invalidation=invalidation)
+        shutil.copytree(bids_dir / "sub-01", bids_dir / f"sub-{invalidation}")
+        assert dataset_fingerprint(bids_dir, invalidation=invalidation) != before
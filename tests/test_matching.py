@@ -0,0 +1,122 @@
+from petutils.matching import AnatomicalIndex, DifflibMatcher
+
+
+def anat(path):
+    # derive the entities from a bids path the same way pybids would for these simple names
+    entities = dict(part.split("-", 1) for part in path.split("/")[-1].split("_")[:-1])
+    entities = {{"sub": "subject", "ses": "session", "acq": "acquisition"}.get(k, k): v for k, v in entities.items()}
+    entities["suffix"] = path.split("_")[-1].split(".")[0]
+    return path, entities
+
+
+def test_anatomical_index_session_fallbacks():
+    index = AnatomicalIndex([
+        anat("sub-01/anat/sub-01_T1w.nii.gz"),
+        anat("sub-01/ses-b/anat/sub-01_ses-b_T1w.nii.gz"),
+        anat("sub-02/ses-b/anat/sub-02_ses-b_T1w.nii.gz"),
+        anat("sub-02/ses-c/anat/sub-02_ses-c_T1w.nii.gz"),
+    ])
+    # same session, then subject level, then the first session of the subject
+    assert index.match("01", "b") == "sub-01/ses-b/anat/sub-01_ses-b_T1w.nii.gz"
+    assert index.match("01", "a") == "sub-01/anat/sub-01_T1w.nii.gz"
+    assert index.match("02", "a") == "sub-02/ses-b/anat/sub-02_ses-b_T1w.nii.gz"
+    assert index.match("03", "a") == ""
+
+
+def test_anatomical_index_prefers_run_and_suffix_order():
+    index = AnatomicalIndex([
+        anat("sub-01/anat/sub-01_run-2_T2w.nii.gz"),
+        anat("sub-01/anat/sub-01_run-1_T1w.nii.gz"),
+        anat("sub-01/anat/sub-01_run-2_T1w.nii.gz"),
+    ], suffixes=["T1w", "T2w"])
+    assert index.match("01", run=2) == "sub-01/anat/sub-01_run-2_T1w.nii.gz"
+    assert index.match("01", run=1) == "sub-01/anat/sub-01_run-1_T1w.nii.gz"
+    assert index.match("01", run=3) == "sub-01/anat/sub-01_run-1_T1w.nii.gz"
+
+
+def test_anatomical_index_ignores_run_padding():
+    index = AnatomicalIndex([
+        anat("sub-01/anat/sub-01_run-01_T1w.nii.gz"),
+        anat("sub-01/anat/sub-01_run-02_T1w.nii.gz"),
+    ], suffixes=["T1w", "T2w"])
+    assert index.match("01", run="2") == "sub-01/anat/sub-01_run-02_T1w.nii.gz"
+    assert index.match("01", run=2) == "sub-01/anat/sub-01_run-02_T1w.nii.gz"
+    assert index.match("01", run="002") == "sub-01/anat/sub-01_run-02_T1w.nii.gz"
+
+
+def test_difflib_matcher_agrees_with_get_close_matches():
+    from difflib import get_close_matches
+    anat_files = [
+        f"/data/sub-{subject}/ses-{session}/anat/sub-{subject}_ses-{session}_{suffix}.nii.gz"
+        for subject in ("01", "02") for session in ("baseline", "rescan", "followup") for suffix in ("T1w", "T2w")
+    ] + ["/data/sub-01/anat/sub-01_T1w.nii", "/elsewhere/unrelated.txt"]
+    pet_files = [
+        f"/data/sub-{subject}/ses-{session}/pet/sub-{subject}_ses-{session}_pet.nii.gz"
+        for subject in ("01", "02", "03") for session in ("baseline", "rescan", "followup", "other")
+    ] + ["/data/sub-01/pet/sub-01_pet.nii", "x"]
+    matcher = DifflibMatcher(anat_files)
+    for pet_file in pet_files:
+        expected = get_close_matches(pet_file, anat_files, n=1)
+        assert matcher.match(pet_file) == (expected[0] if expected else '')
+
+
+def test_difflib_matcher_agrees_with_get_close_matches_on_random_paths():
+    import random
+    from difflib import get_close_matches
+    rng = random.Random(0)
+    labels = ["01", "02", "1", "2", "baseline", "rescan", "10"]
+    for _ in range(300):
+        subject = rng.choice(labels)
+
+        def path(datatype, suffix):
+            entities = [f"sub-{subject}"]
+            session = rng.choice([None] + labels)
+            if session is not None:
+                entities.append(f"ses-{session}")
+            for entity in ("acq", "run"):
+                if rng.random() < 0.4:
+                    entities.append(f"{entity}-{rng.choice(labels)}")
+            folder = "/".join(entities[:2]) if session is not None else entities[0]
+            return f"/data/{folder}/{datatype}/{'_'.join(entities)}_{suffix}{rng.choice(['.nii', '.nii.gz'])}"
+
+        anat_files = [path("anat", rng.choice(["T1w", "T2w"])) for _ in range(rng.randint(1, 6))]
+        matcher = DifflibMatcher(anat_files)
+        for pet_file in (path("pet", "pet") for _ in range(rng.randint(1, 4))):
+            # other runs of the same acquisition are scored starting from this one's winner
+            folder, name = pet_file.rsplit("/", 1)
+            runs = [f"{folder}/{name.replace('_pet.', f'_run-{run}_pet.')}" for run in rng.sample(labels, 3)]
+            for run_file in [pet_file] + (runs if "_run-" not in name else []):
+                expected = get_close_matches(run_file, anat_files, n=1)
+                assert matcher.match(run_file) == (expected[0] if expected else '')
+
+
+def test_difflib_matcher_scores_previous_run_winner_first(monkeypatch):
+    from difflib import SequenceMatcher, get_close_matches
+    from petutils import matching
+    ratios = []
+
+    class CountingSequenceMatcher(SequenceMatcher):
+        def ratio(self):
+            ratios.append(self.a)
+            return super().ratio()
+    monkeypatch.setattr(matching, "SequenceMatcher", CountingSequenceMatcher)
+
+    anat_files = [f"/data/bids/sub-001/ses-{session:02d}/anat/sub-001_ses-{session:02d}_T1w.nii.gz" for session in (1, 2, 3)]
+    pet_files = [f"/data/bids/sub-001/ses-{session:02d}/pet/sub-001_ses-{session:02d}_run-{run:02d}_pet.nii.gz"
+                 for session in (1, 2, 3) for run in range(1, 13)]
+    unordered = DifflibMatcher(anat_files)
+    for pet_file in pet_files:
+        unordered._closest(pet_file)
+    without_previous, ratios[:] = len(ratios), []
+
+    matcher = DifflibMatcher(anat_files)
+    for pet_file in pet_files:
+        assert matcher.match(pet_file) == get_close_matches(pet_file, anat_files, n=1)[0]
+    assert len(ratios) < without_previous
+
+
+def test_difflib_matcher_keeps_runs():
+    anat_files = ["/data/sub-01/anat/sub-01_run-1_T1w.nii.gz", "/data/sub-01/anat/sub-01_run-2_T1w.nii.gz"]
+    matcher = DifflibMatcher(anat_files)
+    assert matcher.match("/data/sub-01/pet/sub-01_run-1_pet.nii.gz") == anat_files[0]
+    assert matcher.match("/data/sub-01/pet/sub-01_run-2_pet.nii.gz") == anat_files[1]
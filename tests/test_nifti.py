@@ -0,0 +1,75 @@
+import pytest
+import nibabel
+import numpy
+from petutils.nifti import read_nifti_header, NiftiHeaderError, MappedNifti
+from tests.conftest import write_pet_nifti
+
+
+@pytest.mark.parametrize("extension", [".nii", ".nii.gz"])
+@pytest.mark.parametrize("nifti_class", [nibabel.Nifti1Image, nibabel.Nifti2Image])
+def test_read_nifti_header_matches_nibabel(tmp_path, extension, nifti_class):
+    nifti_file = write_pet_nifti(tmp_path / f"sub-01_pet{extension}", 7, nifti_class=nifti_class, frame_duration=2.5)
+    header = read_nifti_header(nifti_file)
+    nibabel_image = nibabel.load(nifti_file)
+    nibabel_header = nibabel_image.header
+
+    assert header["version"] == (1 if nifti_class is nibabel.Nifti1Image else 2)
+    assert header["dim"] == tuple(nibabel_header["dim"])
+    assert header["dim"][4] == 7
+    assert numpy.allclose(header["pixdim"], nibabel_header["pixdim"])
+    assert header["datatype"] == nibabel_header["datatype"]
+    assert header["vox_offset"] == nibabel_image.dataobj.offset
+
+
+def test_read_nifti_header_rejects_non_nifti(tmp_path):
+    not_a_nifti = tmp_path / "not_a_nifti.nii"
+    not_a_nifti.write_bytes(b"\x00" * 400)
+    with pytest.raises(NiftiHeaderError):
+        read_nifti_header(not_a_nifti)
+
+
+@pytest.mark.parametrize("nifti_class", [nibabel.Nifti1Image, nibabel.Nifti2Image])
+def test_mapped_nifti_frames_match_nibabel(tmp_path, nifti_class):
+    data = numpy.arange(3 * 4 * 5 * 6, dtype=numpy.int16).reshape((3, 4, 5, 6))
+    nifti_file = tmp_path / "sub-01_pet.nii"
+    nibabel.save(nifti_class(data, numpy.eye(4)), nifti_file)
+
+    with MappedNifti(nifti_file) as image:
+        assert image.shape == (3, 4, 5, 6)
+        assert image.n_frames == 6
+        assert image.header == read_nifti_header(nifti_file)
+        for index, frame in enumerate(image.frames()):
+            assert frame.shape == (3, 4, 5)
+            assert numpy.array_equal(frame, data[..., index])
+        # frames are views of the mapping rather than copies
+        assert not image.frame(2).flags.owndata
+        assert not image.frame(2).flags.writeable
+        assert numpy.array_equal(image.frame(-1), data[..., 5])
+        with pytest.raises(IndexError):
+            image.frame(6)
+
+
+def test_mapped_nifti_scaling(tmp_path):
+    image = nibabel.Nifti1Image(numpy.ones((2, 2, 2, 3), dtype=numpy.int16), numpy.eye(4))
+    image.header.set_slope_inter(2.0, 1.0)
+    nifti_file = tmp_path / "scaled.nii"
+    nibabel.save(image, nifti_file)
+    with MappedNifti(nifti_file) as mapped:
+        assert numpy.all(mapped.frame(0) == 1)
+        assert numpy.all(mapped.frame(0, scaled=True) == 3.0)
+
+
+def test_mapped_nifti_rejects_gzipped_and_truncated_files(tmp_path):
+    with pytest.raises(NiftiHeaderError):
+        MappedNifti(write_pet_nifti(tmp_path / "sub-01_pet.nii.gz", 3))
+    nifti_file = write_pet_nifti(tmp_path / "sub-01_pet.nii", 3)
+    nifti_file.write_bytes(nifti_file.read_bytes()[:-4])
+    with pytest.raises(NiftiHeaderError):
+        MappedNifti(nifti_file)
+
+
+def test_mapped_nifti_close_with_views_alive(tmp_path):
+    image = MappedNifti(write_pet_nifti(tmp_path / "sub-01_pet.nii", 3))
+    frame = image.frame(1)
+    image.close()
+    assert frame.sum() == 0
@@ -1,9 +1,15 @@
 import pytest
 import pathlib
 import re
+import json
+import importlib.metadata
 from petutils.petutils import get_versions, zip_nifti, write_out_dataset_description_json
-from petutils.petutils import collect_anat_and_pet
+from petutils.petutils import collect_anat_and_pet, check_nifti_json_frame_consistency, PETFrameTimingError
+from petutils.petutils import iter_anat_and_pet, iter_frame_consistency
 import subprocess
+from petutils import petutils
+from petutils.layout import get_layout
+from tests.conftest import write_pet_nifti
 
 project_dir = pathlib.Path(__file__).parent.parent.absolute()
 
@@ -205,4 +211,177 @@ def test_anat_in_each_session_folder_multi_run(anat_in_each_session_folder_multi
             run_count += 1
     
     # Should have multiple runs across sessions
-    assert run_count >= 4  # 2 sessions × 2 runs
\ No newline at end of file
+    assert run_count >= 4  # 2 sessions × 2 runs
+
+@pytest.mark.parametrize("header_only", [True, False])
+def test_check_nifti_json_frame_consistency(pet_images_with_frame_mismatch, header_only):
+    inconsistent = check_nifti_json_frame_consistency(pet_images_with_frame_mismatch, header_only=header_only)
+    assert list(inconsistent["01"]["files"].keys()) == [
+        str(pet_images_with_frame_mismatch / "sub-01" / "ses-second" / "pet" / "sub-01_ses-second_pet.nii")
+    ]
+    assert len(inconsistent["01"]["errors"]) == 2
+    assert all("-> 20" in error for error in inconsistent["01"]["errors"])
+
+    with pytest.raises(PETFrameTimingError):
+        check_nifti_json_frame_consistency(pet_images_with_frame_mismatch, subjects=["01"], header_only=header_only)
+
+@pytest.mark.parametrize("executor", ["thread", "process"])
+def test_check_nifti_json_frame_consistency_parallel(pet_images_with_frame_mismatch, executor):
+    serial = check_nifti_json_frame_consistency(pet_images_with_frame_mismatch)
+    parallel = check_nifti_json_frame_consistency(pet_images_with_frame_mismatch, n_jobs=2, executor=executor)
+    assert parallel == serial
+
+@pytest.mark.parametrize("dataset", [
+    "anat_in_no_session_folder",
+    "anat_in_first_session_folder",
+    "anat_in_first_session_folder_multi_sessions",
+    "anat_in_each_session_folder",
+    "anat_in_first_session_folder_multi_sessions_multi_run",
+    "anat_in_each_session_folder_multi_run",
+])
+def test_entity_matcher_agrees_with_difflib(request, dataset):
+    dataset = request.getfixturevalue(dataset)
+    entities = collect_anat_and_pet(dataset, matcher="entities")
+    assert entities == collect_anat_and_pet(dataset, matcher="difflib")
+    assert all(anat != '' for subject in entities.values() for anat in subject.values())
+
+@pytest.mark.parametrize("matcher", ["entities", "difflib"])
+def test_collect_anat_and_pet_bulk_matches_per_subject_queries(anat_in_each_session_folder_multi_run, matcher):
+    bulk = collect_anat_and_pet(anat_in_each_session_folder_multi_run, matcher=matcher, bulk=True)
+    assert bulk == collect_anat_and_pet(anat_in_each_session_folder_multi_run, matcher=matcher, bulk=False)
+    assert bulk == collect_anat_and_pet(anat_in_each_session_folder_multi_run, subjects=["01"], matcher=matcher, bulk=True)
+    assert collect_anat_and_pet(anat_in_each_session_folder_multi_run, subjects=["02"], bulk=True) == {"02": {}}
+
+def test_check_nifti_json_frame_consistency_incremental(pet_images_with_frame_mismatch, tmp_path, monkeypatch):
+    manifest_file = tmp_path / "frame_manifest.json"
+    first = check_nifti_json_frame_consistency(pet_images_with_frame_mismatch, manifest_file=manifest_file)
+
+    checked = []
+    check_pet_frame_counts = petutils._check_pet_frame_counts
+    def counting_check(subject, pet_path, *args):
+        checked.append(pet_path)
+        return check_pet_frame_counts(subject, pet_path, *args)
+    monkeypatch.setattr(petutils, "_check_pet_frame_counts", counting_check)
+
+    assert check_nifti_json_frame_consistency(pet_images_with_frame_mismatch, manifest_file=manifest_file) == first
+    assert checked == []
+
+    # fixing the mismatched image only re-checks that image
+    fixed = write_pet_nifti(pet_images_with_frame_mismatch / "sub-01" / "ses-second" / "pet" / "sub-01_ses-second_pet.nii", 21)
+    assert check_nifti_json_frame_consistency(pet_images_with_frame_mismatch, manifest_file=manifest_file) == {"01": {"errors": [], "files": {}}}
+    assert checked == [str(fixed)]
+
+def test_check_nifti_json_frame_consistency_reads_sidecars(pet_images_with_frame_mismatch):
+    from_entities = check_nifti_json_frame_consistency(pet_images_with_frame_mismatch)
+    assert check_nifti_json_frame_consistency(pet_images_with_frame_mismatch, read_sidecar=True) == from_entities
+
+    # a layout without indexed metadata falls back to reading the sidecars
+    layout = get_layout(pet_images_with_frame_mismatch, index_metadata=False)
+    assert "FrameDuration" not in layout.get(suffix="pet", extension="nii")[0].entities
+    assert check_nifti_json_frame_consistency(layout) == from_entities
+
+def test_iter_anat_and_pet(anat_in_each_session_folder_multi_run):
+    pairs = iter_anat_and_pet(anat_in_each_session_folder_multi_run)
+    subject, pet_image, anat_image = next(pairs)
+    assert subject == "01" and pet_image.endswith("_pet.nii.gz") and anat_image.endswith("_T1w.nii.gz")
+    mapping = collect_anat_and_pet(anat_in_each_session_folder_multi_run)
+    assert [(subject, pet_image, anat_image)] + list(pairs) == [
+        (subject, pet, anat) for subject, pets in mapping.items() for pet, anat in pets.items()
+    ]
+
+
+@pytest.mark.parametrize("n_jobs", [1, 2])
+def test_iter_frame_consistency(pet_images_with_frame_mismatch, n_jobs):
+    results = list(iter_frame_consistency(pet_images_with_frame_mismatch, n_jobs=n_jobs))
+    assert [(result.subject, pathlib.Path(result.pet_path).name, result.nii_frames, result.n_start, result.n_duration) for result in results] == [
+        ("01", "sub-01_ses-baseline_pet.nii.gz", 21, 21, 21),
+        ("01", "sub-01_ses-second_pet.nii", 20, 21, 21),
+    ]
+    assert results[1].json_path.endswith("sub-01_ses-second_pet.json")
+    assert results[0].consistent and len(results[1].errors) == 2
+
+
+def test_check_nifti_json_frame_consistency_keeps_errors_of_every_file(pet_images_with_frame_mismatch):
+    # make the baseline image inconsistent as well, its errors used to be overwritten by the second session's
+    write_pet_nifti(pet_images_with_frame_mismatch / "sub-01" / "ses-baseline" / "pet" / "sub-01_ses-baseline_pet.nii.gz", 19)
+    inconsistent = check_nifti_json_frame_consistency(pet_images_with_frame_mismatch)
+    assert len(inconsistent["01"]["files"]) == 2
+    assert len(inconsistent["01"]["errors"]) == 4
+
+def test_get_versions_reads_checkout_pyproject_without_walking(monkeypatch):
+    def no_walk(*args, **kwargs):
+        raise AssertionError("get_versions should not walk the file system")
+    monkeypatch.setattr(petutils.os, "walk", no_walk)
+    petutils._lookup_versions.cache_clear()
+    versions = get_versions()
+    assert versions["ingest_pet_version"] == "0.0.2"
+    assert versions["bids_version"] == petutils.DEFAULT_BIDS_VERSION
+    assert get_versions() == versions
+    assert petutils._lookup_versions.cache_info().hits == 1
+
+def test_get_versions_prefers_installed_metadata(monkeypatch):
+    monkeypatch.setattr(importlib.metadata, "version", lambda name: "9.9.9")
+    petutils._lookup_versions.cache_clear()
+    try:
+        assert get_versions()["ingest_pet_version"] == "9.9.9"
+    finally:
+        petutils._lookup_versions.cache_clear()
+
+def test_read_pyproject_versions(tmp_path):
+    toml_file = tmp_path / "pyproject.toml"
+    toml_file.write_text('[project]\nname = "petutils"\nversion = "1.2.3"\n\n[tool.bids]\nbids_version = "1.9.0"\n')
+    assert petutils._read_pyproject_versions(toml_file) == ("1.2.3", "1.9.0")
+    toml_file.write_text('[project]\nname = "other"\nversion = "1.2.3"\n')
+    assert petutils._read_pyproject_versions(toml_file) == (None, None)
+
+def test_write_out_dataset_description_json(tmp_path):
+    written = write_out_dataset_description_json(project_dir / "data", tmp_path / "derivatives" / "pipeline")
+    assert written == tmp_path / "derivatives" / "pipeline" / "dataset_description.json"
+    description = json.loads(written.read_text())
+    assert description["BIDSVersion"] == get_versions()["bids_version"]
+    assert description["GeneratedBy"][0]["Version"] == get_versions()["ingest_pet_version"]
+    assert json.loads((project_dir / "data" / "dataset_description.json").read_text())["Name"] in description["Name"]
+    assert [path.name for path in written.parent.iterdir()] == ["dataset_description.json"]
+
+def test_write_out_dataset_description_jsons(tmp_path, monkeypatch):
+    source = tmp_path / "source"
+    source.mkdir()
+    (source / "dataset_description.json").write_text(json.dumps({"Name": "first"}))
+    unnamed = tmp_path / "unnamed"
+    unnamed.mkdir()
+
+    opened = []
+    monkeypatch.setattr(petutils, "_load_source_description", petutils.functools.lru_cache()(
+        lambda *key: opened.append(key) or json.loads(pathlib.Path(key[0]).read_text())))
+    derivatives = [(source, tmp_path / "derivatives" / f"pipeline-{i}") for i in range(5)] + [(unnamed, None)]
+    written = petutils.write_out_dataset_description_jsons(derivatives)
+
+    assert len(written) == 6
+    assert written[-1] == unnamed / "derivatives" / "petdeface" / "dataset_description.json"
+    assert len(opened) == 1
+    assert all("`first`" in json.loads(path.read_text())["Name"] for path in written[:5])
+    assert "`Unknown`" in json.loads(written[-1].read_text())["Name"]
+
+    # an edited source description is picked up by the next call
+    (source / "dataset_description.json").write_text(json.dumps({"Name": "second, renamed"}))
+    written = petutils.write_out_dataset_description_jsons(derivatives[:1])
+    assert "`second, renamed`" in json.loads(written[0].read_text())["Name"]
+
+
+@pytest.mark.parametrize("damage", ["rgb24", "truncated"])
+def test_frame_check_only_needs_the_header(tmp_path, damage):
+    import struct
+    from petutils.synthetic import frame_timing
+    pet_file = write_pet_nifti(tmp_path / "sub-01_pet.nii", 5)
+    starts, durations = frame_timing(5)
+    (tmp_path / "sub-01_pet.json").write_text(json.dumps({"FrameTimesStart": starts, "FrameDuration": durations}))
+    contents = pet_file.read_bytes()
+    if damage == "rgb24":
+        # datatype and bitpix, a datatype MappedNifti can't map
+        contents = contents[:70] + struct.pack("<hh", 128, 24) + contents[74:]
+    else:
+        contents = contents[:len(contents) - 16]
+    pet_file.write_bytes(contents)
+
+    result = petutils._check_pet_frame_timing("01", str(pet_file), None, None, header_only=True)
+    assert result.nii_frames == 5 and result.consistent
@@ -0,0 +1,29 @@
+import csv
+import pickle
+from petutils.results import FrameConsistencyResult, FrameConsistencyTable
+from petutils.petutils import iter_frame_consistency
+
+
+def test_frame_consistency_result():
+    result = FrameConsistencyResult("01", "sub-01_pet.nii", "sub-01_pet.json", 20, 21, 21)
+    assert not result.consistent
+    assert len(result.errors) == 2
+    assert pickle.loads(pickle.dumps(result)) == result
+    assert FrameConsistencyResult.from_dict(result.to_dict()) == result
+
+
+def test_frame_consistency_table(pet_images_with_frame_mismatch, tmp_path):
+    table = FrameConsistencyTable.from_results(iter_frame_consistency(pet_images_with_frame_mismatch))
+    assert len(table) == 2
+    assert table.header_mismatch.tolist() == [False, True]
+    assert not table.start_duration_mismatch.any()
+
+    inconsistent = table.inconsistent()
+    assert inconsistent["nii_frames"].tolist() == [20]
+    assert [result.pet_path for result in inconsistent] == [table["pet_path"][1]]
+    assert len(table.filter(table["subject"] == "02")) == 0
+
+    inconsistent.to_csv(tmp_path / "inconsistent.tsv", delimiter="\t")
+    with open(tmp_path / "inconsistent.tsv", newline="") as f:
+        rows = list(csv.DictReader(f, delimiter="\t"))
+    assert [(row["subject"], row["nii_frames"], row["n_start"]) for row in rows] == [("01", "20", "21")]
@@ -0,0 +1,36 @@
+import pytest
+from petutils.scanner import BIDSScanner, parse_bids_filename
+from petutils.petutils import collect_anat_and_pet, check_nifti_json_frame_consistency
+
+
+def test_parse_bids_filename():
+    assert parse_bids_filename("sub-01_ses-baseline_trc-DASB_run-02_pet.nii.gz") == {
+        "subject": "01", "session": "baseline", "tracer": "DASB", "run": "02", "suffix": "pet", "extension": ".nii.gz",
+    }
+    assert parse_bids_filename("sub-01_T1w.json") == {"subject": "01", "suffix": "T1w", "extension": ".json"}
+    assert parse_bids_filename("dataset_description.json") is None
+
+
+def test_scanner_get(anat_in_first_session_folder_multi_sessions_multi_run):
+    scanner = BIDSScanner(anat_in_first_session_folder_multi_sessions_multi_run)
+    assert scanner.get_subjects() == ["01"]
+    pet_images = scanner.get(subject="01", suffix="pet", extension=["nii", "nii.gz"])
+    assert [(record.session, record.entities["run"]) for record in pet_images] == [
+        ("baseline", "01"), ("baseline", "02"), ("second", "01"), ("second", "02"),
+    ]
+    assert len(scanner.get(suffix=["T1w", "T2w"], extension=".json")) == 1
+
+
+@pytest.mark.parametrize("dataset", [
+    "anat_in_no_session_folder_multi_run",
+    "anat_in_first_session_folder_multi_sessions_multi_run",
+    "anat_in_each_session_folder_multi_run",
+])
+@pytest.mark.parametrize("matcher", ["entities", "difflib"])
+def test_collect_anat_and_pet_with_scanner(request, dataset, matcher):
+    dataset = request.getfixturevalue(dataset)
+    assert collect_anat_and_pet(BIDSScanner(dataset), matcher=matcher) == collect_anat_and_pet(dataset, matcher=matcher)
+
+
+def test_check_nifti_json_frame_consistency_with_scanner(pet_images_with_frame_mismatch):
+    assert check_nifti_json_frame_consistency(BIDSScanner(pet_images_with_frame_mismatch)) == check_nifti_json_frame_consistency(pet_images_with_frame_mismatch)
@@ -0,0 +1,84 @@
+import sys
+import json
+import pathlib
+import subprocess
+import pytest
+from petutils.sharding import shard_of, parse_shard, select_shard, write_partial, read_partials, merge_partials, ShardMergeError
+from petutils.petutils import collect_anat_and_pet, check_nifti_json_frame_consistency, iter_frame_consistency
+from petutils.scanner import BIDSScanner
+from petutils.synthetic import generate_dataset, write_nifti
+
+project_dir = pathlib.Path(__file__).parent.parent.absolute()
+
+
+@pytest.fixture
+def sharded_dataset(tmp_path):
+    dataset = generate_dataset(tmp_path / "dataset", n_subjects=7, n_sessions=2, n_frames=4)
+    # make two subjects inconsistent with their sidecars
+    for subject in ("002", "006"):
+        write_nifti(dataset / f"sub-{subject}" / "ses-02" / "pet" / f"sub-{subject}_ses-02_pet.nii.gz", (2, 2, 2, 3))
+    return dataset
+
+
+def test_shards_are_stable_and_partition_subjects():
+    subjects = [f"{i:03d}" for i in range(200)]
+    shards = [select_shard(subjects, (index, 4)) for index in range(4)]
+    assert sorted(subject for shard in shards for subject in shard) == subjects
+    assert all(shard for shard in shards)
+    assert shard_of("001", 4) == shard_of("001", 4)
+    assert select_shard(subjects, None) == subjects
+
+
+@pytest.mark.parametrize("shard", ["1", "2/2", "-1/3", "a/b", "0/0"])
+def test_parse_shard_rejects(shard):
+    with pytest.raises(ValueError):
+        parse_shard(shard)
+
+
+def test_functions_on_shards_add_up(sharded_dataset):
+    scanner = BIDSScanner(sharded_dataset)
+    mapping = collect_anat_and_pet(scanner)
+    inconsistent = check_nifti_json_frame_consistency(scanner, read_sidecar=True)
+
+    sharded_mapping, sharded_inconsistent = {}, {}
+    for index in range(3):
+        sharded_mapping.update(collect_anat_and_pet(scanner, shard=(index, 3)))
+        sharded_inconsistent.update(check_nifti_json_frame_consistency(scanner, read_sidecar=True, shard=(index, 3)))
+    assert sharded_mapping == mapping
+    assert sharded_inconsistent == inconsistent
+    assert len([s for s in inconsistent.values() if s["files"]]) == 2
+
+
+def test_merge_partials(sharded_dataset, tmp_path):
+    scanner = BIDSScanner(sharded_dataset)
+    partials = []
+    for index in range(3):
+        subjects = select_shard(scanner.get_subjects(), (index, 3))
+        results = list(iter_frame_consistency(scanner, read_sidecar=True, shard=(index, 3)))
+        partials.append(tmp_path / f"partial-{index}.json")
+        write_partial(partials[-1], "frame_consistency", (index, 3), subjects, results)
+
+    results, inconsistent = merge_partials(partials)
+    assert results == list(iter_frame_consistency(scanner, read_sidecar=True))
+    assert inconsistent == check_nifti_json_frame_consistency(scanner, read_sidecar=True)
+
+    with pytest.raises(ShardMergeError, match="missing \\[1\\]"):
+        read_partials([partials[0], partials[2]])
+    with pytest.raises(ShardMergeError, match="duplicated \\[0\\]"):
+        read_partials([partials[0], partials[0], partials[1], partials[2]])
+
+
+@pytest.mark.parametrize("command", ["validate-frames", "map-anat"])
+def test_cli_shards_in_separate_processes(sharded_dataset, tmp_path, command):
+    run = [sys.executable, "-m", "petutils", command, str(sharded_dataset), "--scanner"]
+    partials = [tmp_path / f"{command}-{index}.json" for index in range(3)]
+    processes = [subprocess.Popen(run + ["--shard", f"{index}/3", "-o", str(partial)], cwd=project_dir)
+                 for index, partial in enumerate(partials)]
+    assert all(process.wait() in (0, 1) for process in processes)
+
+    unsharded = subprocess.run(run, cwd=project_dir, capture_output=True, text=True)
+    merged = subprocess.run([sys.executable, "-m", "petutils", "merge", *map(str, partials)], cwd=project_dir,
+                            capture_output=True, text=True)
+    assert merged.returncode == unsharded.returncode == (1 if command == "validate-frames" else 0)
+    assert json.loads(merged.stdout) == json.loads(unsharded.stdout)
+    assert json.loads(merged.stdout)
@@ -0,0 +1,39 @@
+import nibabel
+from petutils.synthetic import generate_dataset, frame_timing, write_nifti
+from petutils.scanner import BIDSScanner
+from petutils.petutils import collect_anat_and_pet, check_nifti_json_frame_consistency
+from petutils.nifti import read_nifti_header
+
+
+def test_frame_timing_is_contiguous():
+    starts, durations = frame_timing(25)
+    assert len(starts) == len(durations) == 25
+    assert all(start + duration == following for start, duration, following in zip(starts, durations, starts[1:]))
+
+
+def test_write_nifti_has_a_real_header(tmp_path):
+    nifti_file = write_nifti(tmp_path / "image.nii", (3, 4, 5, 6), frame_duration=2.0, chunk_size=7)
+    assert nifti_file.stat().st_size == 352 + 3 * 4 * 5 * 6 * 4
+    image = nibabel.load(nifti_file)
+    assert image.shape == (3, 4, 5, 6)
+    assert not image.get_fdata().any()
+    assert read_nifti_header(nifti_file)["pixdim"][4] == 2.0
+
+
+def test_generate_dataset(tmp_path):
+    dataset = generate_dataset(tmp_path / "dataset", n_subjects=3, n_sessions=2, n_runs=2, n_frames=5)
+    scanner = BIDSScanner(dataset)
+    assert scanner.get_subjects() == ["001", "002", "003"]
+    assert len(scanner.get(suffix="pet", extension=".nii.gz")) == 3 * 2 * 2
+    assert len(scanner.get(suffix="T1w", extension=".nii.gz")) == 3 * 2
+
+    mapping = collect_anat_and_pet(scanner)
+    assert all(anat for pairs in mapping.values() for anat in pairs.values())
+    inconsistent = check_nifti_json_frame_consistency(scanner, read_sidecar=True, deep=True)
+    assert all(not found["errors"] for found in inconsistent.values())
+
+
+def test_generate_dataset_without_sessions_or_runs(tmp_path):
+    dataset = generate_dataset(tmp_path / "dataset", n_subjects=1, compress=False, with_anat=False)
+    assert (dataset / "sub-001" / "pet" / "sub-001_pet.nii").is_file()
+    assert not (dataset / "sub-001" / "anat").exists()
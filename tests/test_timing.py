@@ -0,0 +1,98 @@
+import pytest
+import json
+import pathlib
+from petutils.timing import validate_frame_timing, validate_frame_timing_batch, header_frame_duration
+from petutils.nifti import read_nifti_header
+from petutils.petutils import check_nifti_json_frame_consistency
+from tests.conftest import write_pet_nifti
+
+data_dir = pathlib.Path(__file__).parent.parent / "data"
+
+
+def test_validate_frame_timing_of_example_sidecar():
+    with open(data_dir / "sub-01" / "ses-baseline" / "pet" / "sub-01_ses-baseline_pet.json") as f:
+        sidecar = json.load(f)
+    assert validate_frame_timing(sidecar["FrameTimesStart"], sidecar["FrameDuration"], header_duration=1.0) == {}
+
+
+def test_validate_frame_timing_batch():
+    issues = validate_frame_timing_batch(
+        [[0, 10, 20, 30], [0, 5, 20], [0, 10], [0, 10, 5]],
+        [[10, 10, 10, 10], [10, 10, 0], [10], [10, 10, 10]],
+        [10.0, None, None, 2.0],
+    )
+    assert issues == [
+        {},
+        {"non_positive_duration": [2], "overlap": [0], "gap": [1]},
+        {},
+        {"not_increasing": [1], "overlap": [1], "header_duration_mismatch": [0, 1, 2]},
+    ]
+
+
+def test_header_frame_duration(tmp_path):
+    header = read_nifti_header(write_pet_nifti(tmp_path / "sub-01_pet.nii", 3, frame_duration=2.5))
+    assert header_frame_duration(header) == 2.5
+
+
+def test_check_nifti_json_frame_consistency_deep(pet_images_with_frame_mismatch):
+    sidecar_file = pet_images_with_frame_mismatch / "sub-01" / "ses-baseline" / "pet" / "sub-01_ses-baseline_pet.json"
+    assert check_nifti_json_frame_consistency(pet_images_with_frame_mismatch, subjects=["01", "02"], deep=True)["01"]["files"].keys() == {
+        str(pet_images_with_frame_mismatch / "sub-01" / "ses-second" / "pet" / "sub-01_ses-second_pet.nii")
+    }
+
+    with open(sidecar_file) as f:
+        sidecar = json.load(f)
+    sidecar["FrameTimesStart"][3] = sidecar["FrameTimesStart"][2]
+    with open(sidecar_file, "w") as f:
+        json.dump(sidecar, f)
+
+    inconsistent = check_nifti_json_frame_consistency(pet_images_with_frame_mismatch, read_sidecar=True, deep=True)
+    assert str(sidecar_file).replace(".json", ".nii.gz") in inconsistent["01"]["files"]
+    assert any("not_increasing at frames [2]" in error for error in inconsistent["01"]["errors"])
+
+
+@pytest.mark.parametrize("n_jobs", [1, 2])
+def test_dataset_check_validates_timing_in_batches(tmp_path, monkeypatch, n_jobs):
+    import asyncio
+    from petutils import petutils, instrumentation
+    from petutils.aio import check_nifti_json_frame_consistency_async
+    from petutils.petutils import iter_frame_consistency, _check_pet_frame_timing
+    from petutils.synthetic import generate_dataset
+    dataset = generate_dataset(tmp_path / "dataset", n_subjects=5, n_frames=6)
+    broken_sidecar = next(dataset.glob("sub-003/**/*_pet.json"))
+    sidecar = json.loads(broken_sidecar.read_text())
+    sidecar["FrameDuration"][4] += 10
+    broken_sidecar.write_text(json.dumps(sidecar))
+
+    monkeypatch.setattr(petutils, "TIMING_BATCH_SIZE", 2)
+    with instrumentation.recording() as recorder:
+        results = list(iter_frame_consistency(dataset, n_jobs=n_jobs, read_sidecar=True, deep=True))
+    assert [event["images"] for event in recorder.events if event["stage"] == "timing_batch"] == [2, 2, 1]
+    # the same issues as validating each image on its own
+    assert results == [_check_pet_frame_timing(r.subject, r.pet_path, None, None, deep=True) for r in results]
+    assert [r.subject for r in results if r.timing_issues] == ["003"]
+
+    inconsistent = asyncio.run(check_nifti_json_frame_consistency_async(dataset, read_sidecar=True, deep=True, concurrency=2))
+    assert list(inconsistent["003"]["files"]) == [str(broken_sidecar).replace(".json", ".nii.gz")]
+
+
+def test_timing_batch_size_bounds_result_latency(tmp_path):
+    import asyncio
+    from petutils import instrumentation
+    from petutils.aio import aiter_frame_consistency
+    from petutils.petutils import iter_frame_consistency
+    from petutils.synthetic import generate_dataset
+    dataset = generate_dataset(tmp_path / "dataset", n_subjects=4, n_frames=6)
+
+    with instrumentation.recording() as recorder:
+        results = iter_frame_consistency(dataset, read_sidecar=True, deep=True, timing_batch_size=1)
+        assert next(results).consistent
+        # the first result comes out before the other images have been checked
+        assert [event["images"] for event in recorder.events if event["stage"] == "timing_batch"] == [1]
+        results.close()
+
+    async def batches():
+        with instrumentation.recording() as recorder:
+            results = [result async for result in aiter_frame_consistency(dataset, read_sidecar=True, deep=True, timing_batch_size=3)]
+        return len(results), [event["images"] for event in recorder.events if event["stage"] == "timing_batch"]
+    assert asyncio.run(batches()) == (4, [3, 1])
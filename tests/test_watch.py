@@ -0,0 +1,139 @@
+import json
+import os
+from petutils.synthetic import generate_dataset, frame_timing, write_nifti
+from petutils.watch import DatasetWatcher
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def add_scan(dataset, subject, session, n_frames=5, sidecar_frames=None):
+    pet_folder = dataset / f"sub-{subject}" / f"ses-{session}" / "pet"
+    pet_folder.mkdir(parents=True, exist_ok=True)
+    stem = pet_folder / f"sub-{subject}_ses-{session}_pet"
+    starts, durations = frame_timing(n_frames if sidecar_frames is None else sidecar_frames)
+    with open(f"{stem}.json", "w") as f:
+        json.dump({"FrameTimesStart": starts, "FrameDuration": durations}, f)
+    write_nifti(f"{stem}.nii", (2, 2, 2, n_frames))
+    return f"{stem}.nii"
+
+
+def test_existing_files_are_only_indexed(tmp_path):
+    dataset = generate_dataset(tmp_path / "dataset", n_subjects=2, compress=False)
+    watcher = DatasetWatcher(dataset, debounce=0)
+    assert len(watcher.known) == 4
+    assert watcher.step(block=True) == []
+    assert len(list(dataset.rglob("*_pet.nii"))) == 2
+    watcher.close()
+
+
+def test_process_existing(tmp_path):
+    dataset = generate_dataset(tmp_path / "dataset", n_subjects=2, compress=False)
+    watcher = DatasetWatcher(dataset, debounce=0, jobs=2, process_existing=True)
+    events = watcher.step(block=True)
+    watcher.close()
+    assert len(events) == 2
+    assert all(event["compressed"] and event["result"].consistent for event in events)
+    assert all(event["pet_path"].endswith("_pet.nii.gz") for event in events)
+    assert list(dataset.rglob("*_pet.nii")) == []
+
+
+def test_new_scans_are_debounced_and_processed_once(tmp_path):
+    dataset = generate_dataset(tmp_path / "dataset", n_subjects=1)
+    clock = FakeClock()
+    seen = []
+    watcher = DatasetWatcher(dataset, debounce=2, clock=clock, on_event=seen.append)
+
+    new_scan = add_scan(dataset, "001", "02")
+    assert watcher.step(block=True) == []
+    clock.now = 1
+    assert watcher.step(block=True) == []
+
+    # still being written, the wait starts over
+    with open(new_scan, "ab") as f:
+        f.write(b"\0" * 4 * 8)
+    clock.now = 2.5
+    assert watcher.step(block=True) == []
+
+    clock.now = 5
+    events = watcher.step(block=True)
+    assert [event["pet_path"] for event in events] == [new_scan + ".gz"]
+    assert events[0]["result"].consistent
+    assert seen == events
+
+    # compressing the image isn't picked up as a new file
+    clock.now = 10
+    assert watcher.step(block=True) == []
+    watcher.close()
+
+
+def test_modified_sidecar_revalidates_its_image(tmp_path):
+    dataset = generate_dataset(tmp_path / "dataset", n_subjects=1)
+    watcher = DatasetWatcher(dataset, debounce=0)
+    sidecar = next(dataset.rglob("*_pet.json"))
+    starts, durations = frame_timing(3)
+    with open(sidecar, "w") as f:
+        json.dump({"FrameTimesStart": starts, "FrameDuration": durations}, f)
+
+    events = watcher.step(block=True)
+    watcher.close()
+    assert len(events) == 1
+    assert not events[0]["compressed"]
+    assert not events[0]["result"].consistent
+    assert events[0]["pet_path"] == str(sidecar).replace(".json", ".nii.gz")
+
+
+def test_sidecar_waits_for_its_image(tmp_path):
+    dataset = generate_dataset(tmp_path / "dataset", n_subjects=1, n_frames=5)
+    watcher = DatasetWatcher(dataset, debounce=0, compress=False)
+    new_scan = add_scan(dataset, "001", "02", sidecar_frames=4)
+    os.remove(new_scan)
+    assert watcher.step(block=True) == []
+
+    write_nifti(new_scan, (2, 2, 2, 5))
+    events = watcher.step(block=True)
+    watcher.close()
+    assert [event["pet_path"] for event in events] == [new_scan]
+    assert not events[0]["result"].consistent
+
+
+def test_errors_are_reported(tmp_path):
+    dataset = generate_dataset(tmp_path / "dataset", n_subjects=1)
+    watcher = DatasetWatcher(dataset, debounce=0, compress=False)
+    new_scan = add_scan(dataset, "001", "02")
+    with open(new_scan, "wb") as f:
+        f.write(b"not a nifti")
+    events = watcher.step(block=True)
+    watcher.close()
+    assert events[0]["result"] is None
+    assert events[0]["error"].startswith("NiftiHeaderError")
+
+
+def test_changes_during_processing_are_picked_up(tmp_path, monkeypatch):
+    from petutils import watch
+    dataset = generate_dataset(tmp_path / "dataset", n_subjects=1)
+    watcher = DatasetWatcher(dataset, debounce=0)
+    new_scan = add_scan(dataset, "001", "02")
+    sidecar = new_scan.replace(".nii", ".json")
+
+    check_pet_frame_timing = watch._check_pet_frame_timing
+    def check_then_rewrite_sidecar(*args, **kwargs):
+        result = check_pet_frame_timing(*args, **kwargs)
+        if result.consistent:
+            # a corrected sidecar lands after the worker read the old one
+            starts, durations = frame_timing(3)
+            with open(sidecar, "w") as f:
+                json.dump({"FrameTimesStart": starts, "FrameDuration": durations}, f)
+        return result
+    monkeypatch.setattr(watch, "_check_pet_frame_timing", check_then_rewrite_sidecar)
+
+    events = watcher.step(block=True)
+    assert [event["result"].consistent for event in events] == [True]
+    events = watcher.step(block=True)
+    watcher.close()
+    assert [(event["pet_path"], event["result"].consistent) for event in events] == [(new_scan + ".gz", False)]